@@ -1,86 +1,74 @@
 # main.py
-import pandas as pd
-from dataPreprocessing import load_data, check_missing_values, detect_outliers, clean_data, remove_duplicates, consistency_in_dates_price, consistency_in_dates_sentiment, check_data_types_price,check_data_types_sentiment
-import firebase_admin
-from firebase_admin import credentials, firestore
-
-cred = credentials.Certificate("../firebase.json")
-firebase_admin.initialize_app(cred)
-
-db = firestore.client()
-
-file_path = "sentiment.csv"
-
-data = load_data(file_path)
-
-missing_values = check_missing_values(data)
-
-outliers = detect_outliers(data)
-
-data_clean = clean_data(data, outliers)
-
-data_cleaned = remove_duplicates(data_clean)
-
-
-inconsistencies = check_data_types_sentiment(data_cleaned)
-
-
-print("Processed Data of sentiment analysis:")
-data_cleaned  = data_cleaned.drop(columns=['URL'])
-print("Column Names:")
-print(data_cleaned.columns.tolist())
-print(data_cleaned.head())
-sentiment_data=data_cleaned
-
-####################################################################################################################################
-
-file_path = "price.csv"
-
-data = load_data(file_path)
-columns_to_keep = ['Date', 'Adj Close']
-data = data[columns_to_keep]
-
-missing_values = check_missing_values(data)
-
-outliers = detect_outliers(data)
-
-data_clean = clean_data(data, outliers)
-
-data_cleaned = remove_duplicates(data_clean)
-
-inconsistencies = check_data_types_price(data_cleaned)
-
-print("Processed Data of price analysis:")
-print(data_cleaned.head())
-price_data=data_cleaned
-
-####################################################################################################################################
-
-# collection_ref_price = db.collection("price_data")
-# for index, row in price_data.iterrows():
-
-#     doc_ref = collection_ref_price.document(str(row['Date']))  
-#     doc_ref.set({
-#         "Date": row['Date'],
-#         "Adj Close": row['Adj Close'],
-        
-#     })
-
-# print("Data upload complete.")
-collection_ref_sentiment = db.collection("sentiment_data")
-for index, row in sentiment_data.iterrows():
-
-    doc_ref = collection_ref_sentiment.document(str(row['Dates']))  
-    doc_ref.set({
-        "Date": row['Dates'],  # Mapping Dates to Date field
-        "News":row['News'],
-        "Price Direction Up": row['Price Direction Up'],  # Mapping Price Direction Up
-        "Price Direction Constant": row['Price Direction Constant'],  # Mapping Price Direction Constant
-        "Price Direction Down": row['Price Direction Down'],  # Mapping Price Direction Down
-        "Asset Comparison": row['Asset Comparision'],  # Mapping Asset Comparison (corrected typo)
-        "Past Information": row['Past Information'],  # Mapping Past Information
-        "Future Information": row['Future Information'],  # Mapping Future Information
-        "Price Sentiment": row['Price Sentiment']  # Mapping Price Sentiment  
-    })
-
-print("Data upload complete.")
\ No newline at end of file
+"""Upload CSV history into Firestore through the same path as POST /upload.
+
+    python Data/app.py                      # Data/sentiment.csv and Data/price.csv
+    python Data/app.py --kind price prices-2020.csv
+
+Each file is streamed in chunks, validated and written while the rest is
+read. Progress is saved after every chunk under the upload's ID (the kind
+and file name unless --upload-id is given), so running the same command
+again after an interruption resumes after the last stored chunk.
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def guess_kind(path):
+    name = os.path.basename(path).lower()
+    for kind in ('sentiment', 'price'):
+        if kind in name:
+            return kind
+    raise SystemExit(f"Cannot tell whether {path} holds price or sentiment rows; pass --kind")
+
+
+def file_blocks(path, block_size):
+    with open(path, 'rb') as f:
+        yield from iter(lambda: f.read(block_size), b'')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload price or sentiment CSV history in resumable chunks.")
+    parser.add_argument('files', nargs='*', help="CSV files (default: Data/sentiment.csv and Data/price.csv)")
+    parser.add_argument('--kind', choices=['price', 'sentiment'], default=None,
+                        help="what the files hold (default: guessed from each file name)")
+    parser.add_argument('--upload-id', default=None, help="resume key (only with a single file)")
+    parser.add_argument('--restart', action='store_true', help="ignore saved progress and start over")
+    args = parser.parse_args()
+
+    files = [os.path.abspath(f) for f in args.files] or [
+        os.path.join(ROOT, 'Data', 'sentiment.csv'), os.path.join(ROOT, 'Data', 'price.csv')]
+    if args.upload_id and len(files) > 1:
+        parser.error("--upload-id needs a single file")
+
+    # The app's credentials and state paths are relative to the repository root.
+    os.chdir(ROOT)
+    import app as server
+    from Data.csv_upload import BLOCK_SIZE
+
+    for path in files:
+        kind = args.kind or guess_kind(path)
+        upload_id = args.upload_id or re.sub(r'[^A-Za-z0-9_.-]', '_', f"{kind}-{os.path.basename(path)}")
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+
+        def progress(state):
+            print(f"{upload_id}: chunk {state['chunks']}, {state['offset'] / max(size, 1):.0%} of {size} bytes, "
+                  f"{state['written']} written, {state['rejected']} rejected")
+
+        state = server.upload_csv(kind, upload_id, file_blocks(path, BLOCK_SIZE), args.restart, progress)
+        print(f"{upload_id}: {state['rows']} rows, {state['written']} written, {state['rejected']} rejected "
+              f"{state['problems']} in {time.perf_counter() - start:.1f}s")
+
+    if server.dedup_index.path:
+        server.dedup_index.save()
+    print("Data upload complete.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import logging
+import os
+from datetime import datetime
+
+import pandas as pd
+
+from Data.columnar import read_columns, write_columns
+from Data.firestore_bulk import UPDATED_AT_FIELD
+
+logger = logging.getLogger(__name__)
+
+ID_COLUMN = "_id"
+
+
+class CollectionCache:
+    """Local columnar copy of a Firestore collection, synced incrementally.
+
+    The first sync streams the whole collection. After that only documents
+    whose updated_at (stamped by BulkWriter) is at or after the stored
+    high-water mark are fetched and merged over the cached rows by document
+    ID. Documents written without that field are only seen by a cold sync;
+    delete the cache directory to force one.
+    """
+
+    def __init__(self, client, collection, cache_dir, updated_field=UPDATED_AT_FIELD):
+        self.client = client
+        self.collection = collection
+        self.path = os.path.join(cache_dir, collection)
+        self.updated_field = updated_field
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _fetch(self, since):
+        query = self.client.collection(self.collection)
+        if since is not None:
+            # >= rather than > so writes sharing the mark are not missed;
+            # re-fetched documents just overwrite themselves.
+            query = query.where(self.updated_field, ">=", since)
+        rows = []
+        for doc in query.stream():
+            row = doc.to_dict()
+            row[ID_COLUMN] = doc.id
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def sync(self):
+        cached, meta = read_columns(self.path)
+        since = None
+        if cached is not None and meta.get("high_water_mark"):
+            since = datetime.fromisoformat(meta["high_water_mark"])
+
+        new = self._fetch(since)
+        logger.info(f"Fetched {len(new)} {'changed' if since else ''} documents from {self.collection}")
+
+        if cached is not None and new.empty:
+            return cached.drop(columns=[ID_COLUMN, self.updated_field], errors="ignore")
+
+        if self.updated_field in new.columns:
+            new[self.updated_field] = pd.to_datetime(new[self.updated_field], utc=True)
+        if cached is None or since is None:
+            merged = new
+        else:
+            if self.updated_field in cached.columns:
+                cached = cached.assign(**{self.updated_field: pd.to_datetime(cached[self.updated_field], utc=True)})
+            merged = pd.concat([cached, new], ignore_index=True)
+            merged = merged.drop_duplicates(ID_COLUMN, keep="last").reset_index(drop=True)
+
+        high_water_mark = meta.get("high_water_mark") if meta else None
+        if self.updated_field in merged.columns and merged[self.updated_field].notna().any():
+            high_water_mark = merged[self.updated_field].max().isoformat()
+
+        write_columns(self.path, merged, {"high_water_mark": high_water_mark, "collection": self.collection})
+        return merged.drop(columns=[ID_COLUMN, self.updated_field], errors="ignore")
@@ -0,0 +1,73 @@
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+MANIFEST = "manifest.json"
+
+
+def _column_array(series):
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        series = series.dt.tz_convert("UTC").dt.tz_localize(None)
+    if series.dtype.kind in "biufcmM":
+        return series.to_numpy()
+
+    values = series.to_numpy(dtype=object)
+    if all(isinstance(v, str) for v in values):
+        # Fixed-width unicode can be memory-mapped; ragged objects cannot.
+        return values.astype(str) if len(values) else np.array([], dtype="U1")
+    return values
+
+
+def write_columns(path, frame, meta=None):
+    """Store a DataFrame as one .npy file per column plus a manifest.
+
+    Files go to a fresh directory that is swapped in with a rename once
+    complete, so readers never see a half-written copy.
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    columns = []
+    for i, name in enumerate(frame.columns):
+        values = _column_array(frame[name])
+        file_name = f"col_{i}.npy"
+        np.save(os.path.join(tmp_path, file_name), values, allow_pickle=values.dtype == object)
+        columns.append({"name": name, "file": file_name, "dtype": str(values.dtype)})
+
+    with open(os.path.join(tmp_path, MANIFEST), "w") as f:
+        json.dump({"columns": columns, "rows": len(frame), "meta": meta or {}}, f)
+
+    old_path = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def read_columns(path, mmap=True):
+    """(DataFrame, meta) for a directory written by write_columns, or (None, None)."""
+    manifest = read_manifest(path)
+    if manifest is None:
+        return None, None
+
+    data = {}
+    for column in manifest["columns"]:
+        file_path = os.path.join(path, column["file"])
+        if column["dtype"] == "object":
+            data[column["name"]] = np.load(file_path, allow_pickle=True)
+        else:
+            data[column["name"]] = np.load(file_path, mmap_mode="r" if mmap else None)
+    frame = pd.DataFrame(data, copy=False)
+    return frame, manifest["meta"]
@@ -0,0 +1,228 @@
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development server only
+    fcntl = None
+
+BLOCK_SIZE = 1 << 16
+CHUNK_ROWS = 5000
+
+RUNNING = "running"
+COMPLETE = "complete"
+FAILED = "failed"
+
+_UPLOAD_ID = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+
+class UploadConflict(Exception):
+    """The upload is already running, or a resume does not match what was committed."""
+
+
+def multipart_file_blocks(stream, boundary, field_name="file", block_size=BLOCK_SIZE):
+    """Yield the bytes of one file field of a multipart/form-data body as they arrive."""
+    from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+    decoder = MultipartDecoder(boundary)
+    in_file = False
+    while True:
+        block = stream.read(block_size)
+        decoder.receive_data(block or None)
+        event = decoder.next_event()
+        while not isinstance(event, NeedData):
+            if isinstance(event, Epilogue):
+                return
+            if isinstance(event, Data):
+                if in_file and event.data:
+                    yield event.data
+            else:
+                in_file = isinstance(event, File) and event.name == field_name
+            event = decoder.next_event()
+        if not block:
+            return
+
+
+def _records(blocks):
+    """Raw bytes of each CSV record, keeping newlines inside quoted fields."""
+    rest = b""
+    pending = []
+    open_quotes = 0
+    for block in blocks:
+        lines = (rest + block).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            open_quotes ^= line.count(b'"') & 1
+            pending.append(line)
+            if not open_quotes:
+                yield b"\n".join(pending) + b"\n"
+                pending = []
+    if pending or rest:
+        yield b"\n".join(pending + [rest])
+
+
+class CsvChunk:
+    __slots__ = ("header", "body", "rows", "start", "end", "digest")
+
+    def __init__(self, header, body, rows, start, end, digest):
+        self.header = header
+        self.body = body
+        self.rows = rows
+        self.start = start
+        self.end = end
+        self.digest = digest
+
+    def frame(self):
+        return pd.read_csv(io.BytesIO(self.header + self.body))
+
+
+def iter_csv_chunks(blocks, chunk_rows=CHUNK_ROWS, resume_offset=0, resume_digest=None):
+    """Split a CSV arriving as byte blocks into chunks of chunk_rows records.
+
+    Each chunk carries its byte range and the SHA-256 of the file up to its
+    end. When resuming, the records before resume_offset are only hashed, not
+    parsed, and must hash to resume_digest, so a different file cannot be
+    resumed by mistake.
+    """
+    records = _records(blocks)
+    header = next(records, None)
+    if header is None:
+        if resume_offset:
+            raise UploadConflict("The file is empty but part of it was already committed")
+        return
+    digest = hashlib.sha256(header)
+    offset = len(header)
+    while offset < resume_offset:
+        record = next(records, None)
+        if record is None:
+            break
+        digest.update(record)
+        offset += len(record)
+    if resume_offset and (offset != resume_offset or digest.hexdigest() != resume_digest):
+        raise UploadConflict("The file does not match the part already committed; restart the upload")
+
+    body, rows, start = [], 0, offset
+    for record in records:
+        body.append(record)
+        digest.update(record)
+        offset += len(record)
+        rows += bool(record.strip())
+        if rows == chunk_rows:
+            yield CsvChunk(header, b"".join(body), rows, start, offset, digest.hexdigest())
+            body, rows, start = [], 0, offset
+    if rows:
+        yield CsvChunk(header, b"".join(body), rows, start, offset, digest.hexdigest())
+
+
+class UploadLog:
+    """Progress of each upload, one JSON file per upload_id in directory.
+
+    The file is replaced after every committed chunk, so it always records
+    how far into the CSV the stored data reaches.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, upload_id, suffix=".json"):
+        if not _UPLOAD_ID.match(upload_id):
+            raise ValueError(f"Invalid upload ID {upload_id!r}")
+        return os.path.join(self.directory, upload_id + suffix)
+
+    def load(self, upload_id):
+        path = self._path(upload_id)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def save(self, state):
+        path = self._path(state["upload_id"])
+        os.makedirs(self.directory, exist_ok=True)
+        state["updated"] = time.time()
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+
+    @contextmanager
+    def locked(self, upload_id):
+        """Hold upload_id for this process, or raise UploadConflict if another holds it."""
+        path = self._path(upload_id, ".lock")
+        os.makedirs(self.directory, exist_ok=True)
+        lock = open(path, "a")
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    raise UploadConflict(f"Upload {upload_id} is already in progress")
+            yield
+        finally:
+            lock.close()
+
+
+def run_upload(log, upload_id, kind, blocks, prepare, write, chunk_rows=CHUNK_ROWS, restart=False, on_chunk=None):
+    """Stream a CSV into storage chunk by chunk, resuming after the last committed chunk.
+
+    prepare(frame) returns (rows to write, {problem: count} of rows
+    rejected) and runs on the caller's thread, parsing and validating the
+    next chunk while write(rows) stores the previous one on a writer
+    thread. Only one chunk is buffered ahead, so memory stays at about two
+    chunks however large the file. After each write the progress (chunks,
+    byte offset, digest and row counts) is saved to log and passed to
+    on_chunk(state). Returns the final state; on error the state is saved
+    as failed and the exception re-raised.
+    """
+    with log.locked(upload_id):
+        state = None if restart else log.load(upload_id)
+        if state is not None and state["kind"] != kind:
+            raise UploadConflict(f"Upload {upload_id} is a {state['kind']} upload, not {kind}")
+        if state is None:
+            state = {"upload_id": upload_id, "kind": kind, "chunks": 0, "offset": 0, "digest": None,
+                     "rows": 0, "written": 0, "rejected": 0, "problems": {}, "started": time.time()}
+        state.update(state=RUNNING, error=None)
+        log.save(state)
+        state_lock = threading.Lock()
+
+        def commit(chunk, rows, problems):
+            written = write(rows)
+            with state_lock:
+                state["chunks"] += 1
+                state["offset"] = chunk.end
+                state["digest"] = chunk.digest
+                state["rows"] += chunk.rows
+                state["written"] += len(rows) if written is None else written
+                state["rejected"] += chunk.rows - len(rows)
+                for problem, count in problems.items():
+                    state["problems"][problem] = state["problems"].get(problem, 0) + count
+                log.save(state)
+            if on_chunk is not None:
+                on_chunk(dict(state))
+
+        try:
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="csv-upload") as pool:
+                pending = None
+                for chunk in iter_csv_chunks(blocks, chunk_rows, state["offset"], state["digest"]):
+                    rows, problems = prepare(chunk.frame())
+                    if pending is not None:
+                        pending.result()
+                    pending = pool.submit(commit, chunk, rows, problems)
+                if pending is not None:
+                    pending.result()
+        except Exception as e:
+            with state_lock:
+                state.update(state=FAILED, error=str(e))
+                log.save(state)
+            raise
+        state["state"] = COMPLETE
+        log.save(state)
+        return state
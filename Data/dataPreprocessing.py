@@ -1,12 +1,169 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
 import pandas as pd
 from scipy import stats
 
+from Data.columnar import read_columns, write_columns
+
+CHUNK_SIZE = 50000
+
 def load_data(file_path):
+    # The whole file in memory; iterate over iter_chunks() to stream it instead.
     print(f"Loading data from {file_path}")
     data = pd.read_csv(file_path)
     print(f"Data loaded. Shape: {data.shape}")
     return data
 
+def file_hash(file_path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def compact_dtypes(file_path, usecols=None, sample_rows=1000):
+    # Only floats are narrowed: a sample cannot prove that later integers fit.
+    sample = pd.read_csv(file_path, usecols=usecols, nrows=sample_rows)
+    return {c: 'float32' for c in sample.select_dtypes(include=['float64']).columns}
+
+def _cache_path(file_path, cache_dir, usecols, dtype, chunksize):
+    options = json.dumps([sorted(usecols) if usecols else None, dtype, chunksize], sort_keys=True)
+    key = hashlib.sha256((file_hash(file_path) + options).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{os.path.basename(file_path)}-{key}")
+
+def iter_chunks(file_path, usecols=None, dtype=None, chunksize=CHUNK_SIZE, cache_dir=None):
+    """Yield the CSV in chunks, parsing only usecols with the given dtypes.
+
+    dtype='compact' narrows float columns to float32. With cache_dir the
+    chunks are also stored as a binary columnar copy keyed by the file's
+    hash, and later calls read that copy (memory-mapped) instead of parsing.
+    """
+    if dtype == 'compact':
+        dtype = compact_dtypes(file_path, usecols)
+
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = _cache_path(file_path, cache_dir, usecols, dtype, chunksize)
+        if os.path.exists(os.path.join(cache_path, 'parts.json')):
+            with open(os.path.join(cache_path, 'parts.json')) as f:
+                parts = json.load(f)
+            for part in parts:
+                yield read_columns(os.path.join(cache_path, part))[0]
+            return
+
+    tmp_path = None
+    if cache_path is not None:
+        tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+    parts = []
+    for i, chunk in enumerate(pd.read_csv(file_path, usecols=usecols, dtype=dtype, chunksize=chunksize)):
+        if tmp_path is not None:
+            part = f"part-{i:05d}"
+            write_columns(os.path.join(tmp_path, part), chunk)
+            parts.append(part)
+        yield chunk
+
+    if tmp_path is not None:
+        with open(os.path.join(tmp_path, 'parts.json'), 'w') as f:
+            json.dump(parts, f)
+        os.replace(tmp_path, cache_path)
+
+class RunningStats:
+    """Per-column count/mean/M2 merged chunk by chunk (Welford/Chan), ignoring NaN."""
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.count = np.zeros(len(self.columns))
+        self.mean = np.zeros(len(self.columns))
+        self.m2 = np.zeros(len(self.columns))
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 1:
+            values = values[None, :]
+        observed = ~np.isnan(values)
+        n = observed.sum(axis=0)
+        safe_n = np.maximum(n, 1)
+        chunk_mean = np.where(observed, values, 0).sum(axis=0) / safe_n
+        chunk_m2 = np.where(observed, (values - chunk_mean) ** 2, 0).sum(axis=0)
+
+        total = self.count + n
+        delta = chunk_mean - self.mean
+        safe_total = np.maximum(total, 1)
+        self.mean = self.mean + delta * n / safe_total
+        self.m2 = self.m2 + chunk_m2 + delta ** 2 * self.count * n / safe_total
+        self.count = total
+
+    @property
+    def std(self):
+        # Population std (ddof=0), matching scipy.stats.zscore.
+        return np.sqrt(self.m2 / np.maximum(self.count, 1))
+
+    def zscores(self, values):
+        std = self.std
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (np.asarray(values, dtype=np.float64) - self.mean) / np.where(std > 0, std, np.nan)
+
+def profile_data(file_path, usecols=None, dtype=None, chunksize=CHUNK_SIZE, cache_dir=None, z_threshold=3):
+    """Missing values, duplicate rows and z-score outliers without loading the whole file.
+
+    A single parsing pass counts missing values, hashes rows to find
+    duplicates and accumulates running statistics. Row hashes seen so far
+    are kept as one sorted uint64 array (8 bytes a row) that each chunk is
+    checked against with a binary search. Outliers need the final mean/std,
+    so rows are then scored in a second pass over the binary cache (or a
+    re-parse when no cache_dir is given).
+    """
+    print(f"Profiling {file_path} in chunks of {chunksize} rows")
+    missing = None
+    seen = np.empty(0, dtype=np.uint64)
+    duplicate_rows = []
+    running = None
+    offset = 0
+    for chunk in iter_chunks(file_path, usecols, dtype, chunksize, cache_dir):
+        if running is None:
+            numerical_cols = chunk.select_dtypes(include=['number']).columns
+            running = RunningStats(numerical_cols)
+            missing = pd.Series(0, index=chunk.columns)
+        missing += chunk.isnull().sum()
+
+        hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+        position = np.searchsorted(seen, hashes)
+        repeated = pd.Series(hashes).duplicated().to_numpy()
+        if len(seen):
+            repeated = repeated | (seen[np.minimum(position, len(seen) - 1)] == hashes)
+        duplicate_rows.append(np.flatnonzero(repeated) + offset)
+        new = np.unique(hashes[~repeated])
+        seen = np.insert(seen, np.searchsorted(seen, new), new)
+
+        running.update(chunk[running.columns].to_numpy(dtype=np.float64))
+        offset += len(chunk)
+
+    outlier_rows = []
+    if running is not None and running.columns:
+        offset = 0
+        for chunk in iter_chunks(file_path, usecols, dtype, chunksize, cache_dir):
+            z = running.zscores(chunk[running.columns].to_numpy(dtype=np.float64))
+            flagged = np.nonzero((np.abs(z) > z_threshold).any(axis=1))[0]
+            outlier_rows.extend((flagged + offset).tolist())
+            offset += len(chunk)
+
+    duplicate_rows = np.concatenate(duplicate_rows) if duplicate_rows else np.empty(0, dtype=np.int64)
+    print(f"Rows: {offset}, duplicates: {len(duplicate_rows)}, outliers: {len(outlier_rows)}")
+    return {
+        'rows': offset,
+        'missing_values': missing,
+        'duplicate_rows': duplicate_rows.astype(np.int64),
+        'outlier_rows': np.array(outlier_rows, dtype=np.int64),
+        'mean': pd.Series(running.mean if running else [], index=running.columns if running else []),
+        'std': pd.Series(running.std if running else [], index=running.columns if running else []),
+    }
+
 def check_missing_values(data):
     missing_values = data.isnull().sum()
     print("Missing values in the dataset:")
@@ -32,7 +189,10 @@ def clean_data(data, outliers):
 
 def remove_duplicates(data):
     print(f"Removing duplicates. Original data shape: {data.shape}")
-    data_cleaned = data.drop_duplicates()
+    # One 64-bit hash per row, rather than factorizing every column
+    # (including the long News text) together.
+    hashes = pd.util.hash_pandas_object(data, index=False)
+    data_cleaned = data[~hashes.duplicated().to_numpy()]
     print(f"Data after removing duplicates: {data_cleaned.shape}")
     return data_cleaned
 
@@ -0,0 +1,318 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from Data.firestore_bulk import UPDATED_AT_FIELD, fetch_changed
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+BANDS = 16
+# Estimated Jaccard similarity of character shingles above which two
+# headlines count as the same story reworded.
+NEAR_DUPLICATE_THRESHOLD = 0.7
+# Near duplicates are only looked for this many days either side, so a
+# stock phrase like "gold edges higher" on different days is kept.
+WINDOW_DAYS = 1
+HASH_PRIME = np.uint64(4294967291)  # largest prime below 2**32
+SIGNATURE_BLOCK = 1024
+
+EXACT = "exact"
+NEAR = "near"
+
+_NON_WORD = re.compile(r"[^\w]+")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_THOUSANDS = re.compile(r"(?<=\d),(?=\d{3})")
+# Words giving a headline's direction; near-duplicate wording with a
+# different direction ("index falls 2.7%" / "index rises 2.4%") is a
+# different story.
+_DIRECTIONS = (
+    ("up", re.compile(r"\b(?:ris(?:e|es|en|ing)|rose|gain\w*|up|high\w*|jump\w*|climb\w*|surg\w*|advanc\w*|"
+                      r"rall\w*|soar\w*|firm\w*|rebound\w*|recover\w*|top\w*|peak\w*|strong\w*)\b")),
+    ("down", re.compile(r"\b(?:fall\w*|fell|drop\w*|down|low\w*|slip\w*|declin\w*|retreat\w*|slid\w*|"
+                        r"plung\w*|tumbl\w*|eas(?:e|es|ed|ing)|sink\w*|sank|dip\w*|los(?:e|es|ing|s)|lost|"
+                        r"slump\w*|weak\w*|crash\w*|shed\w*|sag\w*|skid\w*)\b")),
+)
+
+
+def normalize_headline(text):
+    return _NON_WORD.sub(" ", str(text).lower()).strip()
+
+
+def headline_gist(text):
+    """64-bit hash of the numbers and direction words in a headline.
+
+    Reworded copies of a story keep these; headlines that only share
+    phrasing, like moves of different sizes or opposite directions, do not.
+    """
+    text = _THOUSANDS.sub("", str(text).lower())
+    numbers = sorted(float(n) for n in _NUMBER.findall(text))
+    directions = [name for name, pattern in _DIRECTIONS if pattern.search(text)]
+    digest = hashlib.blake2b(repr((numbers, directions)).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _exact_hash(day, text):
+    digest = hashlib.blake2b(f"{day}|{text}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _permutations(num_perm, seed=1):
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(HASH_PRIME), num_perm, dtype=np.uint64)
+    b = rng.integers(0, int(HASH_PRIME), num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signatures(texts, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE):
+    """(len(texts) x num_perm) uint32 MinHash signatures of normalized texts.
+
+    Character shingles of each text are hashed with a vectorized polynomial
+    hash over the UTF-8 bytes of the whole batch, then min-reduced per text
+    under num_perm universal hash functions.
+    """
+    a, b = _permutations(num_perm)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    weights = np.uint64(257) ** np.arange(shingle_size - 1, -1, -1, dtype=np.uint64)
+    for start in range(0, len(texts), SIGNATURE_BLOCK):
+        block = [t.encode("utf-8").ljust(shingle_size) for t in texts[start:start + SIGNATURE_BLOCK]]
+        lengths = np.array([len(t) for t in block])
+        data = np.frombuffer(b"".join(block), dtype=np.uint8).astype(np.uint64)
+        shingles = sliding_window_view(data, shingle_size) @ weights % HASH_PRIME
+        # Keep only shingles that lie within one text.
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        counts = lengths - shingle_size + 1
+        keep = np.concatenate([np.arange(s, s + c) for s, c in zip(starts, counts)])
+        hashed = (shingles[keep, None] * a + b) % HASH_PRIME
+        offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        signatures[start:start + len(block)] = np.minimum.reduceat(hashed, offsets, axis=0)
+    return signatures
+
+
+class DedupIndex:
+    """Exact and near-duplicate lookup for headlines, persisted to disk.
+
+    Exact duplicates (same day, same normalized text) are found with one
+    dict lookup on a 64-bit content hash. Near duplicates are found by
+    MinHash-LSH: each signature is cut into bands, headlines sharing any
+    band are candidates, and a candidate within window_days whose
+    signatures agree on at least threshold of their positions and which
+    has the same numbers and direction words (headline_gist) is a match.
+    Lookups cost the same however many headlines are indexed.
+
+    The index mirrors the sentiment collection: claim() admits new
+    headlines from this process, sync() adds what other processes wrote
+    since the last sync, and save() stores it with the sync mark so a
+    restart only fetches the documents written since.
+    """
+
+    def __init__(self, path=None, num_perm=NUM_PERM, bands=BANDS, threshold=NEAR_DUPLICATE_THRESHOLD,
+                 window_days=WINDOW_DAYS, save_interval=60.0, sync_interval=30.0):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.path = path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.threshold = threshold
+        self.window_days = window_days
+        self.save_interval = save_interval
+        self.sync_interval = sync_interval
+        self.high_water_mark = None
+        self._synced_at = None
+        self._sync_lock = threading.Lock()
+        self._ids = []
+        self._slots = {}
+        self._exact = {}
+        self._buckets = {}
+        self._days = np.empty(0, dtype="datetime64[D]")
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._gists = np.empty(0, dtype=np.uint64)
+        self._signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self._live = np.empty(0, dtype=bool)
+        self._saved_at = time.monotonic()
+        self._lock = threading.RLock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._slots
+
+    def _band_keys(self, signature):
+        r = self.rows_per_band
+        return [(band, signature[band * r:(band + 1) * r].tobytes()) for band in range(self.bands)]
+
+    def _grow(self, n):
+        size = len(self._ids) + n
+        if size <= len(self._days):
+            return
+        capacity = max(size, 2 * len(self._days), 1024)
+        self._days = np.resize(self._days, capacity)
+        self._hashes = np.resize(self._hashes, capacity)
+        self._gists = np.resize(self._gists, capacity)
+        self._signatures = np.resize(self._signatures, (capacity, self.num_perm))
+        self._live = np.resize(self._live, capacity)
+        self._live[len(self._ids):] = False
+
+    def _add(self, doc_id, day, exact_hash, gist, signature):
+        slot = len(self._ids)
+        self._ids.append(doc_id)
+        self._slots[doc_id] = slot
+        self._days[slot] = day
+        self._hashes[slot] = exact_hash
+        self._gists[slot] = gist
+        self._signatures[slot] = signature
+        self._live[slot] = True
+        self._exact.setdefault(exact_hash, doc_id)
+        for key in self._band_keys(signature):
+            self._buckets.setdefault(key, []).append(slot)
+
+    def _match(self, day, exact_hash, gist, signature):
+        doc_id = self._exact.get(exact_hash)
+        if doc_id is not None:
+            return EXACT, doc_id
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates.update(self._buckets.get(key, ()))
+        for slot in candidates:
+            if not self._live[slot] or abs(int((self._days[slot] - day).astype(np.int64))) > self.window_days:
+                continue
+            if self._gists[slot] != gist:
+                continue
+            if (self._signatures[slot] == signature).mean() >= self.threshold:
+                return NEAR, self._ids[slot]
+        return None
+
+    def _prepare(self, days, texts):
+        gists = np.array([headline_gist(t) for t in texts], dtype=np.uint64)
+        texts = [normalize_headline(t) for t in texts]
+        hashes = np.array([_exact_hash(d, t) for d, t in zip(np.asarray(days).astype(str), texts)], dtype=np.uint64)
+        return hashes, gists, minhash_signatures(texts, self.num_perm)
+
+    def claim(self, doc_ids, days, texts):
+        """Admit the headlines that duplicate nothing indexed or earlier in the batch.
+
+        Returns (keep, matches): keep is a boolean mask, matches lists
+        (doc_id, kind, duplicate_of) for the rest. Admitted headlines are
+        indexed at once, so concurrent batches cannot both admit one;
+        discard() them if they end up not being written.
+        """
+        days = np.asarray(days, dtype="datetime64[D]")
+        hashes, gists, signatures = self._prepare(days, texts)
+        keep = np.zeros(len(doc_ids), dtype=bool)
+        matches = []
+        with self._lock:
+            self._grow(len(doc_ids))
+            for i, doc_id in enumerate(doc_ids):
+                if doc_id in self._slots:
+                    matches.append((doc_id, EXACT, doc_id))
+                    continue
+                if np.isnat(days[i]):
+                    keep[i] = True
+                    continue
+                match = self._match(days[i], hashes[i], gists[i], signatures[i])
+                if match is not None:
+                    matches.append((doc_id, *match))
+                    continue
+                keep[i] = True
+                self._add(doc_id, days[i], hashes[i], gists[i], signatures[i])
+        return keep, matches
+
+    def add(self, doc_ids, days, texts):
+        """Index headlines unconditionally (ones already stored elsewhere)."""
+        days = np.asarray(days, dtype="datetime64[D]")
+        new = [i for i, doc_id in enumerate(doc_ids) if doc_id not in self._slots and not np.isnat(days[i])]
+        if not new:
+            return
+        hashes, gists, signatures = self._prepare(days[new], [texts[i] for i in new])
+        with self._lock:
+            self._grow(len(new))
+            for j, i in enumerate(new):
+                if doc_ids[i] not in self._slots:
+                    self._add(doc_ids[i], days[i], hashes[j], gists[j], signatures[j])
+
+    def discard(self, doc_ids):
+        with self._lock:
+            for doc_id in doc_ids:
+                slot = self._slots.pop(doc_id, None)
+                if slot is None:
+                    continue
+                self._live[slot] = False
+                exact_hash = int(self._hashes[slot])
+                if self._exact.get(exact_hash) == doc_id:
+                    del self._exact[exact_hash]
+
+    def sync(self, client, collection, parse_dates, date_field="Date", news_field="News",
+             updated_field=UPDATED_AT_FIELD, force=False):
+        """Index documents written to collection since the last sync (all of them the first time).
+
+        Does nothing if the last sync was under sync_interval seconds ago,
+        unless forced.
+        """
+        now = time.monotonic()
+        if not force and self._synced_at is not None and now - self._synced_at < self.sync_interval:
+            return 0
+        with self._sync_lock:
+            if not force and self._synced_at is not None and now - self._synced_at < self.sync_interval:
+                return 0
+            self._synced_at = now
+            documents, mark = fetch_changed(client, collection, self.high_water_mark, updated_field)
+            if documents:
+                ids = [doc_id for doc_id, _ in documents]
+                days = parse_dates([fields.get(date_field) for _, fields in documents])
+                self.add(ids, days, [fields.get(news_field, "") for _, fields in documents])
+            self.high_water_mark = mark
+        self.maybe_save()
+        return len(documents)
+
+    def maybe_save(self):
+        if self.path and time.monotonic() - self._saved_at >= self.save_interval:
+            self.save()
+
+    def save(self):
+        with self._lock:
+            live = np.flatnonzero(self._live[:len(self._ids)])
+            ids = np.array([self._ids[i] for i in live], dtype=str) if len(live) else np.array([], dtype="U1")
+            arrays = {
+                "ids": ids,
+                "days": self._days[live],
+                "hashes": self._hashes[live],
+                "gists": self._gists[live],
+                "signatures": self._signatures[live],
+                "meta": np.array([FORMAT_VERSION, self.num_perm, self.bands], dtype=np.int64),
+                "high_water_mark": np.array(self.high_water_mark.isoformat() if self.high_water_mark else ""),
+            }
+            self._saved_at = time.monotonic()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp-{os.getpid()}.npz"
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        with np.load(self.path) as data:
+            version, num_perm, bands = data["meta"].tolist()
+            if version != FORMAT_VERSION or num_perm != self.num_perm or bands != self.bands:
+                logger.info(f"Ignoring dedup index {self.path} built with different settings")
+                return
+            ids, days, hashes, gists = data["ids"], data["days"], data["hashes"], data["gists"]
+            signatures = data["signatures"]
+            mark = str(data["high_water_mark"])
+        with self._lock:
+            self._grow(len(ids))
+            for i, doc_id in enumerate(ids.tolist()):
+                self._add(doc_id, days[i], hashes[i], gists[i], signatures[i])
+            self.high_water_mark = datetime.fromisoformat(mark) if mark else None
+
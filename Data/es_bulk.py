@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Elasticsearch's own guidance: a few MB per bulk request, not a document count.
+DEFAULT_MAX_ACTIONS = 500
+DEFAULT_MAX_BYTES = 5 * 2 ** 20
+
+
+def get_es_client(hosts, basic_auth=None, verify_certs=True, connections_per_node=10, request_timeout=30):
+    """Elasticsearch client keeping a pool of keep-alive connections per node.
+
+    Create one per process and share it; every request then reuses an open
+    TLS connection instead of handshaking again.
+    """
+    from elasticsearch import Elasticsearch
+
+    return Elasticsearch(
+        hosts=hosts, basic_auth=basic_auth, verify_certs=verify_certs,
+        ssl_show_warn=verify_certs, connections_per_node=connections_per_node,
+        request_timeout=request_timeout, retry_on_timeout=True, max_retries=3,
+    )
+
+
+def _failure(item):
+    """(op, _index, _id, error) for one failed item of a bulk response."""
+    op, result = next(iter(item.items()))
+    return op, result.get('_index'), result.get('_id'), result.get('error') or result.get('exception')
+
+
+class BulkIndexer:
+    """Buffers index actions and sends them as bulk requests.
+
+    A bulk request goes out when max_actions documents or max_bytes of
+    source are buffered, and a daemon thread flushes whatever is left every
+    flush_interval seconds, so a lone document waits at most that long.
+    Documents that fail are logged, counted in failed and passed to
+    on_error(index, doc_id, error) if given; the rest of their request is
+    still indexed.
+    """
+
+    def __init__(self, client, max_actions=DEFAULT_MAX_ACTIONS, max_bytes=DEFAULT_MAX_BYTES, flush_interval=1.0,
+                 on_error=None):
+        self.client = client
+        self.max_actions = max_actions
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.on_error = on_error
+        self.indexed = 0
+        self.failed = 0
+        self._actions = []
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flusher = None
+        self._flusher_pid = None
+
+    def index(self, index_name, doc_id, source):
+        action = {"_op_type": "index", "_index": index_name, "_id": doc_id, "_source": source}
+        size = len(json.dumps(source, default=str))
+        with self._lock:
+            self._actions.append(action)
+            self._bytes += size
+            full = len(self._actions) >= self.max_actions or self._bytes >= self.max_bytes
+        self._ensure_flusher()
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Send everything buffered now; returns the failures as (op, index, id, error)."""
+        with self._lock:
+            actions, self._actions, self._bytes = self._actions, [], 0
+        if not actions:
+            return []
+        from elasticsearch import helpers
+
+        # One request at a time keeps the documents of a flush in order.
+        with self._send_lock:
+            indexed, errors = helpers.bulk(
+                self.client, actions, chunk_size=self.max_actions, max_chunk_bytes=self.max_bytes * 2,
+                raise_on_error=False, raise_on_exception=False, max_retries=3,
+            )
+        failures = [_failure(item) for item in errors]
+        self.indexed += indexed
+        self.failed += len(failures)
+        for op, index_name, doc_id, error in failures:
+            logger.warning(f"Failed to {op} document {doc_id} in {index_name}: {error}")
+            if self.on_error is not None:
+                self.on_error(index_name, doc_id, error)
+        return failures
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Background bulk flush failed: {e}")
+
+    def _ensure_flusher(self):
+        if not self.flush_interval:
+            return
+        # Threads do not survive fork, so each worker process starts its own.
+        if self._flusher is not None and self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher_pid == os.getpid():
+                return
+            self._stop = threading.Event()
+            self._flusher = threading.Thread(target=self._run, name="es-bulk-flusher", daemon=True)
+            self._flusher_pid = os.getpid()
+            self._flusher.start()
+
+    def close(self):
+        self._stop.set()
+        return self.flush()
+
+
+def backfill(client, index_name, documents, thread_count=4, chunk_size=DEFAULT_MAX_ACTIONS,
+             max_chunk_bytes=DEFAULT_MAX_BYTES):
+    """Index (doc_id, source) pairs over thread_count concurrent bulk streams.
+
+    Returns (indexed, failures) with failures as (op, index, id, error).
+    """
+    from elasticsearch import helpers
+
+    actions = ({"_op_type": "index", "_index": index_name, "_id": doc_id, "_source": source}
+               for doc_id, source in documents)
+    indexed, failures = 0, []
+    for ok, item in helpers.parallel_bulk(
+        client, actions, thread_count=thread_count, chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes,
+        raise_on_error=False, raise_on_exception=False,
+    ):
+        if ok:
+            indexed += 1
+        else:
+            failures.append(_failure(item))
+    return indexed, failures
+
+
+class FakeBulkServer:
+    """Local HTTP stand-in for the _bulk endpoint, for tests and benchmarks.
+
+    Point a client at url. Indexed sources are kept in documents keyed by
+    (index, id); ids listed in fail_ids are rejected the way Elasticsearch
+    rejects an unmappable document.
+    """
+
+    def __init__(self, fail_ids=()):
+        self.documents = {}
+        self.fail_ids = set(fail_ids)
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = None
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("X-Elastic-Product", "Elasticsearch")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                path = self.path.split("?")[0].strip("/").split("/")
+                if path[-1] != "_bulk":
+                    self._reply(404, {"error": f"no handler for {self.path}"})
+                    return
+                self._reply(200, fake.bulk(body.decode(), path[0] if len(path) == 2 else None))
+
+            do_PUT = do_POST
+
+        return Handler
+
+    def bulk(self, body, default_index=None):
+        lines = [line for line in body.split("\n") if line.strip()]
+        items, errors = [], False
+        with self._lock:
+            self.requests += 1
+            for meta_line, source_line in zip(lines[::2], lines[1::2]):
+                op, meta = next(iter(json.loads(meta_line).items()))
+                index_name, doc_id = meta.get("_index", default_index), str(meta.get("_id"))
+                if doc_id in self.fail_ids:
+                    errors = True
+                    items.append({op: {"_index": index_name, "_id": doc_id, "status": 400, "error": {
+                        "type": "document_parsing_exception", "reason": "failed to parse"}}})
+                    continue
+                self.documents[(index_name, doc_id)] = json.loads(source_line)
+                items.append({op: {"_index": index_name, "_id": doc_id, "status": 201, "result": "created"}})
+        return {"took": 0, "errors": errors, "items": items}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-bulk-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
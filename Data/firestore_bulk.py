@@ -0,0 +1,299 @@
+import logging
+import operator
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Firestore rejects batches with more than 500 writes.
+MAX_BATCH_SIZE = 500
+
+# Every bulk write stamps this field so readers can fetch changes incrementally.
+UPDATED_AT_FIELD = "updated_at"
+
+try:
+    from google.api_core import exceptions as _gexc
+    RETRYABLE_ERRORS = (
+        _gexc.ServiceUnavailable, _gexc.DeadlineExceeded, _gexc.Aborted,
+        _gexc.ResourceExhausted, _gexc.InternalServerError,
+        ConnectionError, TimeoutError,
+    )
+except ImportError:
+    RETRYABLE_ERRORS = (ConnectionError, TimeoutError)
+
+
+def get_firestore_client(cred_path):
+    """Firestore client for the configured backend.
+
+    FIRESTORE_BACKEND=memory gives an in-process stand-in for tests and
+    benchmarks. Setting FIRESTORE_EMULATOR_HOST is honoured by the Firebase
+    SDK itself and points the real client at a local emulator.
+    """
+    if os.environ.get("FIRESTORE_BACKEND") == "memory":
+        return InMemoryFirestore()
+
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate(cred_path))
+    return firestore.client()
+
+
+class LazyFirestoreClient:
+    """Creates the Firestore client on first use, separately in each process.
+
+    gRPC channels do not survive fork, so a pre-forking server must not hand
+    workers a client created in the master; this also keeps Firebase
+    initialisation out of import time.
+    """
+
+    def __init__(self, cred_path):
+        self.cred_path = cred_path
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._client = get_firestore_client(self.cred_path)
+                    self._pid = os.getpid()
+        return self._client
+
+    def collection(self, name):
+        return self.client.collection(name)
+
+    def batch(self):
+        return self.client.batch()
+
+    @contextmanager
+    def throwaway(self):
+        """Use a client on a Firebase app of its own inside the block, then discard it.
+
+        For work in a pre-fork master: firebase_admin caches the client on
+        the default app, so a client created there normally would be the one
+        every forked worker gets back. The in-memory backend has no channel
+        to protect and is used as is.
+        """
+        if os.environ.get("FIRESTORE_BACKEND") == "memory":
+            yield self
+            return
+
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+
+        app = firebase_admin.initialize_app(credentials.Certificate(self.cred_path), name=f"throwaway-{os.getpid()}")
+        client = firestore.client(app)
+        with self._lock:
+            self._client, self._pid = client, os.getpid()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._client, self._pid = None, None
+            if hasattr(client, "close"):
+                client.close()
+            firebase_admin.delete_app(app)
+
+
+def frame_to_documents(data, id_column, field_map):
+    """(doc_id, fields) pairs for a DataFrame, renaming columns with field_map.
+
+    Rows sharing a document ID collapse to the last one, which is what the
+    per-row set() calls used to leave in Firestore.
+    """
+    ids = data[id_column].astype(str).tolist()
+    records = data[list(field_map)].rename(columns=field_map).to_dict("records")
+    return list(dict(zip(ids, records)).items())
+
+
+def fetch_changed(client, collection, since=None, updated_field=UPDATED_AT_FIELD):
+    """(documents, high_water_mark) for the documents stamped at or after since.
+
+    documents are (doc_id, fields) pairs; with since None the whole
+    collection is fetched. >= rather than > so writes sharing the mark are
+    not missed; callers must tolerate seeing a document twice. The returned
+    mark is since when nothing newer came back.
+    """
+    query = client.collection(collection)
+    if since is not None:
+        query = query.where(updated_field, ">=", since)
+    documents = [(doc.id, doc.to_dict()) for doc in query.stream()]
+    stamps = [fields[updated_field] for _, fields in documents if fields.get(updated_field) is not None]
+    if stamps:
+        latest = max(_as_utc(stamp) for stamp in stamps)
+        since = latest if since is None else max(since, latest)
+    return documents, since
+
+
+def _as_utc(stamp):
+    if isinstance(stamp, str):
+        stamp = datetime.fromisoformat(stamp)
+    return stamp if stamp.tzinfo else stamp.replace(tzinfo=timezone.utc)
+
+
+def server_timestamp(client):
+    if isinstance(client, LazyFirestoreClient):
+        client = client.client
+    if isinstance(client, InMemoryFirestore):
+        return MEMORY_SERVER_TIMESTAMP
+    from google.cloud.firestore import SERVER_TIMESTAMP
+    return SERVER_TIMESTAMP
+
+
+class BulkWriter:
+    """Writes documents in batched commits, several batches in parallel.
+
+    on_commit(collection, n_documents, seconds), if given, is called after
+    every successful batch commit.
+    """
+
+    def __init__(self, client, batch_size=MAX_BATCH_SIZE, max_workers=8, max_retries=5, backoff=0.2,
+                 stamp_field=UPDATED_AT_FIELD, on_commit=None):
+        self.client = client
+        self.on_commit = on_commit
+        self.stamp_field = stamp_field
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    def write(self, collection, documents, merge=False):
+        """Set every (doc_id, fields) pair; with merge, fields are merged into existing documents."""
+        collection_ref = self.client.collection(collection)
+        batches = [documents[i:i + self.batch_size] for i in range(0, len(documents), self.batch_size)]
+        if len(batches) <= 1 or self.max_workers <= 1:
+            return sum(self._commit(collection, collection_ref, batch, merge) for batch in batches)
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as pool:
+            written = sum(pool.map(lambda batch: self._commit(collection, collection_ref, batch, merge), batches))
+        logger.info(f"Wrote {written} documents to {collection} in {len(batches)} batches")
+        return written
+
+    def _commit(self, collection, collection_ref, documents, merge=False):
+        for attempt in range(self.max_retries + 1):
+            batch = self.client.batch()
+            for doc_id, fields in documents:
+                if self.stamp_field:
+                    fields = dict(fields, **{self.stamp_field: server_timestamp(self.client)})
+                batch.set(collection_ref.document(doc_id), fields, merge=merge)
+            try:
+                start = time.perf_counter()
+                batch.commit()
+                if self.on_commit is not None:
+                    self.on_commit(collection, len(documents), time.perf_counter() - start)
+                return len(documents)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff * (2 ** attempt) * (1 + random.random())
+                logger.warning(f"Batch commit failed ({e}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+
+
+MEMORY_SERVER_TIMESTAMP = object()
+
+
+_QUERY_OPERATORS = {
+    "==": operator.eq, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+}
+
+
+class _MemorySnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return None if self._data is None else dict(self._data)
+
+
+class _MemoryDocument:
+    def __init__(self, collection, doc_id):
+        self._collection = collection
+        self.id = doc_id
+
+    def set(self, data, merge=False):
+        now = datetime.now(timezone.utc)
+        with self._collection.lock:
+            current = dict(self._collection.docs.get(self.id) or {}) if merge else {}
+            for key, value in data.items():
+                if value is MEMORY_SERVER_TIMESTAMP:
+                    value = now
+                current[key] = value
+            self._collection.docs[self.id] = current
+
+    def get(self):
+        with self._collection.lock:
+            return _MemorySnapshot(self.id, self._collection.docs.get(self.id))
+
+
+class _MemoryQuery:
+    def __init__(self, collection, filters):
+        self._collection = collection
+        self._filters = filters
+
+    def where(self, field, op, value):
+        return _MemoryQuery(self._collection, self._filters + [(field, _QUERY_OPERATORS[op], value)])
+
+    def stream(self):
+        with self._collection.lock:
+            items = list(self._collection.docs.items())
+        for doc_id, data in items:
+            # Like Firestore, documents missing a filtered field never match.
+            if all(field in data and op(data[field], value) for field, op, value in self._filters):
+                yield _MemorySnapshot(doc_id, dict(data))
+
+
+class _MemoryCollection:
+    def __init__(self, lock):
+        self.lock = lock
+        self.docs = {}
+
+    def document(self, doc_id):
+        return _MemoryDocument(self, str(doc_id))
+
+    def where(self, field, op, value):
+        return _MemoryQuery(self, []).where(field, op, value)
+
+    def stream(self):
+        return _MemoryQuery(self, []).stream()
+
+
+class _MemoryBatch:
+    def __init__(self):
+        self._writes = []
+
+    def set(self, doc_ref, data, merge=False):
+        self._writes.append((doc_ref, data, merge))
+
+    def commit(self):
+        for doc_ref, data, merge in self._writes:
+            doc_ref.set(data, merge=merge)
+        self._writes = []
+
+
+class InMemoryFirestore:
+    """Just enough of the Firestore client API to run the app offline."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._collections = {}
+
+    def collection(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = _MemoryCollection(threading.Lock())
+            return self._collections[name]
+
+    def batch(self):
+        return _MemoryBatch()
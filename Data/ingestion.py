@@ -0,0 +1,353 @@
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development server only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+WRITING = "writing"
+WRITTEN = "written"
+FAILED = "failed"
+
+
+class IngestionQueueFull(Exception):
+    pass
+
+
+class IngestionQueue:
+    """Bounded in-process write-behind queue.
+
+    submit() records the write and returns an ingestion ID straight away. A
+    dispatcher thread hands batches to a thread pool, one handler call per
+    kind and batch. Writes to the same (kind, key) that are still waiting are
+    coalesced into one record, fields of later writes replacing those of
+    earlier ones. Every submission is appended to a journal file first, and
+    entries not yet written are replayed by start(); once compact_after
+    ingestions have finished the journal is rewritten without them, so it
+    stays about as long as the backlog. Under a pre-forking server each
+    worker locks a journal of its own and adopts those of workers that are
+    gone. Journal entries carry each ingestion's final status, so status()
+    answers for IDs submitted to any worker sharing the journal directory
+    by reading the other journals from where it last stopped.
+    """
+
+    def __init__(self, handlers, max_pending=10000, max_batch=500, flush_interval=0.5,
+                 max_workers=4, max_attempts=3, spill_path=None, put_timeout=1.0,
+                 status_retention=100000, compact_after=10000):
+        self.handlers = handlers
+        self.max_pending = max_pending
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self.spill_path = spill_path
+        self.put_timeout = put_timeout
+        self.status_retention = status_retention
+        self.compact_after = compact_after
+
+        self._cond = threading.Condition()
+        self._journal_read_lock = threading.Lock()
+        self._pending = OrderedDict()  # (kind, key) -> [record, ids, attempts]
+        self._inflight = 0
+        self._statuses = OrderedDict()
+        self._journal_statuses = OrderedDict()
+        self._journal_offsets = {}  # path -> (inode, offset)
+        self._journal = None
+        self._journal_path = None
+        self._journal_lock = None
+        self._finished = 0  # ingestions marked done since the journal was rewritten
+        self._pid = None
+        self._executor = None
+        self._stopping = False
+
+    def start(self):
+        """Start the dispatcher and claim and replay a journal in this process.
+
+        Call it in each process that will submit, e.g. from a pre-forking
+        server's post_fork hook; submit() and flush() call it too.
+        """
+        # Threads and file handles are per process; restart them after a fork.
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ingestion")
+            if self.spill_path:
+                self._replay_journal()
+            threading.Thread(target=self._dispatch, name="ingestion-dispatcher", daemon=True).start()
+
+    def _claim_journal(self):
+        # Each worker process of a pre-forking server keeps its own journal:
+        # spill_path, spill_path.1, ... each guarded by an exclusive lock.
+        if fcntl is None:
+            return self.spill_path, None
+        for slot in itertools.count():
+            path = self.spill_path if slot == 0 else f"{self.spill_path}.{slot}"
+            lock = self._try_lock(path)
+            if lock is not None:
+                return path, lock
+
+    @staticmethod
+    def _try_lock(path):
+        lock = open(path + ".lock", "a")
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return None
+        return lock
+
+    def _journal_paths(self):
+        prefix = os.path.basename(self.spill_path) + "."
+        directory = os.path.dirname(self.spill_path) or "."
+        return [self.spill_path] + [
+            os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.startswith(prefix) and name[len(prefix):].isdigit()
+        ]
+
+    def _orphaned_journals(self):
+        """Journals of other slots whose process has gone, locked for adoption."""
+        if fcntl is None:
+            return []
+        orphans = []
+        for path in self._journal_paths():
+            if path == self._journal_path or not os.path.exists(path):
+                continue
+            lock = self._try_lock(path)
+            if lock is not None:
+                orphans.append((path, lock))
+        return orphans
+
+    @staticmethod
+    def _read_journal(path, pending):
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn write at the end of the file
+                if entry["op"] == "put":
+                    pending[entry["id"]] = entry
+                else:
+                    for ingestion_id in entry["ids"]:
+                        pending.pop(ingestion_id, None)
+
+    def _replay_journal(self):
+        self._journal_path, self._journal_lock = self._claim_journal()
+        orphans = self._orphaned_journals()
+        pending = OrderedDict()
+        self._read_journal(self._journal_path, pending)
+        for path, _ in orphans:
+            self._read_journal(path, pending)
+        self._rewrite_journal(pending)
+        for path, lock in orphans:
+            os.remove(path)
+            lock.close()
+
+        for entry in pending.values():
+            self._enqueue(entry["kind"], entry["key"], entry["record"], entry["id"])
+        if pending:
+            logger.info(f"Replayed {len(pending)} unfinished ingestions into {self._journal_path}")
+
+    def _rewrite_journal(self, pending):
+        """Replace the journal with just the unfinished entries in pending."""
+        if self._journal is not None:
+            self._journal.close()
+        tmp_path = self._journal_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for entry in pending.values():
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp_path, self._journal_path)
+        self._journal = open(self._journal_path, "a")
+        self._finished = 0
+
+    def _log(self, entry):
+        if self._journal is None:
+            return
+        self._journal.write(json.dumps(entry) + "\n")
+        self._journal.flush()
+        if entry["op"] == "done":
+            self._finished += len(entry["ids"])
+            if self._finished >= self.compact_after:
+                # Called under _cond, so nothing is appended meanwhile.
+                pending = OrderedDict()
+                self._read_journal(self._journal_path, pending)
+                self._rewrite_journal(pending)
+
+    def _set_status(self, ingestion_id, state, error=None):
+        self._statuses[ingestion_id] = {"id": ingestion_id, "status": state, "error": error}
+        self._statuses.move_to_end(ingestion_id)
+        while len(self._statuses) > self.status_retention:
+            self._statuses.popitem(last=False)
+
+    def _enqueue(self, kind, key, record, ingestion_id):
+        slot = self._pending.get((kind, key))
+        if slot is None:
+            self._pending[(kind, key)] = [record, [ingestion_id], 0]
+        else:
+            slot[0] = {**slot[0], **record}
+            slot[1].append(ingestion_id)
+        self._set_status(ingestion_id, QUEUED)
+        if len(self._pending) >= self.max_batch:
+            self._cond.notify_all()
+
+    def submit(self, kind, key, record):
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown ingestion kind: {kind}")
+        self.start()
+        ingestion_id = uuid.uuid4().hex
+        deadline = time.monotonic() + self.put_timeout
+        with self._cond:
+            while len(self._pending) >= self.max_pending and (kind, key) not in self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise IngestionQueueFull(f"{len(self._pending)} writes pending")
+                self._cond.wait(remaining)
+            self._log({"op": "put", "id": ingestion_id, "kind": kind, "key": key, "record": record})
+            self._enqueue(kind, key, record, ingestion_id)
+        return ingestion_id
+
+    def status(self, ingestion_id):
+        with self._cond:
+            status = self._statuses.get(ingestion_id)
+            if status:
+                return dict(status)
+        if not self.spill_path or fcntl is None:
+            return None
+        with self._journal_read_lock:
+            self._read_other_journals()
+            status = self._journal_statuses.get(ingestion_id)
+            return dict(status) if status else None
+
+    def _read_other_journals(self):
+        """Fold what other workers appended to their journals into _journal_statuses."""
+        for path in self._journal_paths():
+            if path == self._journal_path:
+                continue
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                self._journal_offsets.pop(path, None)
+                continue
+            with f:
+                inode = os.fstat(f.fileno()).st_ino
+                seen_inode, offset = self._journal_offsets.get(path, (None, 0))
+                if seen_inode != inode or offset > os.fstat(f.fileno()).st_size:
+                    offset = 0  # rewritten since the last read
+                f.seek(offset)
+                data = f.read()
+            # Only whole lines; a write in progress is read next time.
+            end = data.rfind(b"\n") + 1
+            self._journal_offsets[path] = (inode, offset + end)
+            for line in data[:end].splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry["op"] == "put":
+                    updates = [(entry["id"], QUEUED, None)]
+                else:
+                    updates = [(i, entry.get("status", WRITTEN), entry.get("error")) for i in entry["ids"]]
+                for ingestion_id, state, error in updates:
+                    self._journal_statuses[ingestion_id] = {"id": ingestion_id, "status": state, "error": error}
+                    self._journal_statuses.move_to_end(ingestion_id)
+            while len(self._journal_statuses) > self.status_retention:
+                self._journal_statuses.popitem(last=False)
+
+    def _take_batches(self):
+        batches = {}
+        while self._pending and sum(len(b) for b in batches.values()) < self.max_batch:
+            (kind, key), slot = self._pending.popitem(last=False)
+            batches.setdefault(kind, []).append((key, slot))
+            for ingestion_id in slot[1]:
+                self._set_status(ingestion_id, WRITING)
+        return batches
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                if len(self._pending) < self.max_batch and not self._stopping:
+                    self._cond.wait(self.flush_interval)
+                if not self._pending:
+                    if self._stopping:
+                        return
+                    continue
+                batches = self._take_batches()
+                self._inflight += len(batches)
+                self._cond.notify_all()  # room for blocked submitters
+            for kind, items in batches.items():
+                self._executor.submit(self._write, kind, items)
+
+    def _write(self, kind, items):
+        error = None
+        try:
+            self.handlers[kind]([slot[0] for _, slot in items])
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Writing {len(items)} {kind} records failed: {e}")
+
+        with self._cond:
+            done_ids = []
+            state = WRITTEN if error is None else FAILED
+            for key, (record, ids, attempts) in items:
+                if error is not None and attempts + 1 < self.max_attempts:
+                    # Retry; if a newer write for the key is already queued, merge under it.
+                    slot = self._pending.setdefault((kind, key), [record, [], attempts + 1])
+                    slot[0] = {**record, **slot[0]}
+                    slot[1][:0] = ids
+                    for ingestion_id in ids:
+                        self._set_status(ingestion_id, QUEUED, error)
+                    continue
+                for ingestion_id in ids:
+                    self._set_status(ingestion_id, state, error)
+                done_ids.extend(ids)
+            if done_ids:
+                self._log({"op": "done", "ids": done_ids, "status": state, "error": error})
+            self._inflight -= 1
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Block until everything submitted so far has been written or failed."""
+        self.start()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._pending or self._inflight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else self.flush_interval)
+                self._cond.notify_all()
+        return True
+
+    def close(self, timeout=None):
+        if self._pid != os.getpid():
+            return  # never started in this process
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if self._journal_lock is not None:
+            self._journal_lock.close()
+            self._journal_lock = None
@@ -0,0 +1,376 @@
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from Data.dataPreprocessing import RunningStats
+
+DATE = "date"
+NUMBER = "number"
+LEVEL = "level"
+BINARY = "binary"
+CATEGORY = "category"
+TEXT = "text"
+
+FieldSpec = namedtuple("FieldSpec", ["name", "kind", "required"])
+Issue = namedtuple("Issue", ["field", "problem", "detail"])
+
+# Below this many observations a column's mean/std are too rough for z-scores.
+MIN_HISTORY = 30
+
+
+def _parse_dates(values):
+    return pd.to_datetime(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype="datetime64[D]")
+
+
+def _blank(value):
+    return value is None or (isinstance(value, str) and not value.strip()) or (
+        isinstance(value, float) and np.isnan(value))
+
+
+def _log_returns(prev_days, prev_values, days, values):
+    """Log return from each previous close, scaled to one business day.
+
+    Returns over a gap of k business days have about sqrt(k) times the
+    spread of daily ones, so dividing by sqrt(k) puts them on one scale.
+    """
+    gaps = np.maximum(np.busday_count(prev_days, days), 1)
+    return np.log(values / prev_values) / np.sqrt(gaps)
+
+
+class _LevelSeries:
+    """One price column's closes, sorted by day, in arrays grown in place.
+
+    A batch of later days is appended into spare capacity; only days that
+    fall inside the stored range are placed with np.insert.
+    """
+
+    def __init__(self):
+        self._days = np.empty(64, dtype="datetime64[D]")
+        self._values = np.empty(64)
+        self.size = 0
+
+    @property
+    def days(self):
+        return self._days[:self.size]
+
+    @property
+    def values(self):
+        return self._values[:self.size]
+
+    def before(self, days):
+        """Index of the last close before each day, -1 if there is none."""
+        return np.searchsorted(self.days, days, side="left") - 1
+
+    def merge(self, days, values):
+        """Store a batch of closes; the returns of the days not stored before."""
+        order = np.argsort(days, kind="stable")
+        days, values = days[order], values[order]
+        # A later row replaces an earlier one for the same day.
+        last = np.append(days[1:] != days[:-1], True)
+        days, values = days[last], values[last]
+        at = np.searchsorted(self.days, days, side="left")
+        stored = at < self.size
+        stored[stored] = self._days[at[stored]] == days[stored]
+        self._values[at[stored]] = values[stored]
+        days, values, at = days[~stored], values[~stored], at[~stored]
+        if not len(days):
+            return np.empty(0)
+        if at[0] == self.size:
+            end = self.size + len(days)
+            if end > len(self._days):
+                capacity = max(2 * len(self._days), end)
+                self._days = np.resize(self._days, capacity)
+                self._values = np.resize(self._values, capacity)
+            self._days[self.size:end], self._values[self.size:end] = days, values
+            self.size = end
+        else:
+            self._days = np.insert(self.days, at, days)
+            self._values = np.insert(self.values, at, values)
+            self.size = len(self._days)
+        prev = self.before(days)
+        has = prev >= 0
+        return _log_returns(self.days[prev[has]], self.values[prev[has]], days[has], values[has])
+
+
+class StreamingValidator:
+    """Checks one incoming record at a time against statistics of what is stored.
+
+    Per column it keeps a running count/mean/variance (RunningStats), the
+    min/max for numbers and the values seen for categories. LEVEL columns
+    (prices) trend, so their levels say little about a new value; instead
+    the stored series is kept by day and each new value's log return from
+    the previous stored close is scored against running statistics of the
+    stored returns. seed() builds all of this from stored history in one
+    vectorized pass and observe() folds in each batch as it is written, so
+    validate() costs the same however much history there is. Problems found:
+
+    - missing: a required field is blank
+    - type: a number, 0/1 flag or date does not parse, or a price is not positive
+    - future_date: the date is after today
+    - outlier: a number more than z_threshold standard deviations from the
+      column mean, or a price whose return from the previous close is (once
+      MIN_HISTORY values or returns have been seen)
+    - unknown_category: a category value never seen before, once seeded
+    """
+
+    def __init__(self, fields, parse_dates=_parse_dates, z_threshold=4.0):
+        self.fields = list(fields)
+        self.parse_dates = parse_dates
+        self.z_threshold = z_threshold
+        self.date_field = next((f.name for f in self.fields if f.kind == DATE), None)
+        self.numeric = [f.name for f in self.fields if f.kind == NUMBER]
+        self.levels = [f.name for f in self.fields if f.kind == LEVEL]
+        if self.levels and self.date_field is None:
+            raise ValueError("LEVEL fields need a DATE field")
+        self.stats = RunningStats(self.numeric)
+        self.minimum = np.full(len(self.numeric), np.inf)
+        self.maximum = np.full(len(self.numeric), -np.inf)
+        self.returns = RunningStats(self.levels)
+        self.series = {name: _LevelSeries() for name in self.levels}
+        self.categories = {f.name: set() for f in self.fields if f.kind == CATEGORY}
+        self.seeded = False
+        self._lock = threading.Lock()
+
+    def seed(self, frame):
+        """Replace the statistics with those of a frame of stored history."""
+        with self._lock:
+            self.stats = RunningStats(self.numeric)
+            self.minimum[:] = np.inf
+            self.maximum[:] = -np.inf
+            self.returns = RunningStats(self.levels)
+            self.series = {name: _LevelSeries() for name in self.levels}
+            for values in self.categories.values():
+                values.clear()
+            self._observe(frame)
+            self.seeded = True
+
+    def observe(self, frame):
+        """Fold a batch that has been written into the statistics."""
+        with self._lock:
+            self._observe(frame)
+
+    def _observe(self, frame):
+        if not len(frame):
+            return
+        if self.numeric:
+            values = np.column_stack([
+                pd.to_numeric(frame[c], errors="coerce").to_numpy(dtype=np.float64) if c in frame
+                else np.full(len(frame), np.nan) for c in self.numeric
+            ])
+            self.stats.update(values)
+            with np.errstate(invalid="ignore"):
+                self.minimum = np.fmin(self.minimum, np.nanmin(np.where(np.isnan(values), np.inf, values), axis=0))
+                self.maximum = np.fmax(self.maximum, np.nanmax(np.where(np.isnan(values), -np.inf, values), axis=0))
+        if self.levels and self.date_field in frame:
+            days = self.parse_dates(frame[self.date_field].to_numpy(dtype=object))
+            returns = [self._observe_level(name, days, frame[name] if name in frame else None)
+                       for name in self.levels]
+            width = max(len(r) for r in returns)
+            matrix = np.full((width, len(self.levels)), np.nan)
+            for i, r in enumerate(returns):
+                matrix[:len(r), i] = r
+            if width:
+                self.returns.update(matrix)
+        for name, values in self.categories.items():
+            if name in frame:
+                values.update(str(v) for v in frame[name].dropna().unique())
+
+    def _observe_level(self, name, days, column):
+        """Merge a batch into the stored series; the returns of its new days."""
+        if column is None:
+            return np.empty(0)
+        values = pd.to_numeric(column, errors="coerce").to_numpy(dtype=np.float64)
+        keep = ~np.isnat(days) & (values > 0)
+        if not keep.any():
+            return np.empty(0)
+        return self.series[name].merge(days[keep], values[keep])
+
+    def _return_z(self, name, days, values):
+        """z-scores of values' returns from the last stored close before each day (NaN if none)."""
+        i = self.levels.index(name)
+        series = self.series[name]
+        if self.returns.count[i] < MIN_HISTORY or not series.size:
+            return np.full(len(days), np.nan), None, None
+        at = series.before(days)
+        z = np.full(len(days), np.nan)
+        known = (at >= 0) & ~np.isnat(days) & (values > 0)
+        if known.any():
+            r = _log_returns(series.days[at[known]], series.values[at[known]], days[known], values[known])
+            z[known] = (r - self.returns.mean[i]) / max(self.returns.std[i], 1e-12)
+        safe = np.maximum(at, 0)
+        return z, series.days[safe], series.values[safe]
+
+    def _level_outliers(self, i, name, days, values):
+        """Rows of a frame whose return from the last accepted close before their day is an outlier.
+
+        A row's previous close is the frame's latest earlier accepted row or,
+        failing that, the last stored close before its day (one binary
+        search), so a backfill is checked day by day and the cost depends on
+        the frame, not on the stored history. A flagged row stops being
+        anyone's previous close and the rest are rescored, so the correct
+        price after a typo is not flagged for moving back.
+        """
+        rows = np.flatnonzero(~np.isnat(days) & (values > 0))
+        if not len(rows):
+            return rows
+        rows = rows[np.argsort(days[rows], kind="stable")]
+        frame_days, frame_values = days[rows], values[rows]
+        series = self.series[name]
+        at = series.before(frame_days)
+        stored = at >= 0
+        stored_days = np.full(len(rows), np.datetime64("NaT"), dtype="datetime64[D]")
+        stored_values = np.full(len(rows), np.nan)
+        stored_days[stored], stored_values[stored] = series.days[at[stored]], series.values[at[stored]]
+        std = max(self.returns.std[i], 1e-12)
+        flagged = np.zeros(len(rows), dtype=bool)
+        while True:
+            accepted = np.flatnonzero(~flagged)
+            prev = np.searchsorted(frame_days[accepted], frame_days, side="left") - 1
+            prev_row = accepted[np.maximum(prev, 0)]
+            from_frame = (prev >= 0) & (~stored | (frame_days[prev_row] >= stored_days))
+            prev_days = np.where(from_frame, frame_days[prev_row], stored_days)
+            prev_values = np.where(from_frame, frame_values[prev_row], stored_values)
+            known = (from_frame | stored) & ~flagged
+            z = np.full(len(rows), np.nan)
+            z[known] = (_log_returns(prev_days[known], prev_values[known],
+                                     frame_days[known], frame_values[known]) - self.returns.mean[i]) / std
+            new = np.flatnonzero(np.abs(np.nan_to_num(z)) > self.z_threshold)
+            if not len(new):
+                return rows[flagged]
+            # Rows are in day order; only the earliest is certain, later ones
+            # may just follow it.
+            flagged[new[0]] = True
+
+    def validate(self, record):
+        """Issues found in one record (a dict keyed by field name); empty if it is fine."""
+        issues = []
+        numbers = np.full(len(self.numeric), np.nan)
+        levels = {}
+        day = np.datetime64("NaT")
+        today = np.datetime64("today", "D")
+        for spec in self.fields:
+            value = record.get(spec.name)
+            if _blank(value):
+                if spec.required:
+                    issues.append(Issue(spec.name, "missing", "required field is blank"))
+                continue
+            if spec.kind == DATE:
+                parsed = self.parse_dates([value])[0]
+                if np.isnat(parsed):
+                    issues.append(Issue(spec.name, "type", f"{value!r} is not a date"))
+                elif parsed > today:
+                    issues.append(Issue(spec.name, "future_date", f"{value} is after today"))
+                if spec.name == self.date_field:
+                    day = parsed
+            elif spec.kind in (NUMBER, LEVEL, BINARY):
+                try:
+                    number = float(value)
+                except (TypeError, ValueError):
+                    issues.append(Issue(spec.name, "type", f"{value!r} is not a number"))
+                    continue
+                if spec.kind == BINARY and number not in (0.0, 1.0):
+                    issues.append(Issue(spec.name, "type", f"{value!r} is not 0 or 1"))
+                elif spec.kind == LEVEL and not number > 0:
+                    issues.append(Issue(spec.name, "type", f"{value!r} is not a positive price"))
+                elif spec.kind == LEVEL:
+                    levels[spec.name] = number
+                elif spec.kind == NUMBER:
+                    numbers[self.numeric.index(spec.name)] = number
+            elif spec.kind == CATEGORY:
+                known = self.categories[spec.name]
+                if self.seeded and known and str(value) not in known:
+                    issues.append(Issue(spec.name, "unknown_category",
+                                        f"{value!r} is not one of {sorted(known)}"))
+
+        if not self.z_threshold:
+            return issues
+        with self._lock:
+            if self.numeric:
+                z = self.stats.zscores(numbers)
+                enough = self.stats.count >= MIN_HISTORY
+                minimum, maximum = self.minimum.copy(), self.maximum.copy()
+                for i in np.flatnonzero(enough & (np.abs(np.nan_to_num(z)) > self.z_threshold)):
+                    issues.append(Issue(self.numeric[i], "outlier",
+                                        f"{numbers[i]} is {z[i]:+.1f} standard deviations from the mean "
+                                        f"(seen range {minimum[i]:g} to {maximum[i]:g})"))
+            for name, value in levels.items():
+                z, prev_days, prev_values = self._return_z(name, np.array([day]), np.array([value]))
+                if not np.isnan(z[0]) and abs(z[0]) > self.z_threshold:
+                    issues.append(Issue(name, "outlier",
+                                        f"{value:g} is a {value / prev_values[0] - 1:+.1%} move from the close of "
+                                        f"{prev_values[0]:g} on {prev_days[0]} ({z[0]:+.1f} standard deviations)"))
+        return issues
+
+    def validate_frame(self, frame):
+        """The same checks over a whole frame at once.
+
+        Prices are scored by _level_outliers, against both the stored series
+        and the frame's own earlier days. Returns (valid, problems):
+        a boolean mask of the rows with no issue and the number of issues of
+        each problem.
+        """
+        n = len(frame)
+        bad = np.zeros(n, dtype=bool)
+        problems = {}
+
+        def flag(problem, rows):
+            nonlocal bad
+            if rows.any():
+                problems[problem] = problems.get(problem, 0) + int(rows.sum())
+                bad |= rows
+
+        def column_of(name):
+            return frame[name] if name in frame else pd.Series([None] * n, index=frame.index, dtype=object)
+
+        today = np.datetime64("today", "D")
+        days = np.full(n, np.datetime64("NaT"), dtype="datetime64[D]")
+        numbers = np.full((n, len(self.numeric)), np.nan)
+        levels = np.full((n, len(self.levels)), np.nan)
+        for spec in self.fields:
+            column = column_of(spec.name)
+            blank = column.isna().to_numpy()
+            if column.dtype == object:
+                blank |= column.astype(str).str.strip().eq("").to_numpy()
+            if spec.required:
+                flag("missing", blank)
+            if spec.kind == DATE:
+                parsed = self.parse_dates(column.to_numpy(dtype=object))
+                flag("type", np.isnat(parsed) & ~blank)
+                flag("future_date", parsed > today)
+                if spec.name == self.date_field:
+                    days = parsed
+            elif spec.kind in (NUMBER, LEVEL, BINARY):
+                values = pd.to_numeric(column, errors="coerce").to_numpy(dtype=np.float64)
+                flag("type", np.isnan(values) & ~blank)
+                if spec.kind == BINARY:
+                    flag("type", ~np.isnan(values) & (values != 0.0) & (values != 1.0))
+                elif spec.kind == LEVEL:
+                    flag("type", ~np.isnan(values) & ~(values > 0))
+                    levels[:, self.levels.index(spec.name)] = values
+                else:
+                    numbers[:, self.numeric.index(spec.name)] = values
+            elif spec.kind == CATEGORY:
+                known = self.categories[spec.name]
+                if self.seeded and known:
+                    flag("unknown_category", ~blank & ~column.astype(str).isin(known).to_numpy())
+
+        if not self.z_threshold or not n:
+            return ~bad, problems
+        outlier = np.zeros(n, dtype=bool)
+        with self._lock:
+            if self.numeric:
+                z = self.stats.zscores(numbers)
+                enough = self.stats.count >= MIN_HISTORY
+                outlier |= (enough & (np.abs(np.nan_to_num(z)) > self.z_threshold)).any(axis=1)
+            for i, name in enumerate(self.levels):
+                if self.returns.count[i] < MIN_HISTORY:
+                    continue
+                outlier[self._level_outliers(i, name, days, levels[:, i])] = True
+        flag("outlier", outlier)
+        return ~bad, problems
+
+
+def describe_issues(issues):
+    return "; ".join(f"{issue.field}: {issue.detail}" for issue in issues)
@@ -1,90 +1,565 @@
-from flask import Flask, render_template, request, redirect, url_for
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
+import io
+import itertools
+import json
+import os
+import time
+import uuid
+from flask import Flask, render_template, request, redirect, url_for, Response, stream_with_context, jsonify, g
+import numpy as np
 import pandas as pd
-from Data.dataPreprocessing import (
-    check_missing_values, detect_outliers, clean_data, remove_duplicates, 
-    consistency_in_dates_price, check_data_types_price
+from Data.csv_upload import BLOCK_SIZE, CHUNK_ROWS, UploadConflict, UploadLog, multipart_file_blocks, run_upload
+from Data.dedup_index import NEAR, DedupIndex
+from Data.firestore_bulk import BulkWriter, LazyFirestoreClient, frame_to_documents
+from Data.ingestion import IngestionQueue, IngestionQueueFull
+from Data.validation import BINARY, CATEGORY, DATE, LEVEL, TEXT, FieldSpec, StreamingValidator, describe_issues
+from models.coalescer import PredictionCoalescer
+from models.daily_sentiment import DAILY_SENTIMENT_COLLECTION, contribution_documents, headline_document_id, parse_headline_dates
+from models.features import FLAG_COLUMNS, INPUT_COLUMNS, SENTIMENT_COLUMN, to_days
+from models.history_index import HistoryIndex
+from models.headline_labeler import LABEL_COLUMNS, load_headline_labeler
+from models.market_features import GOLD_COLUMN, MARKET_COLUMNS, MarketFeatureEngine, MarketFeatureSync
+from models import model1
+from models.metrics import RequestProfiler, metrics
+from models.online_training import OnlineTrainer
+from models.prediction_table import PredictionTableService
+from models.registry import ModelRegistry
+
+app = Flask(__name__)
+
+REQUEST_COUNT = metrics.counter('http_requests_total', 'HTTP requests by endpoint, method and status.')
+REQUEST_SECONDS = metrics.histogram('http_request_duration_seconds', 'HTTP request latency by endpoint.')
+REQUESTS_IN_FLIGHT = metrics.gauge('http_requests_in_flight', 'HTTP requests currently being handled.')
+STAGE_SECONDS = metrics.histogram('stage_duration_seconds', 'Time spent in each hot-path stage.')
+FIRESTORE_COMMIT_SECONDS = metrics.histogram('firestore_batch_commit_seconds', 'Firestore batch commit latency.')
+FIRESTORE_DOCUMENTS = metrics.counter('firestore_documents_written_total', 'Documents written to Firestore.')
+DUPLICATE_HEADLINES = metrics.counter('duplicate_headlines_total', 'Submitted headlines skipped as duplicates.')
+REJECTED_RECORDS = metrics.counter('validation_rejections_total', 'Submitted records rejected by validation.')
+
+# PROFILE_SAMPLE_RATE=0.01 runs cProfile on 1% of requests and logs the
+# hottest calls (and dumps .prof files to PROFILE_OUTPUT_DIR if set).
+request_profiler = RequestProfiler(
+    sample_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+    output_dir=os.environ.get('PROFILE_OUTPUT_DIR'),
 )
-import joblib
 
-cred = credentials.Certificate("firebase.json")
-firebase_admin.initialize_app(cred)
 
-app = Flask(__name__)
+def record_firestore_commit(collection, n_documents, seconds):
+    FIRESTORE_COMMIT_SECONDS.observe(seconds, collection=collection)
+    FIRESTORE_DOCUMENTS.inc(n_documents, collection=collection)
+
+
+# Connected on first write in each worker process, never in a pre-fork master.
+db = LazyFirestoreClient("firebase.json")
+bulk_writer = BulkWriter(db, on_commit=record_firestore_commit)
+
+FEATURE_PIPELINE_PATH = 'models/feature_pipeline.pkl'
+if not os.path.exists(FEATURE_PIPELINE_PATH):
+    # Models trained before the fused pipeline existed only shipped a scaler.
+    FEATURE_PIPELINE_PATH = 'models/scaler.pkl'
+
+MODEL_PATH = 'models/random_forest_model.npz'
+if not os.path.exists(MODEL_PATH):
+    MODEL_PATH = 'models/random_forest_model.pkl'
+
+model_registry = ModelRegistry(MODEL_PATH, FEATURE_PIPELINE_PATH)
+model_registry.subscribe(lambda snapshot: STAGE_SECONDS.observe(snapshot.load_seconds, stage='model_load'))
+
+# Cross-asset market features, updated as prices are ingested here and
+# synced from price_data every MARKET_SYNC_INTERVAL seconds for prices
+# written by other workers.
+market_features = MarketFeatureEngine(MARKET_COLUMNS)
+market_sync = MarketFeatureSync(db, 'price_data', market_features,
+                                refresh_interval=float(os.environ.get('MARKET_SYNC_INTERVAL', 30)))
+
+# Predictions for the next PREDICTION_TABLE_DAYS days are precomputed for
+# every 0/1 flag combination whenever a model version (or, for models with
+# market features, the market data) changes.
+prediction_tables = PredictionTableService(model_registry, int(os.environ.get('PREDICTION_TABLE_DAYS', 365)),
+                                           market=market_features)
+
+# Concurrent /predict requests are scored together; PREDICT_MAX_WAIT_MS caps
+# how long one request waits for others to join its batch.
+prediction_coalescer = PredictionCoalescer(
+    max_batch=int(os.environ.get('PREDICT_MAX_BATCH', 64)),
+    max_wait=float(os.environ.get('PREDICT_MAX_WAIT_MS', 2)) / 1000,
+)
+
+# ONLINE_TRAINING=1 grows the model on newly ingested rows in the background
+# and publishes it when it does at least as well on the newest of them;
+# models/model1.py is still how the model is trained from scratch.
+model1.db = db
+online_trainer = OnlineTrainer(
+    os.path.dirname(MODEL_PATH),
+    load_rows=lambda: model1.fetch_and_merge_data('sentiment_data', 'price_data'),
+    save_artifacts=model1.save_artifacts,
+    registry=model_registry,
+    min_new_rows=int(os.environ.get('ONLINE_MIN_NEW_ROWS', 5)),
+    max_delay=float(os.environ.get('ONLINE_MAX_DELAY', 3600)),
+    trees_per_update=int(os.environ.get('ONLINE_TREES_PER_UPDATE', 10)),
+) if os.environ.get('ONLINE_TRAINING') == '1' else None
 
-db = firestore.client()
-collection_ref_price = db.collection("price_data")
-collection_ref_sentiment = db.collection("sentiment_data")
+# Labels the flags and Price Sentiment from the headline when a form or
+# batch leaves them out; trained by models/train_headline_labeler.py.
+HEADLINE_LABELER_PATH = os.environ.get('HEADLINE_LABELER_PATH', 'models/headline_labeler.pkl')
+headline_labeler = load_headline_labeler(HEADLINE_LABELER_PATH) if os.path.exists(HEADLINE_LABELER_PATH) else None
+
+BATCH_CHUNK_SIZE = 1024
+
+SENTIMENT_FIELDS = {
+    "Dates": "Date",  # Mapping Dates to Date field
+    "News": "News",
+    "Price Direction Up": "Price Direction Up",
+    "Price Direction Constant": "Price Direction Constant",
+    "Price Direction Down": "Price Direction Down",
+    "Asset Comparison": "Asset Comparison",
+    "Past Information": "Past Information",
+    "Future Information": "Future Information",
+    "Price Sentiment": "Price Sentiment",
+}
+PRICE_FIELDS = {"date": "Date", "adj_close": GOLD_COLUMN}
+# Optional closes of the other markets, keyed by their lowercase form field.
+PRICE_FIELDS.update({column.lower(): column for column in MARKET_COLUMNS if column != GOLD_COLUMN})
+# Date-ordered in-memory copies of both collections for /history/*, kept
+# current by the inserts below and synced every HISTORY_SYNC_INTERVAL
+# seconds for writes from other workers.
+HISTORY_SYNC_INTERVAL = float(os.environ.get('HISTORY_SYNC_INTERVAL', 30))
+HISTORY_MAX_ROWS = 10000
+price_history = HistoryIndex(db, 'price_data', list(PRICE_FIELDS.values()), numeric_fields=MARKET_COLUMNS,
+                             refresh_interval=HISTORY_SYNC_INTERVAL)
+sentiment_history = HistoryIndex(db, 'sentiment_data', list(SENTIMENT_FIELDS.values()), numeric_fields=FLAG_COLUMNS,
+                                 parse_dates=parse_headline_dates, refresh_interval=HISTORY_SYNC_INTERVAL)
+
+# Headlines already stored, exactly or reworded within a day, are skipped
+# on ingestion so they are neither stored twice nor counted twice in the
+# daily aggregates. The index is saved to DEDUP_INDEX_PATH and synced with
+# sentiment_data for headlines written by other workers.
+dedup_index = DedupIndex(
+    os.environ.get('DEDUP_INDEX_PATH', 'Data/.dedup_index.npz'),
+    threshold=float(os.environ.get('DEDUP_NEAR_THRESHOLD', 0.7)),
+)
+
+# Each submitted record is checked against running statistics of what is
+# stored (seeded from the history indexes, updated as writes land) before
+# it is queued: required fields, types, future dates and z-score outliers.
+# Prices are scored by their daily log return from the previous stored
+# close. Daily returns are fat-tailed (real moves reach 6-10 standard
+# deviations) while a misplaced decimal lands in the hundreds, hence the
+# high default threshold.
+VALIDATION_Z_THRESHOLD = float(os.environ.get('VALIDATION_Z_THRESHOLD', 10))
+price_validator = StreamingValidator(
+    [FieldSpec('date', DATE, True), FieldSpec('adj_close', LEVEL, True)]
+    + [FieldSpec(field, LEVEL, False) for field in PRICE_FIELDS if field not in ('date', 'adj_close')],
+    parse_dates=to_days, z_threshold=VALIDATION_Z_THRESHOLD,
+)
+sentiment_validator = StreamingValidator(
+    [FieldSpec('Dates', DATE, True), FieldSpec('News', TEXT, True)]
+    + [FieldSpec(column, BINARY, True) for column in FLAG_COLUMNS]
+    + [FieldSpec(SENTIMENT_COLUMN, CATEGORY, True)],
+    parse_dates=parse_headline_dates, z_threshold=VALIDATION_Z_THRESHOLD,
+)
+
+# Bulk CSV uploads (/upload and Data/app.py) are streamed in chunks of
+# UPLOAD_CHUNK_ROWS rows; progress is kept under UPLOAD_STATE_DIR so an
+# interrupted upload resumes after its last stored chunk.
+UPLOAD_KINDS = ('price', 'sentiment')
+UPLOAD_CHUNK_ROWS = int(os.environ.get('UPLOAD_CHUNK_ROWS', CHUNK_ROWS))
+upload_log = UploadLog(os.environ.get('UPLOAD_STATE_DIR', 'Data/.uploads'))
+
+LABEL_FORM_FIELDS = {
+    "Price Direction Up": "price_direction_up",
+    "Price Direction Constant": "price_direction_constant",
+    "Price Direction Down": "price_direction_down",
+    "Asset Comparison": "asset_Comparison",
+    "Past Information": "past_information",
+    "Future Information": "future_information",
+    "Price Sentiment": "price_sentiment",
+}
 
 def insert_sentiment_data(index_name, data):
-    for index,row in data.iterrows():
-        doc_ref = collection_ref_sentiment.document(str(row['Dates']))  
-        doc_ref.set({
-        "Date": row['Dates'],  # Mapping Dates to Date field
-        "News":row['News'],
-        "Price Direction Up": row['Price Direction Up'],  # Mapping Price Direction Up
-        "Price Direction Constant": row['Price Direction Constant'],  # Mapping Price Direction Constant
-        "Price Direction Down": row['Price Direction Down'],  # Mapping Price Direction Down
-        "Asset Comparison": row['Asset Comparison'],  # Mapping Asset Comparison (corrected typo)
-        "Past Information": row['Past Information'],  # Mapping Past Information
-        "Future Information": row['Future Information'],  # Mapping Future Information
-        "Price Sentiment": row['Price Sentiment']  # Mapping Price Sentiment  
-    })
-    print(f"Document with ID .")
+    # One document per headline, plus its contribution to the daily
+    # aggregates under the same ID, so retried or replayed writes overwrite
+    # rather than count a headline twice.
+    data = data.assign(_doc_id=[headline_document_id(d, n) for d, n in zip(data['Dates'], data['News'])])
+    data = data.drop_duplicates('_doc_id', keep='last')
+    with STAGE_SECONDS.time(stage='dedup'):
+        dedup_index.sync(db, index_name, parse_headline_dates)
+        keep, matches = dedup_index.claim(
+            data['_doc_id'].tolist(), parse_headline_dates(data['Dates'].tolist()), data['News'].tolist())
+    for doc_id, kind, duplicate_of in matches:
+        DUPLICATE_HEADLINES.inc(kind=kind)
+        if kind == NEAR:
+            print(f"Skipping headline {doc_id}: reworded duplicate of {duplicate_of}")
+    data = data[keep]
+    if data.empty:
+        return 0
+    documents = frame_to_documents(data, '_doc_id', SENTIMENT_FIELDS)
+    try:
+        written = bulk_writer.write(index_name, documents)
+        with STAGE_SECONDS.time(stage='daily_sentiment_update'):
+            contributions = contribution_documents(data, '_doc_id')
+        bulk_writer.write(DAILY_SENTIMENT_COLLECTION, contributions)
+    except Exception:
+        # Let a retry of this batch through the index again.
+        dedup_index.discard(data['_doc_id'].tolist())
+        raise
+    dedup_index.maybe_save()
+    with STAGE_SECONDS.time(stage='history_update'):
+        sentiment_history.upsert(documents)
+        sentiment_validator.observe(data)
+    print(f"{written} documents written to {index_name}.")
+    return written
 
 
 def insert_price_data(index_name, data):
-    for index,row in data.iterrows():
-        doc_ref = collection_ref_price.document(str(row['date']))  
-        doc_ref.set({
-        "Date": row['date'],  # Mapping Dates to Date field
-        "Adj Close": row['adj_close'],
-    })
+    # Markets left out of a row are not written, and merging keeps any
+    # closes already stored for that day.
+    data = data.reindex(columns=list(PRICE_FIELDS))
+    documents = [
+        (doc_id, {k: v for k, v in fields.items() if not pd.isna(v)})
+        for doc_id, fields in frame_to_documents(data, 'date', PRICE_FIELDS)
+    ]
+    written = bulk_writer.write(index_name, documents, merge=True)
+    with STAGE_SECONDS.time(stage='history_update'):
+        price_history.upsert(documents)
+        price_validator.observe(data)
+    with STAGE_SECONDS.time(stage='market_features_update'):
+        if len(documents) == 1:
+            market_features.update(documents[0][1]['Date'], documents[0][1])
+        elif documents:
+            market_features.update_many(pd.DataFrame([fields for _, fields in documents]))
+    return written
+
+SENTIMENT_COLUMNS = list(SENTIMENT_FIELDS)
+
+def write_sentiment_records(records):
+    with STAGE_SECONDS.time(stage='dataframe_build'):
+        data = pd.DataFrame(records, columns=SENTIMENT_COLUMNS)
+    insert_sentiment_data('sentiment_data', data)
+    if online_trainer is not None:
+        online_trainer.notify(len(records))
+
+
+def write_price_records(records):
+    with STAGE_SECONDS.time(stage='dataframe_build'):
+        data = pd.DataFrame(records, columns=list(PRICE_FIELDS))
+    insert_price_data('price_data', data)
+    if online_trainer is not None:
+        online_trainer.notify(len(records))
+
+
+ingestion_queue = IngestionQueue(
+    {'sentiment': write_sentiment_records, 'price': write_price_records},
+    spill_path=os.environ.get('INGESTION_SPILL_PATH', 'ingestion_spill.jsonl'),
+)
+
+def labelled_record(record):
+    """record with blank flag/sentiment fields labelled from its News headline."""
+    if headline_labeler is not None:
+        record = headline_labeler.fill(record)
+    missing = [c for c in LABEL_COLUMNS if record.get(c) in (None, '')]
+    if missing:
+        raise ValueError(f"Missing fields: {missing}")
+    return record
+
+
+def seed_validator(validator, history, fields):
+    # The history holds stored field names; the validator checks form records.
+    stored = pd.DataFrame(history.query(), columns=['id'] + list(fields.values()))
+    validator.seed(stored.rename(columns={v: k for k, v in fields.items()}))
+
+
+def validator_for(kind):
+    validator, history, fields = {
+        'price': (price_validator, price_history, PRICE_FIELDS),
+        'sentiment': (sentiment_validator, sentiment_history, SENTIMENT_FIELDS),
+    }[kind]
+    if not validator.seeded:
+        try:
+            with STAGE_SECONDS.time(stage='history_sync'):
+                history.refresh()
+            seed_validator(validator, history, fields)
+        except Exception as e:
+            print(f"Validation statistics could not be seeded: {e}")
+    return validator
+
+
+def validation_issues(kind, record):
+    """Problems found in one submitted record, each counted in REJECTED_RECORDS."""
+    validator = validator_for(kind)
+    with STAGE_SECONDS.time(stage='validation'):
+        issues = validator.validate(record)
+    for issue in issues:
+        REJECTED_RECORDS.inc(kind=kind, problem=issue.problem)
+    return issues
+
+
+def prepare_upload_chunk(kind, frame):
+    """The rows of an uploaded chunk to store, keyed like form records, and the problems of the rest."""
+    fields = PRICE_FIELDS if kind == 'price' else SENTIMENT_FIELDS
+    # Columns may carry the stored names (as in Data/*.csv) or the form names.
+    frame = frame.rename(columns={'Asset Comparision': 'Asset Comparison'})
+    frame = frame.rename(columns={stored: field for field, stored in fields.items()
+                                  if stored != field and field not in frame.columns})
+    if kind == 'sentiment' and headline_labeler is not None and 'News' in frame:
+        with STAGE_SECONDS.time(stage='headline_labels'):
+            frame = headline_labeler.fill_frame(frame)
+    frame = frame.reindex(columns=list(fields))
+    with STAGE_SECONDS.time(stage='validation'):
+        valid, problems = validator_for(kind).validate_frame(frame)
+    for problem, count in problems.items():
+        REJECTED_RECORDS.inc(count, kind=kind, problem=problem)
+    frame = frame[valid]
+    if kind == 'price':
+        # Same ISO document IDs as /pricedata submissions.
+        frame = frame.assign(date=to_days(frame['date'].to_numpy(dtype=object)).astype(str))
+    else:
+        frame = frame.astype({column: 'int64' for column in FLAG_COLUMNS})
+    return frame, problems
+
+
+def write_upload_chunk(kind, frame):
+    if frame.empty:
+        return 0
+    if kind == 'price':
+        written = insert_price_data('price_data', frame)
+    else:
+        written = insert_sentiment_data('sentiment_data', frame)
+    if online_trainer is not None:
+        online_trainer.notify(len(frame))
+    return written
+
+
+def upload_csv(kind, upload_id, blocks, restart=False, on_chunk=None):
+    """Store a CSV arriving as byte blocks, resuming upload_id after its last stored chunk."""
+    return run_upload(upload_log, upload_id, kind, blocks,
+                      lambda frame: prepare_upload_chunk(kind, frame),
+                      lambda frame: write_upload_chunk(kind, frame),
+                      UPLOAD_CHUNK_ROWS, restart, on_chunk)
+
+
+def missing_input_columns(columns):
+    missing = [c for c in INPUT_COLUMNS if c not in columns]
+    if headline_labeler is not None and 'News' in columns:
+        missing = [c for c in missing if c not in LABEL_COLUMNS]
+    return missing
+
+
+def warm_up():
+    """Load the model and build its prediction table in this process.
+
+    The pre-forking server calls this in the master before starting workers,
+    so they all share the loaded arrays copy-on-write instead of each loading
+    its own copy on its first request. Data is read through a throwaway
+    client, so no Firestore channel is left open for the workers to inherit;
+    they connect on their own and only fetch what changed since.
+    """
+    try:
+        with db.throwaway():
+            market_sync.refresh(force=True)
+            price_history.refresh(force=True)
+            sentiment_history.refresh(force=True)
+            seed_validator(price_validator, price_history, PRICE_FIELDS)
+            seed_validator(sentiment_validator, sentiment_history, SENTIMENT_FIELDS)
+            dedup_index.sync(db, 'sentiment_data', parse_headline_dates, force=True)
+    except Exception as e:
+        print(f"Market data or history could not be loaded during warm-up: {e}")
+    try:
+        snapshot = model_registry.get()
+    except Exception as e:
+        print(f"Model could not be loaded during warm-up: {e}")
+        return False
+    prediction_tables.wait()
+    # Workers start their own watcher threads; the master's is not needed.
+    model_registry.stop()
+    print(f"Warmed up model version {snapshot.version}")
+    return True
+
+
+def refresh_market_features():
+    try:
+        with STAGE_SECONDS.time(stage='market_sync'):
+            market_sync.refresh()
+    except Exception as e:
+        # Serve from the features already held rather than fail the request.
+        print(f"Market data could not be refreshed: {e}")
+
 
 def make_prediction(input_data):
     try:
-        model = joblib.load('models/random_forest_model.pkl')
+        snapshot = model_registry.get()
     except Exception as e:
         return f"Model could not be loaded: {e}"
 
-    if model is None:
+    model, features = snapshot.model, snapshot.features
+    if model is None or features is None:
         return "Model could not be loaded."
+    if features.market_columns:
+        refresh_market_features()
 
-    prediction_input = pd.DataFrame([{
-        "Date": input_data["Date"],
-        "Price Direction Up": input_data["Price Direction Up"],
-        "Price Direction Constant": input_data["Price Direction Constant"],
-        "Price Direction Down": input_data["Price Direction Down"],
-        "Asset Comparison": input_data["Asset Comparison"],
-        "Past Information": input_data["Past Information"],
-        "Future Information": input_data["Future Information"],
-        "Price Sentiment": input_data["Price Sentiment"]
-    }])
-    
-    prediction_input["Date"] = pd.to_datetime(input_data["Date"])
-
-    prediction_input['Year'] = prediction_input['Date'].dt.year
-    prediction_input['Month'] = prediction_input['Date'].dt.month
-    prediction_input['Day'] = prediction_input['Date'].dt.day
-    prediction_input['DayOfWeek'] = prediction_input['Date'].dt.dayofweek
-    prediction_input['WeekOfYear'] = prediction_input['Date'].dt.isocalendar().week
-    
-    prediction_input.drop(columns=["Date"], inplace=True)
-
-    prediction_input['Price Sentiment'] = prediction_input['Price Sentiment'].apply(lambda x: 0 if x == 'negative' else 1)
-
-    prediction_input = prediction_input[[
-        'Year', 'Month', 'Day', 'DayOfWeek', 'WeekOfYear',
-        'Price Direction Up', 'Price Direction Constant', 
-        'Price Direction Down', 'Asset Comparison', 
-        'Past Information', 'Future Information', 
-        'Price Sentiment'
-    ]]
-
-    prediction = model.predict(prediction_input)  
-
-    return f"Predicted Price Sentiment: {prediction[0]}"
+    with STAGE_SECONDS.time(stage='table_lookup'):
+        prediction = prediction_tables.lookup(input_data, snapshot)
+    if prediction is not None:
+        return f"Predicted Price Sentiment: {prediction}"
+
+    try:
+        with STAGE_SECONDS.time(stage='feature_build'):
+            market = market_features.features_for([input_data['Date']], features.market_columns)
+            prediction_input = features.transform_records([input_data], market)
+    except ValueError as ve:
+        return f"Error: Invalid input - {ve}"
+
+    with STAGE_SECONDS.time(stage='predict'):
+        prediction = prediction_coalescer.predict(prediction_input[0], model)
+
+    return f"Predicted Price Sentiment: {prediction}"
+
+
+def read_batch_chunks(stream, content_type):
+    if 'csv' in content_type:
+        yield from pd.read_csv(stream, chunksize=BATCH_CHUNK_SIZE)
+        return
+
+    rows = []
+    for line in io.TextIOWrapper(stream, encoding='utf-8'):
+        if not line.strip():
+            continue
+        rows.append(json.loads(line))
+        if len(rows) == BATCH_CHUNK_SIZE:
+            yield pd.DataFrame(rows)
+            rows = []
+    if rows:
+        yield pd.DataFrame(rows)
+
+
+def predict_batch(model, features, chunks, as_csv):
+    if features.market_columns:
+        refresh_market_features()
+    if as_csv:
+        yield 'Date,prediction\n'
+    for chunk in chunks:
+        missing = missing_input_columns(chunk.columns)
+        if missing:
+            raise ValueError(f"Missing columns: {missing}")
+        if headline_labeler is not None and 'News' in chunk.columns:
+            with STAGE_SECONDS.time(stage='batch_headline_labels'):
+                chunk = headline_labeler.fill_frame(chunk)
+
+        with STAGE_SECONDS.time(stage='batch_feature_build'):
+            market = market_features.features_for(chunk['Date'].to_numpy(), features.market_columns)
+            X, valid = features.transform_frame(chunk, market)
+        predictions = np.full(len(chunk), np.nan)
+        if valid.any():
+            with STAGE_SECONDS.time(stage='batch_predict'):
+                predictions[valid] = model.predict(X[valid])
+
+        if as_csv:
+            out = pd.DataFrame({'Date': chunk['Date'], 'prediction': predictions})
+            yield out.to_csv(index=False, header=False)
+        else:
+            yield ''.join(
+                json.dumps({'Date': str(date), 'prediction': None if np.isnan(p) else float(p)}) + '\n'
+                for date, p in zip(chunk['Date'], predictions)
+            )
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    g.profiler = request_profiler.start()
+    REQUESTS_IN_FLIGHT.inc()
+
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    # Streamed responses (stream_with_context) are torn down twice: when the
+    # view returns and again once the body has been sent. Popping the start
+    # time records each request once, on the first teardown, so a streamed
+    # response's time covers the view but not the body streamed after it.
+    start = g.pop('request_start', None)
+    if start is None:
+        return
+    endpoint = request.endpoint or 'unmatched'
+    REQUESTS_IN_FLIGHT.dec()
+    REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    REQUEST_COUNT.inc(endpoint=endpoint, method=request.method, status=g.get('response_status', 500))
+    if g.profiler is not None:
+        request_profiler.finish(g.profiler, request.path)
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/healthz')
+def healthz():
+    return jsonify(status="ok")
+
+
+@app.route('/readyz')
+def readyz():
+    try:
+        snapshot = model_registry.get()
+    except Exception as e:
+        return jsonify(ready=False, error=f"Model could not be loaded: {e}"), 503
+    table = prediction_tables.table
+    return jsonify(
+        ready=True,
+        model_version=snapshot.version,
+        prediction_table=table is not None and table.version == snapshot.version,
+        online_update=online_trainer.last_result if online_trainer is not None else None,
+    )
+
+
+@app.route('/market/features')
+def market_features_endpoint():
+    refresh_market_features()
+    days = market_features.days
+    return jsonify(
+        version=market_features.version,
+        last_date=str(days[-1]) if len(days) else None,
+        features={name: None if np.isnan(value) else value for name, value in market_features.latest().items()},
+    )
+
+
+def history_response(history):
+    start, end = request.args.get('start'), request.args.get('end')
+    try:
+        for value in (start, end):
+            if value is not None:
+                pd.to_datetime(value, format='%Y-%m-%d', errors='raise')
+        latest = request.args.get('latest', type=int)
+    except ValueError as ve:
+        return jsonify(error=f"Invalid input - {ve}"), 400
+    if latest is not None and latest < 0:
+        return jsonify(error="Invalid input - latest must not be negative"), 400
+    try:
+        with STAGE_SECONDS.time(stage='history_sync'):
+            history.refresh()
+    except Exception as e:
+        print(f"History could not be refreshed: {e}")
+
+    with STAGE_SECONDS.time(stage='history_query'):
+        # Beyond HISTORY_MAX_ROWS only the most recent rows are returned.
+        limit = HISTORY_MAX_ROWS if latest is None else min(latest, HISTORY_MAX_ROWS)
+        rows = history.query(start, end, limit)
+    return jsonify(count=len(rows), rows=rows)
+
+
+@app.route('/history/price')
+def price_history_endpoint():
+    return history_response(price_history)
+
+
+@app.route('/history/sentiment')
+def sentiment_history_endpoint():
+    return history_response(sentiment_history)
 
 
 @app.route('/')
@@ -94,30 +569,24 @@ def index():
 @app.route('/sentiment', methods=['GET', 'POST'])
 def sentiment():
     if request.method == 'POST':
-        sentiment_data = [
-            request.form['dates'],
-            request.form['news'],
-            request.form['price_direction_up'],
-            request.form['price_direction_constant'],
-            request.form['price_direction_down'],
-            request.form['asset_Comparison'],
-            request.form['past_information'],
-            request.form['future_information'],
-            request.form['price_sentiment']
-        ]
-
-        sentiment_df = pd.DataFrame([sentiment_data], columns=[
-            "Dates", "News", "Price Direction Up", "Price Direction Constant",
-            "Price Direction Down", "Asset Comparison", "Past Information",
-            "Future Information", "Price Sentiment"
-        ])
-        #missing_values = check_missing_values(sentiment_df)
-        #outliers = detect_outliers(sentiment_df)
-        #clean_data = clean_data(sentiment_df, outliers)
-        #sentiment_data_cleaned = remove_duplicates(clean_data)
-
-        insert_sentiment_data('sentiment_data', sentiment_df)
-        return redirect(url_for('index'))
+        sentiment_record = {"Dates": request.form['dates'], "News": request.form['news']}
+        for column, field in LABEL_FORM_FIELDS.items():
+            sentiment_record[column] = request.form.get(field, '').strip()
+        try:
+            with STAGE_SECONDS.time(stage='headline_labels'):
+                sentiment_record = labelled_record(sentiment_record)
+        except ValueError as ve:
+            return f"Error: Invalid input - {ve}", 400
+        issues = validation_issues('sentiment', sentiment_record)
+        if issues:
+            return f"Error: Invalid input - {describe_issues(issues)}", 400
+
+        try:
+            ingestion_id = ingestion_queue.submit(
+                'sentiment', headline_document_id(sentiment_record['Dates'], sentiment_record['News']), sentiment_record)
+        except IngestionQueueFull:
+            return "Error: Too many pending submissions, please retry shortly.", 503
+        return redirect(url_for('index', ingestion_id=ingestion_id))
 
     return render_template('sentiment.html')
 
@@ -131,41 +600,81 @@ def pricedata():
             pd.to_datetime(date, format='%Y-%m-%d', errors='raise')
 
             price_data = {'date': date, 'adj_close': adj_close}
-            
-            price_df = pd.DataFrame([price_data])
+            for field in PRICE_FIELDS:
+                value = request.form.get(field, '').strip()
+                if field not in price_data and value:
+                    price_data[field] = float(value)
+            issues = validation_issues('price', price_data)
+            if issues:
+                raise ValueError(describe_issues(issues))
 
-            insert_price_data('price_data', price_df)
-            return redirect(url_for('pricedata'))
+            ingestion_id = ingestion_queue.submit('price', date, price_data)
+            return redirect(url_for('pricedata', ingestion_id=ingestion_id))
+
+        except IngestionQueueFull:
+            return "Error: Too many pending submissions, please retry shortly.", 503
 
         except ValueError as ve:
             return f"Error: Invalid input - {str(ve)}"
 
     return render_template('pricedata.html')
 
+@app.route('/ingestion/<ingestion_id>')
+def ingestion_status(ingestion_id):
+    status = ingestion_queue.status(ingestion_id)
+    if status is None:
+        return jsonify(error="Unknown ingestion ID"), 404
+    return jsonify(status)
+
+def upload_state(upload_id):
+    try:
+        return upload_log.load(upload_id)
+    except ValueError:
+        return None
+
+@app.route('/upload', methods=['POST'])
+def upload():
+    kind = request.args.get('kind')
+    if kind not in UPLOAD_KINDS:
+        return jsonify(error=f"Invalid input - kind must be one of {list(UPLOAD_KINDS)}"), 400
+    upload_id = request.args.get('upload_id') or uuid.uuid4().hex
+    if request.mimetype == 'multipart/form-data':
+        boundary = request.mimetype_params.get('boundary')
+        if not boundary:
+            return jsonify(error="Invalid input - multipart body without a boundary"), 400
+        blocks = multipart_file_blocks(request.stream, boundary.encode(), request.args.get('field', 'file'))
+    else:
+        blocks = iter(lambda: request.stream.read(BLOCK_SIZE), b'')
+
+    try:
+        state = upload_csv(kind, upload_id, blocks, restart=request.args.get('restart') == '1')
+    except UploadConflict as e:
+        return jsonify(error=str(e), upload=upload_state(upload_id)), 409
+    except ValueError as ve:
+        return jsonify(error=f"Invalid input - {ve}", upload=upload_state(upload_id)), 400
+    except Exception as e:
+        return jsonify(error=f"Upload failed, retry with upload_id={upload_id} to resume: {e}",
+                       upload=upload_state(upload_id)), 503
+    return jsonify(state)
+
+@app.route('/upload/<upload_id>')
+def upload_status(upload_id):
+    state = upload_state(upload_id)
+    if state is None:
+        return jsonify(error="Unknown upload ID"), 404
+    return jsonify(state)
+
 @app.route('/predict', methods=['GET', 'POST'])
 def predict():
     if request.method == 'POST':
-        date = request.form['date']
-        news = request.form['news']
-        price_direction_up = int(request.form['price_direction_up'])
-        price_direction_constant = int(request.form['price_direction_constant'])
-        price_direction_down = int(request.form['price_direction_down'])
-        asset_Comparison = request.form['asset_Comparison']
-        past_information = request.form['past_information']
-        future_information = request.form['future_information']
-        price_sentiment = request.form['price_sentiment']
-        
-        input_data = {
-            "Date": date,
-            "News": news,
-            "Price Direction Up": price_direction_up,
-            "Price Direction Constant": price_direction_constant,
-            "Price Direction Down": price_direction_down,
-            "Asset Comparison": asset_Comparison,
-            "Past Information": past_information,
-            "Future Information": future_information,
-            "Price Sentiment": price_sentiment
-        }
+        input_data = {"Date": request.form['date'], "News": request.form['news']}
+        for column, field in LABEL_FORM_FIELDS.items():
+            input_data[column] = request.form.get(field, '').strip()
+        try:
+            with STAGE_SECONDS.time(stage='headline_labels'):
+                input_data = labelled_record(input_data)
+        except ValueError as ve:
+            return render_template('prediction_result.html', prediction=f"Error: Invalid input - {ve}")
 
         prediction = make_prediction(input_data)
         print(input_data)
@@ -174,6 +683,32 @@ def predict():
 
     return render_template('prediction_form.html')
 
+@app.route('/predict/batch', methods=['POST'])
+def predict_batch_route():
+    try:
+        snapshot = model_registry.get()
+    except Exception as e:
+        return jsonify(error=f"Model could not be loaded: {e}"), 503
+    if snapshot.features is None:
+        return jsonify(error="Feature pipeline could not be loaded."), 503
+
+    content_type = request.content_type or ''
+    as_csv = 'csv' in content_type
+    chunks = read_batch_chunks(request.stream, content_type)
+    try:
+        first = next(chunks, None)
+    except ValueError as ve:
+        return jsonify(error=f"Invalid input - {ve}"), 400
+    if first is None:
+        return jsonify(error="Empty batch"), 400
+    missing = missing_input_columns(first.columns)
+    if missing:
+        return jsonify(error=f"Missing columns: {missing}"), 400
+
+    chunks = itertools.chain([first], chunks)
+    mimetype = 'text/csv' if as_csv else 'application/x-ndjson'
+    return Response(stream_with_context(predict_batch(snapshot.model, snapshot.features, chunks, as_csv)), mimetype=mimetype)
+
 
 if __name__ == "__main__":
     app.run(debug=True)
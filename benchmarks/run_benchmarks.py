@@ -0,0 +1,320 @@
+"""Offline benchmarks for the prediction, ingestion, preprocessing and training paths.
+
+Everything runs against the in-memory Firestore stand-in and the bundled
+Data/price.csv and Data/sentiment.csv, synthetically scaled. Run from the
+repository root:
+
+    python benchmarks/run_benchmarks.py --scales 1 10 100
+    python benchmarks/run_benchmarks.py --baseline benchmarks/results/<earlier>.json
+
+Results are written as JSON; with --baseline, timings more than --tolerance
+slower than the baseline are reported and the exit status is 1.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+os.environ['FIRESTORE_BACKEND'] = 'memory'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import numpy as np
+import pandas as pd
+
+WORK_DIR = tempfile.mkdtemp(prefix='gold-bench-')
+os.environ['COLLECTION_CACHE_DIR'] = os.path.join(WORK_DIR, 'collection_cache')
+os.environ['INGESTION_SPILL_PATH'] = os.path.join(WORK_DIR, 'ingestion_spill.jsonl')
+os.environ['DEDUP_INDEX_PATH'] = os.path.join(WORK_DIR, 'dedup_index.npz')
+
+import app
+from Data.dataPreprocessing import detect_outliers, load_data, profile_data, remove_duplicates
+from Data.dedup_index import DedupIndex
+from Data.firestore_bulk import BulkWriter, InMemoryFirestore, frame_to_documents
+from models import model1
+from models.daily_sentiment import DAILY_SENTIMENT_COLLECTION, DailySentiment, headline_document_id
+from models.features import FLAG_COLUMNS
+from models.prediction_table import PredictionTableService
+from models.registry import ModelRegistry
+
+logging.disable(logging.INFO)
+
+SENTIMENT_CSV = os.path.join(ROOT, 'Data', 'sentiment.csv')
+PRICE_CSV = os.path.join(ROOT, 'Data', 'price.csv')
+YEAR_SHIFT_DAYS = 366 * 8  # longer than the bundled history, so scaled copies never collide
+
+
+def timed(fn, repeat=1):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    stats = {
+        'mean_s': statistics.fmean(samples),
+        'p50_s': samples[len(samples) // 2],
+        'p99_s': samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+        'runs': repeat,
+    }
+    return stats, result
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': elapsed, 'peak_mb': peak / 2 ** 20}, result
+
+
+def shift_dates(values, days, fmt):
+    parsed = pd.to_datetime(values, format=fmt, errors='coerce')
+    shifted = (parsed + pd.Timedelta(days=days)).dt.strftime(fmt)
+    return shifted.where(parsed.notna(), values)
+
+
+def scaled_sentiment(scale):
+    base = pd.read_csv(SENTIMENT_CSV)
+    copies = [base.assign(Dates=shift_dates(base['Dates'], i * YEAR_SHIFT_DAYS, '%d-%m-%Y')) for i in range(scale)]
+    return pd.concat(copies, ignore_index=True)
+
+
+def scaled_price(scale):
+    base = pd.read_csv(PRICE_CSV)
+    copies = [base.assign(Date=shift_dates(base['Date'], i * YEAR_SHIFT_DAYS, '%Y-%m-%d')) for i in range(scale)]
+    return pd.concat(copies, ignore_index=True)
+
+
+def seed_store(db, sentiment, price):
+    writer = BulkWriter(db)
+    sentiment = sentiment.rename(columns={'Asset Comparision': 'Asset Comparison'})
+    sentiment['_doc_id'] = [headline_document_id(d, n) for d, n in zip(sentiment['Dates'], sentiment['News'])]
+    writer.write('sentiment_data', frame_to_documents(sentiment, '_doc_id', app.SENTIMENT_FIELDS))
+    writer.write(DAILY_SENTIMENT_COLLECTION, DailySentiment.aggregate(sentiment).documents())
+    writer.write('price_data', frame_to_documents(price, 'Date', {'Date': 'Date', 'Adj Close': 'Adj Close'}))
+
+
+def bench_preprocessing(scale):
+    sentiment = scaled_sentiment(scale)
+    price = scaled_price(scale)
+    paths = {
+        'sentiment': os.path.join(WORK_DIR, f'sentiment_x{scale}.csv'),
+        'price': os.path.join(WORK_DIR, f'price_x{scale}.csv'),
+    }
+    sentiment.to_csv(paths['sentiment'], index=False)
+    price.to_csv(paths['price'], index=False)
+    del sentiment, price
+
+    results = {}
+    for name, path in paths.items():
+        def in_memory():
+            data = load_data(path)
+            outliers = detect_outliers(data)
+            return remove_duplicates(data[~data.index.isin(outliers.index)])
+
+        def streaming():
+            return profile_data(path, cache_dir=os.path.join(WORK_DIR, 'csv_cache'))
+
+        results[f'{name}_load_outliers_duplicates'], _ = quiet(lambda: peak_memory(in_memory))
+        results[f'{name}_profile_streaming_cold'], _ = quiet(lambda: peak_memory(streaming))
+        results[f'{name}_profile_streaming_cached'], _ = quiet(lambda: peak_memory(streaming))
+    return results
+
+
+def bench_ingestion(scale):
+    sentiment = scaled_sentiment(scale)
+    sentiment = sentiment.rename(columns={'Asset Comparision': 'Asset Comparison'}).drop(columns=['URL'])
+    price = scaled_price(scale)[['Date', 'Adj Close']].rename(columns={'Date': 'date', 'Adj Close': 'adj_close'})
+
+    results = {}
+    app.db = InMemoryFirestore()
+    app.bulk_writer = BulkWriter(app.db)
+    app.dedup_index = DedupIndex()
+    stats, _ = timed(lambda: quiet(lambda: app.insert_sentiment_data('sentiment_data', sentiment)))
+    results['insert_sentiment_data'] = dict(stats, rows=len(sentiment), rows_per_s=len(sentiment) / stats['mean_s'])
+    stats, _ = timed(lambda: app.insert_price_data('price_data', price))
+    results['insert_price_data'] = dict(stats, rows=len(price), rows_per_s=len(price) / stats['mean_s'])
+    return results
+
+
+def bench_training(scale):
+    shutil.rmtree(os.environ['COLLECTION_CACHE_DIR'], ignore_errors=True)
+    model1.db = InMemoryFirestore()
+    seed_store(model1.db, scaled_sentiment(scale), scaled_price(scale))
+
+    results = {}
+    results['fetch_and_merge_cold'], merged = timed(lambda: quiet(
+        lambda: model1.fetch_and_merge_data('sentiment_data', 'price_data')))
+    results['fetch_and_merge_incremental'], merged = timed(lambda: quiet(
+        lambda: model1.fetch_and_merge_data('sentiment_data', 'price_data')))
+
+    results['preprocess'], prepared = timed(lambda: model1.preprocess_data_with_date(merged))
+    X_train, X_test, y_train, y_test, pipeline = prepared
+    results['train'], model = timed(lambda: model1.train_random_forest_model(X_train, y_train))
+    results['train']['rows'] = len(X_train)
+
+    artifacts = os.path.join(WORK_DIR, f'artifacts_x{scale}')
+    os.makedirs(artifacts, exist_ok=True)
+    results['save_artifacts'], _ = timed(lambda: model1.save_artifacts(model, pipeline, X_test, artifacts))
+    return results, artifacts
+
+
+def prediction_input(date):
+    record = {'Date': date, 'News': 'gold rises', 'Price Sentiment': 'positive'}
+    record.update({column: 0 for column in FLAG_COLUMNS})
+    record['Price Direction Up'] = 1
+    return record
+
+
+def expect_prediction(result):
+    # An error message would time the failure path instead of a prediction.
+    if not str(result).startswith('Predicted Price Sentiment'):
+        raise RuntimeError(f"Benchmark prediction failed: {result}")
+    return result
+
+
+def bench_prediction(artifacts, batch_rows, scale):
+    model_path = os.path.join(artifacts, 'random_forest_model.npz')
+    pickle_path = os.path.join(artifacts, 'random_forest_model.pkl')
+    features_path = os.path.join(artifacts, 'feature_pipeline.pkl')
+    results = {}
+    # The models were trained with market features, which predictions look
+    # up in the app's engine.
+    app.market_features.load(scaled_price(scale))
+
+    for name, path in [('compiled', model_path), ('pickle', pickle_path)]:
+        def cold():
+            app.model_registry = ModelRegistry(path, features_path, poll_interval=0)
+            return app.make_prediction(prediction_input('2015-06-01'))
+
+        results[f'make_prediction_cold_{name}'], result = timed(cold)
+        expect_prediction(result)
+        results[f'make_prediction_warm_live_{name}'], _ = timed(
+            lambda: app.make_prediction(prediction_input('2015-06-01')), repeat=500)
+
+    def build_table():
+        app.model_registry = ModelRegistry(model_path, features_path, poll_interval=0)
+        app.prediction_tables = PredictionTableService(app.model_registry, market=app.market_features)
+        app.model_registry.get()
+        if not wait_for(lambda: app.prediction_tables.table is not None):
+            raise RuntimeError("Prediction table was not built")
+
+    results['prediction_table_build'], _ = timed(build_table)
+    today = str(np.datetime64('today', 'D'))
+    if app.prediction_tables.lookup(prediction_input(today), app.model_registry.get()) is None:
+        raise RuntimeError("Prediction table does not answer for today")
+    expect_prediction(app.make_prediction(prediction_input(today)))
+    results['make_prediction_warm_table'], _ = timed(lambda: app.make_prediction(prediction_input(today)), repeat=2000)
+
+    header = ','.join(['Date'] + FLAG_COLUMNS + ['Price Sentiment']) + '\n'
+    dates = pd.date_range('2012-01-01', periods=batch_rows, freq='h').strftime('%Y-%m-%d')
+    body = header + ''.join(f'{d},1,0,0,1,0,1,positive\n' for d in dates)
+    client = app.app.test_client()
+
+    def batch():
+        response = client.post('/predict/batch', data=body, content_type='text/csv')
+        return response.get_data()
+
+    stats, _ = timed(batch, repeat=3)
+    results['predict_batch'] = dict(stats, rows=batch_rows, rows_per_s=batch_rows / stats['mean_s'])
+    return results
+
+
+def wait_for(condition, timeout=120):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def quiet(fn):
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return fn()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+
+    def walk(current, previous, path):
+        for key, value in current.items():
+            if key not in previous:
+                continue
+            if isinstance(value, dict):
+                walk(value, previous[key], path + [key])
+            elif key.endswith('_s') or key == 'seconds':
+                if previous[key] > 0 and value > previous[key] * (1 + tolerance):
+                    regressions.append(f"{'/'.join(path + [key])}: {previous[key]:.6f}s -> {value:.6f}s")
+
+    walk(results['benchmarks'], baseline['benchmarks'], [])
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--batch-rows', type=int, default=10000)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'cpu_count': os.cpu_count(),
+        'benchmarks': {},
+    }
+    try:
+        for scale in args.scales:
+            print(f"Scale x{scale}")
+            scale_results = {}
+            scale_results['preprocessing'] = bench_preprocessing(scale)
+            scale_results['ingestion'] = bench_ingestion(scale)
+            scale_results['training'], artifacts = bench_training(scale)
+            scale_results['prediction'] = bench_prediction(artifacts, args.batch_rows, scale)
+            results['benchmarks'][f'x{scale}'] = scale_results
+            print(json.dumps(scale_results, indent=2))
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        ROOT, 'benchmarks', 'results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
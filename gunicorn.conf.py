@@ -0,0 +1,37 @@
+import multiprocessing
+import os
+
+# Production server: `gunicorn -c gunicorn.conf.py app:app` (see Procfile).
+# The app is imported and warmed up once in the master, then forked, so the
+# workers share the model and prediction table pages copy-on-write.
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Several threads per worker let concurrent /predict calls share a batch.
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = 'gthread'
+preload_app = True
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+accesslog = '-'
+
+
+def when_ready(server):
+    # Runs in the master after the preloaded app is imported and before any
+    # worker is forked.
+    from app import warm_up
+    warm_up()
+
+
+def post_fork(server, worker):
+    # Claim this worker's journal and replay what earlier workers left
+    # unwritten as soon as it starts, not on its first write.
+    from app import ingestion_queue
+    ingestion_queue.start()
+
+
+def worker_exit(server, worker):
+    # Drain this worker's queued Firestore writes; anything left stays in its
+    # journal and is replayed by the next worker to start.
+    from app import ingestion_queue
+    ingestion_queue.close(timeout=graceful_timeout)
@@ -1,16 +1,26 @@
+import argparse
+import os
+import sys
 from flask import Flask, render_template, request, redirect, url_for
-from elasticsearch import Elasticsearch, helpers
 import pandas as pd
 import joblib
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Data.dataPreprocessing import iter_chunks
+from Data.es_bulk import BulkIndexer, backfill, get_es_client
+
 
 app = Flask(__name__)
 
-es = Elasticsearch(
-    hosts=["https://localhost:9200"],
+# One pooled keep-alive client and one buffered indexer shared by all
+# requests; submissions are sent in bulk every ES_FLUSH_INTERVAL seconds or
+# as soon as a full request has built up.
+es = get_es_client(
+    hosts=os.environ.get('ES_HOSTS', "https://localhost:9200").split(','),
     basic_auth=("elastic", "d3ozO4B7tEJK5Jj4U9*L"),  
     verify_certs=False
 )
+es_indexer = BulkIndexer(es, flush_interval=float(os.environ.get('ES_FLUSH_INTERVAL', 1.0)))
 
 
 def insert_price_data(index_name, data):
@@ -19,15 +29,8 @@ def insert_price_data(index_name, data):
         "Adj Close": float(data["adj_close"])
     }
 
-    action = {
-        "_op_type": "index", 
-        "_index": index_name,  
-        "_id": document["Date"],  
-        "_source": document  
-    }
-
-    helpers.bulk(es, [action])
-    print(f"Document with ID {document['Date']} inserted successfully into {index_name}.")
+    es_indexer.index(index_name, document["Date"], document)
+    print(f"Document with ID {document['Date']} queued for {index_name}.")
 
 def make_prediction(input_data):
     try:
@@ -102,7 +105,7 @@ def predict():
         price_direction_up = int(request.form['price_direction_up'])
         price_direction_constant = int(request.form['price_direction_constant'])
         price_direction_down = int(request.form['price_direction_down'])
-        asset_Comparision = request.form['asset_Comparision']
+        asset_Comparision = request.form['asset_Comparison']
         past_information = request.form['past_information']
         future_information = request.form['future_information']
         price_sentiment = request.form['price_sentiment']
@@ -141,16 +144,9 @@ def insert_sentiment_data(index_name, data):
     ]:
         document[key] = int(document[key])
 
-    action = {
-        "_op_type": "index", 
-        "_index": index_name,  
-        "_id": document["Dates"], 
-        "_source": document  
-    }
+    es_indexer.index(index_name, document["Dates"], document)
 
-    helpers.bulk(es, [action])
-
-    print(f"Document with ID {document['Dates']} inserted successfully into {index_name}.")
+    print(f"Document with ID {document['Dates']} queued for {index_name}.")
 
 @app.route('/')
 def index():
@@ -165,7 +161,7 @@ def sentiment():
             request.form['price_direction_up'],
             request.form['price_direction_constant'],
             request.form['price_direction_down'],
-            request.form['asset_Comparision'],
+            request.form['asset_Comparison'],
             request.form['past_information'],
             request.form['future_information'],
             request.form['price_sentiment']
@@ -187,5 +183,47 @@ def sentiment():
     return render_template('sentiment.html')
 
 
+SENTIMENT_FIELDS = [
+    "Dates", "News", "Price Direction Up", "Price Direction Constant",
+    "Price Direction Down", "Asset Comparision", "Past Information",
+    "Future Information", "Price Sentiment"
+]
+
+def csv_documents(path, id_column, usecols):
+    """(doc_id, source) pairs for the rows of a CSV, read a chunk at a time."""
+    for chunk in iter_chunks(path, usecols=usecols):
+        # Elasticsearch rejects NaN, so blanks are sent as null.
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        yield from zip(chunk[id_column].astype(str), chunk.to_dict('records'))
+
+
+def backfill_from_csv(sentiment_path, price_path, thread_count=4):
+    """Index the bundled CSVs over parallel bulk streams; returns the failures."""
+    failures = []
+    for index_name, path, id_column, usecols in [
+        ('sentiment_data', sentiment_path, 'Dates', lambda c: c in SENTIMENT_FIELDS),
+        ('price_data', price_path, 'Date', ['Date', 'Adj Close']),
+    ]:
+        documents = csv_documents(path, id_column, usecols)
+        indexed, failed = backfill(es, index_name, documents, thread_count=thread_count)
+        print(f"{indexed} documents indexed into {index_name}, {len(failed)} failed.")
+        failures += failed
+    return failures
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backfill', action='store_true', help="index Data/sentiment.csv and Data/price.csv, then exit")
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    if args.backfill:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        failures = backfill_from_csv(os.path.join(root, 'Data', 'sentiment.csv'),
+                                     os.path.join(root, 'Data', 'price.csv'), args.threads)
+        sys.exit(1 if failures else 0)
+
+    try:
+        app.run(debug=True)
+    finally:
+        es_indexer.close()
@@ -0,0 +1,227 @@
+"""Walk-forward backtests of the price model over the merged history.
+
+The history is replayed in date order: each fold fits on the rows before
+its origin (all of them, or the last train_size for a sliding window) and
+predicts the next `step` trading days, then the origin moves on by step.
+With step=1 every day is predicted by a model fitted the day before.
+
+    python models/backtest.py --from-csv --step 20 --max-mae 2.5 --min-hit-rate 0.5
+
+exits 1 when a gate fails, so it can run nightly before a model is
+published.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.features import to_days
+from models.training import SharedArray, init_worker, worker_arrays
+
+logger = logging.getLogger(__name__)
+
+EXPANDING = 'expanding'
+SLIDING = 'sliding'
+DEFAULT_PARAMS = {'n_estimators': 100}
+CACHE_VERSION = 1
+
+
+def walk_forward_folds(n_samples, step=20, min_train_size=250, window=EXPANDING, train_size=None):
+    """(train_start, train_end, test_end) row bounds for date-ordered rows.
+
+    Origins sit at min_train_size, min_train_size + step, ..., so folds
+    already run keep their bounds (and their cache entries) as rows are
+    appended to the history.
+    """
+    if window not in (EXPANDING, SLIDING):
+        raise ValueError(f"Unknown window {window}")
+    if window == SLIDING:
+        train_size = train_size or min_train_size
+        min_train_size = max(min_train_size, train_size)
+    if n_samples <= min_train_size:
+        raise ValueError(f"Not enough rows ({n_samples}) for a first training window of {min_train_size}")
+    folds = []
+    for train_end in range(min_train_size, n_samples, step):
+        train_start = train_end - train_size if window == SLIDING else 0
+        folds.append((train_start, train_end, min(train_end + step, n_samples)))
+    return folds
+
+
+def _fold_key(X, y, fold, params, random_state):
+    train_start, train_end, test_end = fold
+    digest = hashlib.sha256()
+    digest.update(json.dumps([CACHE_VERSION, sorted(params.items()), random_state], default=str).encode())
+    digest.update(np.ascontiguousarray(X[train_start:test_end]).tobytes())
+    digest.update(np.ascontiguousarray(y[train_start:train_end]).tobytes())
+    return digest.hexdigest()[:24]
+
+
+def _run_fold(params, train_start, train_end, test_end, random_state):
+    X, y = worker_arrays()
+    start = time.perf_counter()
+    model = RandomForestRegressor(n_jobs=1, random_state=random_state, **params)
+    model.fit(X[train_start:train_end], y[train_start:train_end])
+    return model.predict(X[train_end:test_end]), time.perf_counter() - start
+
+
+def direction_hits(y_true, y_pred, y_prev):
+    """1.0 where the predicted move from the previous close has the actual move's sign."""
+    return (np.sign(y_pred - y_prev) == np.sign(y_true - y_prev)).astype(np.float64)
+
+
+def grouped_metrics(y_true, y_pred, y_prev, groups):
+    """MAE, RMSE and directional hit rate per group label, in one pass with bincount."""
+    labels, inverse = np.unique(groups, return_inverse=True)
+    counts = np.bincount(inverse).astype(np.float64)
+    error = y_pred - y_true
+    mae = np.bincount(inverse, np.abs(error)) / counts
+    rmse = np.sqrt(np.bincount(inverse, error ** 2) / counts)
+    hit_rate = np.bincount(inverse, direction_hits(y_true, y_pred, y_prev)) / counts
+    return pd.DataFrame({'group': labels, 'rows': counts.astype(np.int64), 'mae': mae, 'rmse': rmse,
+                         'hit_rate': hit_rate})
+
+
+def backtest(X, y, days, params=None, step=20, min_train_size=250, window=EXPANDING, train_size=None,
+             max_workers=None, cache_dir=None, random_state=42):
+    """Walk-forward predictions and metrics for date-ordered X, y.
+
+    Folds run in a process pool attached to one shared copy of X and y.
+    With cache_dir, each fold's predictions are stored under a hash of its
+    training rows, test features and parameters, so reruns only fit folds
+    whose data changed. Returns a dict with the per-day predictions frame
+    and overall, per-fold and per-year metrics.
+    """
+    params = dict(params or DEFAULT_PARAMS)
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    days = to_days(days)
+    if len(days) > 1 and (np.diff(days.astype(np.int64)) < 0).any():
+        raise ValueError("Backtest rows must be in date order")
+    folds = walk_forward_folds(len(X), step, min_train_size, window, train_size)
+
+    predictions = {}
+    keys = {}
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        for fold in folds:
+            keys[fold] = _fold_key(X, y, fold, params, random_state)
+            path = os.path.join(cache_dir, keys[fold] + '.npy')
+            if os.path.exists(path):
+                predictions[fold] = np.load(path)
+    pending = [fold for fold in folds if fold not in predictions]
+    max_workers = max_workers or os.cpu_count()
+    logger.info(f"Backtest: {len(folds)} folds, {len(folds) - len(pending)} cached, "
+                f"{len(pending)} to fit on {max_workers} workers")
+
+    fit_seconds = 0.0
+    if pending:
+        X_shared, y_shared = SharedArray(X), SharedArray(y)
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                                     initargs=(X_shared.descriptor, y_shared.descriptor)) as pool:
+                # Largest training sets first, so the pool does not end on one long fold.
+                futures = {fold: pool.submit(_run_fold, params, *fold, random_state)
+                           for fold in sorted(pending, key=lambda f: f[0] - f[1])}
+                for fold, future in futures.items():
+                    predictions[fold], seconds = future.result()
+                    fit_seconds += seconds
+                    if cache_dir:
+                        path = os.path.join(cache_dir, keys[fold] + '.npy')
+                        np.save(path + '.tmp.npy', predictions[fold])
+                        os.replace(path + '.tmp.npy', path)
+        finally:
+            X_shared.close()
+            y_shared.close()
+
+    first = folds[0][1]
+    y_pred = np.concatenate([predictions[fold] for fold in folds])
+    y_true, test_days = y[first:], days[first:]
+    y_prev = y[first - 1:-1]
+    fold_ids = np.concatenate([np.full(fold[2] - fold[1], i) for i, fold in enumerate(folds)])
+    years = test_days.astype('datetime64[Y]').astype(np.int64) + 1970
+
+    overall = grouped_metrics(y_true, y_pred, y_prev, np.zeros(len(y_true), dtype=np.int64)).iloc[0]
+    return {
+        'predictions': pd.DataFrame({'Date': test_days, 'actual': y_true, 'predicted': y_pred, 'fold': fold_ids}),
+        'overall': {'rows': int(overall['rows']), **{k: float(overall[k]) for k in ('mae', 'rmse', 'hit_rate')}},
+        'by_fold': grouped_metrics(y_true, y_pred, y_prev, fold_ids).rename(columns={'group': 'fold'}),
+        'by_year': grouped_metrics(y_true, y_pred, y_prev, years).rename(columns={'group': 'year'}),
+        'folds': len(folds),
+        'cached_folds': len(folds) - len(pending),
+        'fit_seconds': fit_seconds,
+    }
+
+
+def load_csv_history(price_path, sentiment_path):
+    """The merged training rows rebuilt from the bundled CSVs, without Firestore."""
+    from models.daily_sentiment import DailySentiment
+    from models.headline_labeler import load_labelled_headlines
+    from models.market_features import add_market_features
+
+    prices = pd.read_csv(price_path)
+    prices['Date'] = pd.to_datetime(prices['Date'], errors='coerce')
+    prices = prices.dropna(subset=['Date']).sort_values('Date').reset_index(drop=True)
+    daily = DailySentiment.aggregate(load_labelled_headlines(sentiment_path))
+    return daily.asof_join(add_market_features(prices))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Walk-forward backtest of the gold price model.")
+    parser.add_argument('--from-csv', action='store_true', help="use Data/*.csv instead of Firestore")
+    parser.add_argument('--window', choices=[EXPANDING, SLIDING], default=EXPANDING)
+    parser.add_argument('--train-size', type=int, default=None, help="rows per sliding window")
+    parser.add_argument('--min-train-size', type=int, default=250)
+    parser.add_argument('--step', type=int, default=20, help="trading days predicted per fit")
+    parser.add_argument('--params', default=None, help="JSON RandomForestRegressor parameters")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                            '.backtest_cache'))
+    parser.add_argument('--output', default=None, help="write the per-day predictions here as CSV")
+    parser.add_argument('--max-mae', type=float, default=None)
+    parser.add_argument('--min-hit-rate', type=float, default=None)
+    args = parser.parse_args()
+
+    from models import model1
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if args.from_csv:
+        merged = load_csv_history(os.path.join(root, 'Data', 'price.csv'), os.path.join(root, 'Data', 'sentiment.csv'))
+    else:
+        merged = model1.fetch_and_merge_data('sentiment_data', 'price_data')
+
+    X, y, pipeline = model1.build_feature_matrix(merged)
+    _, valid = pipeline.raw_features(merged)
+    days = merged['Date'].to_numpy()[valid]
+
+    start = time.perf_counter()
+    result = backtest(X, y, days, json.loads(args.params) if args.params else None, args.step,
+                      args.min_train_size, args.window, args.train_size, args.workers, args.cache_dir)
+    logger.info(f"Backtest of {result['folds']} folds ({result['cached_folds']} cached) "
+                f"took {time.perf_counter() - start:.1f}s")
+    print(result['by_year'].to_string(index=False))
+    print(json.dumps(result['overall'], indent=2))
+    if args.output:
+        result['predictions'].to_csv(args.output, index=False)
+
+    failures = []
+    if args.max_mae is not None and result['overall']['mae'] > args.max_mae:
+        failures.append(f"MAE {result['overall']['mae']:.4f} > {args.max_mae}")
+    if args.min_hit_rate is not None and result['overall']['hit_rate'] < args.min_hit_rate:
+        failures.append(f"hit rate {result['overall']['hit_rate']:.4f} < {args.min_hit_rate}")
+    for failure in failures:
+        print(f"GATE FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
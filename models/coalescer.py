@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class _Pending:
+    __slots__ = ("row", "model", "enqueued", "done", "result", "error")
+
+    def __init__(self, row, model):
+        self.row = row
+        self.model = model
+        self.enqueued = time.monotonic()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class PredictionCoalescer:
+    """Runs concurrent single-row predictions as one vectorized predict call.
+
+    Callers block in predict() while a worker thread gathers rows until
+    max_batch rows are waiting or the oldest has waited max_wait seconds,
+    then calls model.predict once per model in the batch and hands each
+    caller its own value. Added latency is bounded by max_wait plus one
+    batch's predict time.
+    """
+
+    def __init__(self, max_batch=64, max_wait=0.002):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._pid = None
+
+    def _ensure_started(self):
+        # The worker thread does not survive fork; start one per process.
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            self._queue = deque()
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="prediction-coalescer", daemon=True).start()
+
+    def predict(self, row, model, timeout=None):
+        self._ensure_started()
+        pending = _Pending(np.asarray(row, dtype=np.float64).ravel(), model)
+        with self._cond:
+            self._queue.append(pending)
+            self._cond.notify()
+        if not pending.done.wait(timeout):
+            raise TimeoutError("Prediction timed out")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            while len(self._queue) < self.max_batch:
+                remaining = self._queue[0].enqueued + self.max_wait - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            # A hot reload may swap the model mid-batch; keep each row with
+            # the model its features were built for.
+            groups = {}
+            for pending in batch:
+                groups.setdefault(id(pending.model), []).append(pending)
+            for group in groups.values():
+                try:
+                    predictions = group[0].model.predict(np.vstack([p.row for p in group]))
+                    for pending, value in zip(group, predictions):
+                        pending.result = float(value)
+                except Exception as e:
+                    for pending in group:
+                        pending.error = e
+                for pending in group:
+                    pending.done.set()
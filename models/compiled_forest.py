@@ -0,0 +1,165 @@
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+FORMAT_VERSION = 2
+ROW_BLOCK = 1024
+ZIP_LOCAL_HEADER = struct.Struct("<4s22xHH")
+
+
+def _mmap_npz(path):
+    """The arrays of an uncompressed .npz, memory-mapped where they sit in the archive.
+
+    np.load() ignores mmap_mode for .npz files and reads every array into
+    private memory; mapping the members in place lets processes loading
+    the same file share its pages.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename[:-len(".npy")]
+            if info.compress_type != zipfile.ZIP_STORED:
+                arrays[name] = np.load(archive.open(info))
+                continue
+            f.seek(info.header_offset)
+            signature, name_length, extra_length = ZIP_LOCAL_HEADER.unpack(f.read(ZIP_LOCAL_HEADER.size))
+            if signature != b"PK\x03\x04":
+                raise ValueError(f"Corrupt archive {path}")
+            start = info.header_offset + ZIP_LOCAL_HEADER.size + name_length + extra_length
+            f.seek(start)
+            read_header = {(1, 0): np.lib.format.read_array_header_1_0,
+                           (2, 0): np.lib.format.read_array_header_2_0}.get(np.lib.format.read_magic(f))
+            shape, fortran_order, dtype = read_header(f) if read_header else ((), False, np.dtype(object))
+            if not shape or dtype.hasobject:
+                f.seek(start)
+                arrays[name] = np.lib.format.read_array(f, allow_pickle=False)
+                continue
+            arrays[name] = np.memmap(f, dtype=dtype, mode="r", offset=f.tell(), shape=shape,
+                                     order="F" if fortran_order else "C")
+    return arrays
+
+
+class CompiledForest:
+    """A fitted RandomForestRegressor flattened into contiguous node arrays.
+
+    All trees share one node table, so every row steps through all trees at
+    once, one tree level per iteration of plain NumPy indexing, with no
+    per-tree Python loop and no sklearn input checks. Leaves point back at
+    themselves and (row, tree) pairs that reach one drop out of the loop.
+    """
+
+    def __init__(self, feature, threshold, children, is_leaf, value, missing_left, roots, max_depth, n_features):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children  # (nodes x 2): left, right
+        self.is_leaf = is_leaf
+        self.value = value
+        self.missing_left = missing_left
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.n_features = int(n_features)
+        self.has_missing = bool(missing_left.any())
+
+    @classmethod
+    def from_sklearn(cls, model):
+        features, thresholds, lefts, rights, values, missing, roots = [], [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            if tree.n_outputs != 1:
+                raise ValueError("Only single-output forests can be compiled")
+            n = tree.node_count
+            is_leaf = tree.children_left == -1
+            own = np.arange(offset, offset + n, dtype=np.int32)
+
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+            thresholds.append(tree.threshold.astype(np.float64))
+            lefts.append(np.where(is_leaf, own, tree.children_left + offset).astype(np.int32))
+            rights.append(np.where(is_leaf, own, tree.children_right + offset).astype(np.int32))
+            values.append(tree.value[:, 0, 0].astype(np.float64))
+            missing_go_to_left = getattr(tree, 'missing_go_to_left', None)
+            missing.append(np.zeros(n, dtype=bool) if missing_go_to_left is None
+                           else np.asarray(missing_go_to_left, dtype=bool))
+            roots.append(offset)
+            max_depth = max(max_depth, tree.max_depth)
+            offset += n
+
+        left = np.concatenate(lefts)
+        return cls(
+            np.concatenate(features), np.concatenate(thresholds), np.column_stack([left, np.concatenate(rights)]),
+            left == np.arange(len(left)), np.concatenate(values), np.concatenate(missing),
+            np.array(roots, dtype=np.int32), max_depth, model.n_features_in_,
+        )
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def _leaf_values(self, X):
+        n_rows = len(X)
+        flat_X = X.ravel()
+        # One entry per (row, tree); entries drop out once they reach a leaf.
+        nodes = np.tile(self.roots, n_rows)
+        row_offset = np.repeat(np.arange(n_rows, dtype=np.int64) * self.n_features, self.n_trees)
+        active = np.arange(len(nodes))
+        for _ in range(self.max_depth):
+            current = nodes[active]
+            x = flat_X[row_offset[active] + self.feature[current]]
+            go_right = ~(x <= self.threshold[current])
+            if self.has_missing:
+                go_right &= ~(np.isnan(x) & self.missing_left[current])
+            current = self.children[current, go_right.view(np.int8)]
+            nodes[active] = current
+            active = active[~self.is_leaf[current]]
+            if not len(active):
+                break
+        return self.value[nodes].reshape(n_rows, self.n_trees)
+
+    def predict(self, X):
+        # sklearn compares float32 inputs against float64 thresholds.
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+        if X.shape[1] != self.n_features:
+            raise ValueError(f"X has {X.shape[1]} features, but the forest expects {self.n_features}")
+
+        out = np.zeros(len(X))
+        for start in range(0, len(X), ROW_BLOCK):
+            leaves = self._leaf_values(X[start:start + ROW_BLOCK])
+            block = out[start:start + ROW_BLOCK]
+            # Sum tree by tree in order, as sklearn does, so results match exactly.
+            for t in range(self.n_trees):
+                block += leaves[:, t]
+        return out / self.n_trees
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez(
+            tmp_path, format_version=FORMAT_VERSION,
+            feature=self.feature, threshold=self.threshold, children=self.children, is_leaf=self.is_leaf,
+            value=self.value, missing_left=self.missing_left, roots=self.roots,
+            max_depth=self.max_depth, n_features=self.n_features,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """Load a saved forest; with mmap_mode='r' its arrays are mapped from the file, not copied."""
+        if mmap_mode == 'r':
+            data = _mmap_npz(path)
+        else:
+            with np.load(path) as archive:
+                data = {name: archive[name] for name in archive.files}
+        if int(data['format_version']) != FORMAT_VERSION:
+            raise ValueError(f"Unsupported compiled forest format {int(data['format_version'])}")
+        return cls(
+            data['feature'], data['threshold'], data['children'], data['is_leaf'], data['value'],
+            data['missing_left'], data['roots'], data['max_depth'], data['n_features'],
+        )
+
+
+def compile_forest(model):
+    return CompiledForest.from_sklearn(model)
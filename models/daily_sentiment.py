@@ -0,0 +1,226 @@
+import hashlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+from models.features import FLAG_COLUMNS, SENTIMENT_COLUMN, to_days
+
+DAILY_SENTIMENT_COLLECTION = 'sentiment_daily'
+HEADLINE_DATE_FORMAT = '%d-%m-%Y'
+COUNT_FIELD = 'Headline Count'
+
+# A price day joins the latest headline day at most this many days earlier,
+# enough to carry Friday's news over a weekend or a long holiday.
+ASOF_TOLERANCE_DAYS = 4
+
+
+def headline_document_id(date, news):
+    """Firestore ID for one headline, so headlines sharing a date are all kept."""
+    digest = hashlib.sha1(str(news).encode('utf-8')).hexdigest()[:16]
+    return f"{date}-{digest}"
+
+
+def parse_headline_dates(values):
+    """Headline dates are DD-MM-YYYY; ISO dates from the API are accepted too."""
+    parsed = pd.to_datetime(pd.Series(values, dtype=object), format=HEADLINE_DATE_FORMAT, errors='coerce')
+    days = parsed.to_numpy(dtype='datetime64[D]')
+    unparsed = np.isnat(days)
+    if unparsed.any():
+        days[unparsed] = to_days(np.asarray(values, dtype=object)[unparsed])
+    return days
+
+
+def _flag_sum_field(column):
+    return f"{column} Sum"
+
+
+def _sentiment_count_field(label):
+    return f"Sentiment {label} Count"
+
+
+def contribution_documents(headlines, id_column):
+    """(doc_id, fields) pairs holding each headline's share of its day, keyed by headline ID.
+
+    Writing a headline's contribution again (a retried commit, a replayed
+    batch) overwrites it instead of counting it twice, and concurrent
+    writers never touch the same document; the daily table is their sum.
+    """
+    # Dated exactly like the headline, so aggregate() parses both alike.
+    dates = headlines['Dates'] if 'Dates' in headlines else headlines['Date']
+    valid = ~np.isnat(parse_headline_dates(dates))
+    flags = [pd.to_numeric(headlines[c], errors='coerce').tolist() for c in FLAG_COLUMNS]
+    documents = []
+    for i, (doc_id, date, sentiment) in enumerate(zip(headlines[id_column], dates, headlines[SENTIMENT_COLUMN])):
+        if not valid[i]:
+            continue
+        fields = {'Date': date, SENTIMENT_COLUMN: sentiment}
+        fields.update({column: flags[j][i] for j, column in enumerate(FLAG_COLUMNS)})
+        documents.append((doc_id, fields))
+    return documents
+
+
+class DailySentiment:
+    """Headline counts, flag sums and sentiment class counts per day.
+
+    Days are kept sorted in NumPy arrays. add() folds in a batch of new
+    headlines by touching only the days they fall on, and asof() finds, for
+    any dates, the latest headline day at or before each with one binary
+    search.
+    """
+
+    def __init__(self):
+        self.days = np.array([], dtype='datetime64[D]')
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.flag_sums = np.zeros((0, len(FLAG_COLUMNS)))
+        self.classes = []
+        self.sentiment_counts = np.zeros((0, 0), dtype=np.int64)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.days)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def aggregate(cls, headlines):
+        """A DailySentiment of just the rows of a headline DataFrame."""
+        days = parse_headline_dates(headlines['Dates'] if 'Dates' in headlines else headlines['Date'])
+        flags = np.column_stack([
+            pd.to_numeric(headlines[c], errors='coerce').to_numpy(dtype=float) for c in FLAG_COLUMNS
+        ]) if len(headlines) else np.zeros((0, len(FLAG_COLUMNS)))
+        sentiment = headlines[SENTIMENT_COLUMN].astype(str).to_numpy()
+        valid = ~np.isnat(days) & ~np.isnan(flags).any(axis=1) & headlines[SENTIMENT_COLUMN].notna().to_numpy()
+        days, flags, sentiment = days[valid], flags[valid], sentiment[valid]
+
+        result = cls()
+        result.days, inverse = np.unique(days, return_inverse=True)
+        result.counts = np.bincount(inverse, minlength=len(result.days)).astype(np.int64)
+        result.flag_sums = np.zeros((len(result.days), len(FLAG_COLUMNS)))
+        np.add.at(result.flag_sums, inverse, flags)
+        classes, class_index = np.unique(sentiment, return_inverse=True)
+        result.classes = [str(c) for c in classes]
+        result.sentiment_counts = np.zeros((len(result.days), len(classes)), dtype=np.int64)
+        np.add.at(result.sentiment_counts, (inverse, class_index), 1)
+        return result
+
+    def add(self, other):
+        """Fold another DailySentiment (typically a new batch) into this one."""
+        with self._lock:
+            new_classes = [c for c in other.classes if c not in self.classes]
+            if new_classes:
+                self.classes = self.classes + new_classes
+                self.sentiment_counts = np.pad(self.sentiment_counts, ((0, 0), (0, len(new_classes))))
+            class_columns = [self.classes.index(c) for c in other.classes]
+
+            position = np.searchsorted(self.days, other.days)
+            known = position < len(self.days)
+            known[known] = self.days[position[known]] == other.days[known]
+
+            rows = position[known]
+            self.counts[rows] += other.counts[known]
+            self.flag_sums[rows] += other.flag_sums[known]
+            if class_columns:
+                self.sentiment_counts[np.ix_(rows, class_columns)] += other.sentiment_counts[known]
+
+            new = ~known
+            if new.any():
+                sentiment_counts = np.zeros((new.sum(), len(self.classes)), dtype=np.int64)
+                sentiment_counts[:, class_columns] = other.sentiment_counts[new]
+                at = position[new]
+                self.days = np.insert(self.days, at, other.days[new])
+                self.counts = np.insert(self.counts, at, other.counts[new])
+                self.flag_sums = np.insert(self.flag_sums, at, other.flag_sums[new], axis=0)
+                self.sentiment_counts = np.insert(self.sentiment_counts, at, sentiment_counts, axis=0)
+        return self
+
+    def frame(self):
+        """One row per day: Date, headline count, mean of each flag, sentiment ratios
+        and the most common sentiment as Price Sentiment."""
+        counts = np.maximum(self.counts, 1)[:, None]
+        out = pd.DataFrame(self.flag_sums / counts, columns=FLAG_COLUMNS)
+        out.insert(0, 'Date', self.days.astype('datetime64[ns]'))
+        out.insert(1, COUNT_FIELD, self.counts)
+        # Alphabetical class order, so ties break the same however the
+        # table was built.
+        order = np.argsort(self.classes).astype(np.int64)
+        classes = np.asarray(self.classes, dtype=object)[order]
+        sentiment_counts = self.sentiment_counts[:, order]
+        for i, label in enumerate(classes):
+            out[f"Sentiment {label} Ratio"] = sentiment_counts[:, i] / counts[:, 0]
+        if len(classes):
+            out[SENTIMENT_COLUMN] = classes[sentiment_counts.argmax(axis=1)]
+        else:
+            out[SENTIMENT_COLUMN] = pd.Series(dtype=object)
+        return out
+
+    def asof(self, dates, tolerance_days=ASOF_TOLERANCE_DAYS):
+        """(index, valid): the latest day at or before each date, within tolerance_days."""
+        days = to_days(dates)
+        index = np.searchsorted(self.days, days, side='right') - 1
+        valid = (index >= 0) & ~np.isnat(days)
+        if tolerance_days is not None and len(self.days):
+            gap = (days - self.days[np.maximum(index, 0)]).astype(np.int64)
+            valid &= gap <= tolerance_days
+        return index, valid
+
+    def asof_join(self, prices, date_column='Date', tolerance_days=ASOF_TOLERANCE_DAYS):
+        """Rows of prices that have headlines within tolerance, with that day's aggregates."""
+        index, valid = self.asof(prices[date_column].to_numpy(), tolerance_days)
+        daily = self.frame().drop(columns=['Date']).iloc[index[valid]].reset_index(drop=True)
+        joined = prices.loc[valid].reset_index(drop=True)
+        return pd.concat([joined, daily], axis=1)
+
+    def documents(self):
+        """(doc_id, fields) pairs holding this table's absolute counts."""
+        documents = []
+        for i, day in enumerate(self.days.astype(str)):
+            fields = {'Date': day, COUNT_FIELD: int(self.counts[i])}
+            for j, column in enumerate(FLAG_COLUMNS):
+                fields[_flag_sum_field(column)] = float(self.flag_sums[i, j])
+            for j, label in enumerate(self.classes):
+                fields[_sentiment_count_field(label)] = int(self.sentiment_counts[i, j])
+            documents.append((day, fields))
+        return documents
+
+    @classmethod
+    def from_documents(cls, frame):
+        """Rebuild from the stored documents (as fetched into a DataFrame).
+
+        Rows with a headline count are per-day documents; the rest are
+        per-headline contributions (contribution_documents()), summed here.
+        """
+        if frame.empty:
+            return cls()
+        is_day = frame[COUNT_FIELD].notna() if COUNT_FIELD in frame else pd.Series(False, index=frame.index)
+        result = cls._from_day_documents(frame[is_day])
+        contributions = frame[~is_day]
+        if len(contributions):
+            result.add(cls.aggregate(contributions))
+        return result
+
+    @classmethod
+    def _from_day_documents(cls, frame):
+        result = cls()
+        if frame.empty:
+            return result
+        frame = frame.assign(_day=to_days(frame['Date'].to_numpy())).dropna(subset=['_day'])
+        frame = frame.sort_values('_day').drop_duplicates('_day', keep='last')
+        result.days = frame['_day'].to_numpy(dtype='datetime64[D]', copy=True)
+        result.counts = frame[COUNT_FIELD].fillna(0).to_numpy(dtype=np.int64, copy=True)
+        result.flag_sums = np.column_stack([
+            frame.get(_flag_sum_field(c), pd.Series(0.0, index=frame.index)).fillna(0).to_numpy(dtype=float)
+            for c in FLAG_COLUMNS
+        ])
+        prefix, suffix = 'Sentiment ', ' Count'
+        count_columns = [c for c in frame.columns if c.startswith(prefix) and c.endswith(suffix)]
+        result.classes = [c[len(prefix):-len(suffix)] for c in count_columns]
+        result.sentiment_counts = frame[count_columns].fillna(0).to_numpy(dtype=np.int64, copy=True).reshape(len(frame), -1)
+        return result
@@ -0,0 +1,176 @@
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder, StandardScaler
+
+FEATURE_SPEC_VERSION = 1
+
+CALENDAR_COLUMNS = ['Year', 'Month', 'Day', 'DayOfWeek', 'WeekOfYear']
+FLAG_COLUMNS = [
+    'Price Direction Up', 'Price Direction Constant',
+    'Price Direction Down', 'Asset Comparison',
+    'Past Information', 'Future Information',
+]
+SENTIMENT_COLUMN = 'Price Sentiment'
+FEATURE_COLUMNS = CALENDAR_COLUMNS + FLAG_COLUMNS + [SENTIMENT_COLUMN]
+INPUT_COLUMNS = ['Date'] + FLAG_COLUMNS + [SENTIMENT_COLUMN]
+
+# Classes the LabelEncoder saw when models/scaler.pkl was trained.
+LEGACY_SENTIMENT_CLASSES = ['negative', 'neutral', 'none', 'positive']
+
+CALENDAR_TABLE_START = np.datetime64('1970-01-01', 'D')
+CALENDAR_TABLE_END = np.datetime64('2100-01-01', 'D')
+_calendar_table = None
+
+
+def compute_calendar_features(days):
+    days = np.asarray(days, dtype='datetime64[D]')
+    years = days.astype('datetime64[Y]')
+    months = days.astype('datetime64[M]')
+    day_of_week = (days.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+    # The ISO week is the week holding the Thursday of the same Monday-based week.
+    thursday = days + (3 - day_of_week).astype('timedelta64[D]')
+    week_of_year = (thursday - thursday.astype('datetime64[Y]')).astype(np.int64) // 7 + 1
+    return np.column_stack([
+        years.astype(np.int64) + 1970,
+        (months - years).astype(np.int64) + 1,
+        (days - months).astype(np.int64) + 1,
+        day_of_week,
+        week_of_year,
+    ])
+
+
+def calendar_table():
+    global _calendar_table
+    if _calendar_table is None:
+        days = np.arange(CALENDAR_TABLE_START, CALENDAR_TABLE_END)
+        _calendar_table = compute_calendar_features(days).astype(np.int16)
+    return _calendar_table
+
+
+def calendar_features(dates):
+    days = np.asarray(dates, dtype='datetime64[D]')
+    offsets = days.astype(np.int64) - CALENDAR_TABLE_START.astype(np.int64)
+    table = calendar_table()
+    in_table = (offsets >= 0) & (offsets < len(table))
+    if in_table.all():
+        return table[offsets].astype(np.float64)
+
+    out = np.empty((len(days), len(CALENDAR_COLUMNS)))
+    out[in_table] = table[offsets[in_table]]
+    out[~in_table] = compute_calendar_features(days[~in_table])
+    return out
+
+
+def to_days(values):
+    if isinstance(values, np.ndarray) and np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[D]')
+    try:
+        # ISO dates parse directly in NumPy, far cheaper than pandas for a few rows.
+        return np.array(values, dtype='datetime64[D]')
+    except (ValueError, TypeError):
+        pass
+    return pd.to_datetime(pd.Series(values), errors='coerce').to_numpy(dtype='datetime64[D]')
+
+
+class FeaturePipeline:
+    """Calendar features, sentiment encoding and scaling in one artifact.
+
+    Training and serving both go through raw_features()/transform(), so the
+    model always sees the columns, encoding and scaling it was fitted on.
+    Pipelines fitted with market_columns append those features (see
+    models/market_features.py) after the headline ones.
+    """
+
+    # Pipelines saved before market features existed have none.
+    market_columns = ()
+
+    def __init__(self, sentiment_classes=None, mean=None, scale=None, market_columns=()):
+        self.version = FEATURE_SPEC_VERSION
+        self.market_columns = list(market_columns)
+        self.feature_columns = list(FEATURE_COLUMNS) + self.market_columns
+        self.sentiment_mapping = {}
+        if sentiment_classes is not None:
+            self.sentiment_mapping = {c: float(i) for i, c in enumerate(sentiment_classes)}
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float64)
+        self.scale = None if scale is None else np.asarray(scale, dtype=np.float64)
+
+    @classmethod
+    def from_scaler(cls, scaler, sentiment_classes=LEGACY_SENTIMENT_CLASSES):
+        return cls(sentiment_classes, scaler.mean_, scaler.scale_)
+
+    def fit_sentiment(self, values):
+        encoder = LabelEncoder().fit(np.asarray(values, dtype=str))
+        self.sentiment_mapping = {c: float(i) for i, c in enumerate(encoder.classes_)}
+        return self
+
+    def fit_scaler(self, X):
+        scaler = StandardScaler().fit(X)
+        self.mean = scaler.mean_
+        self.scale = scaler.scale_
+        return self
+
+    def encode_sentiment(self, values):
+        values = np.asarray(values)
+        if np.issubdtype(values.dtype, np.number):
+            return values.astype(np.float64)
+        mapping = self.sentiment_mapping
+        return np.array([mapping.get(v, np.nan) for v in values.astype(str)], dtype=np.float64)
+
+    def raw_columns(self, dates, flags, sentiment, market=None):
+        days = to_days(dates)
+        valid = ~np.isnat(days)
+
+        X = np.zeros((len(days), len(self.feature_columns)))
+        X[valid, :5] = calendar_features(days[valid])
+        X[:, 5:11] = flags
+        X[:, 11] = self.encode_sentiment(sentiment)
+        if self.market_columns:
+            X[:, 12:] = np.nan if market is None else market
+
+        valid &= ~np.isnan(X).any(axis=1)
+        return X, valid
+
+    def raw_features(self, frame, market=None):
+        """market defaults to the frame's own market feature columns when it has them."""
+        flags = np.column_stack([
+            pd.to_numeric(frame[c], errors='coerce').to_numpy(dtype=float) for c in FLAG_COLUMNS
+        ])
+        if market is None and self.market_columns and set(self.market_columns) <= set(frame.columns):
+            market = frame[self.market_columns].to_numpy(dtype=float)
+        return self.raw_columns(frame['Date'].to_numpy(), flags, frame[SENTIMENT_COLUMN].to_numpy(), market)
+
+    def transform(self, X):
+        if self.mean is None:
+            return X
+        return (X - self.mean) / self.scale
+
+    def transform_frame(self, frame, market=None):
+        X, valid = self.raw_features(frame, market)
+        return self.transform(X), valid
+
+    def transform_records(self, records, market=None):
+        """Scaled feature rows for a list of input dicts; raises ValueError on bad input."""
+        dates = [r['Date'] for r in records]
+        flags = np.array([[r[c] for c in FLAG_COLUMNS] for r in records], dtype=float)
+        X, valid = self.raw_columns(dates, flags, [r[SENTIMENT_COLUMN] for r in records], market)
+        if not valid.all():
+            if self.market_columns:
+                raise ValueError("unparseable date, unknown Price Sentiment value or no market data before the date")
+            raise ValueError("unparseable date or unknown Price Sentiment value")
+        return self.transform(X)
+
+    def save(self, path):
+        joblib.dump(self, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+
+def load_feature_pipeline(path):
+    obj = joblib.load(path)
+    if isinstance(obj, StandardScaler):
+        return FeaturePipeline.from_scaler(obj)
+    if getattr(obj, 'version', None) != FEATURE_SPEC_VERSION:
+        raise ValueError(f"Feature pipeline version {getattr(obj, 'version', None)} does not match {FEATURE_SPEC_VERSION}")
+    return obj
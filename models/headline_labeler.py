@@ -0,0 +1,137 @@
+import os
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.linear_model import LogisticRegression
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.features import FLAG_COLUMNS, SENTIMENT_COLUMN
+
+LABELER_VERSION = 1
+N_FEATURES = 2 ** 18
+LABEL_COLUMNS = FLAG_COLUMNS + [SENTIMENT_COLUMN]
+
+
+def make_vectorizer(n_features=N_FEATURES):
+    # Stateless, so nothing but its settings needs saving and inference does
+    # no vocabulary lookups.
+    return HashingVectorizer(
+        n_features=n_features, ngram_range=(1, 2), alternate_sign=False,
+        token_pattern=r"(?u)\b\w+\b|[$%+-]", dtype=np.float32,
+    )
+
+
+class HeadlineLabeler:
+    """Fills the headline flags and Price Sentiment from the News text.
+
+    Hashed word unigrams and bigrams feed one linear model per flag plus a
+    multinomial one for sentiment. All of them are stacked into a single
+    weight matrix, so labelling a batch is one sparse hashing pass and one
+    sparse-dense product.
+    """
+
+    def __init__(self, n_features=N_FEATURES):
+        self.version = LABELER_VERSION
+        self.n_features = n_features
+        self.sentiment_classes = []
+        self.weights = None
+        self.intercepts = None
+        self._vectorizer = None
+
+    @property
+    def vectorizer(self):
+        if self._vectorizer is None:
+            self._vectorizer = make_vectorizer(self.n_features)
+        return self._vectorizer
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_vectorizer'] = None
+        return state
+
+    def fit(self, news, labels, C=4.0):
+        """labels is a DataFrame with FLAG_COLUMNS (0/1) and SENTIMENT_COLUMN."""
+        X = self.vectorizer.transform(np.asarray(news, dtype=str))
+        weights, intercepts = [], []
+        for column in FLAG_COLUMNS:
+            y = labels[column].to_numpy(dtype=int)
+            if len(np.unique(y)) < 2:
+                # Constant in the training data: always predict that value.
+                weights.append(np.zeros(self.n_features))
+                intercepts.append(10.0 if y[0] == 1 else -10.0)
+                continue
+            clf = LogisticRegression(C=C, solver='liblinear').fit(X, y)
+            weights.append(clf.coef_[0])
+            intercepts.append(clf.intercept_[0])
+
+        clf = LogisticRegression(C=C, max_iter=1000).fit(X, labels[SENTIMENT_COLUMN].astype(str))
+        self.sentiment_classes = list(clf.classes_)
+        coef, intercept = clf.coef_, clf.intercept_
+        if len(self.sentiment_classes) == 2:
+            coef = np.vstack([-coef[0], coef[0]])
+            intercept = np.array([-intercept[0], intercept[0]])
+        weights.extend(coef)
+        intercepts.extend(intercept)
+
+        self.weights = np.column_stack(weights).astype(np.float32)
+        self.intercepts = np.asarray(intercepts, dtype=np.float32)
+        return self
+
+    def scores(self, news):
+        X = self.vectorizer.transform(news)
+        return np.asarray(X @ self.weights) + self.intercepts
+
+    def label(self, news):
+        """DataFrame of LABEL_COLUMNS for a sequence of headlines."""
+        news = ['' if text is None else str(text) for text in news]
+        scores = self.scores(news)
+        n_flags = len(FLAG_COLUMNS)
+        labels = pd.DataFrame((scores[:, :n_flags] > 0).astype(np.int64), columns=FLAG_COLUMNS)
+        classes = np.asarray(self.sentiment_classes, dtype=object)
+        labels[SENTIMENT_COLUMN] = classes[scores[:, n_flags:].argmax(axis=1)]
+        return labels
+
+    def fill(self, record, news_column='News'):
+        """Copy of record with blank label fields filled in from its headline."""
+        missing = [c for c in LABEL_COLUMNS if record.get(c) in (None, '')]
+        if not missing:
+            return record
+        labels = self.label([record.get(news_column)]).iloc[0]
+        filled = dict(record)
+        for column in missing:
+            value = labels[column]
+            filled[column] = value.item() if hasattr(value, 'item') else value
+        return filled
+
+    def fill_frame(self, frame, news_column='News'):
+        """Adds any LABEL_COLUMNS missing from frame, labelled from its News column."""
+        missing = [c for c in LABEL_COLUMNS if c not in frame.columns]
+        if not missing:
+            return frame
+        labels = self.label(frame[news_column].tolist())
+        frame = frame.copy()
+        for column in missing:
+            frame[column] = labels[column].to_numpy()
+        return frame
+
+    def save(self, path):
+        joblib.dump(self, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+
+def load_headline_labeler(path):
+    obj = joblib.load(path)
+    if getattr(obj, 'version', None) != LABELER_VERSION:
+        raise ValueError(f"Headline labeler version {getattr(obj, 'version', None)} does not match {LABELER_VERSION}")
+    return obj
+
+
+def load_labelled_headlines(file_path):
+    data = pd.read_csv(file_path, encoding='utf-8-sig')
+    data = data.rename(columns={'Asset Comparision': 'Asset Comparison'})
+    return data.dropna(subset=['News'] + LABEL_COLUMNS)
+
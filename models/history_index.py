@@ -0,0 +1,140 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from Data.firestore_bulk import UPDATED_AT_FIELD, fetch_changed
+from models.features import to_days
+
+
+class HistoryIndex:
+    """One collection's documents in date order, held in NumPy arrays.
+
+    Rows are kept sorted by day, one array per field (float64 for
+    numeric_fields, object otherwise), so a date range is two binary
+    searches and a slice. upsert() applies writes from this process as they
+    happen; refresh(), at most every refresh_interval seconds, pulls the
+    documents other processes have stamped since the last one. Writes merge
+    into an existing document field by field, like a Firestore merge write.
+    """
+
+    def __init__(self, client, collection, fields, numeric_fields=(), date_field='Date', parse_dates=to_days,
+                 refresh_interval=30.0, updated_field=UPDATED_AT_FIELD):
+        self.client = client
+        self.collection = collection
+        self.fields = list(fields)
+        self.numeric_fields = set(numeric_fields)
+        self.date_field = date_field
+        self.parse_dates = parse_dates
+        self.refresh_interval = refresh_interval
+        self.updated_field = updated_field
+        self.days = np.empty(0, dtype='datetime64[D]')
+        self.ids = np.empty(0, dtype=object)
+        self.columns = {field: self._empty(field, 0) for field in self.fields}
+        self._id_days = {}
+        self._high_water_mark = None
+        self._checked_at = None
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.days)
+
+    def _empty(self, field, n):
+        if field in self.numeric_fields:
+            return np.full(n, np.nan)
+        return np.full(n, None, dtype=object)
+
+    def _column(self, field, rows):
+        values = [row.get(field) for row in rows]
+        if field in self.numeric_fields:
+            return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+        return np.array(values, dtype=object)
+
+    def upsert(self, documents):
+        """Apply (doc_id, fields) pairs; fields left out keep their stored values."""
+        documents = list(dict(documents).items())
+        if not documents:
+            return
+        ids = np.array([doc_id for doc_id, _ in documents], dtype=object)
+        rows = [fields for _, fields in documents]
+        days = self.parse_dates(np.array([row.get(self.date_field) for row in rows], dtype=object))
+        keep = ~np.isnat(days)
+        ids, days, rows = ids[keep], days[keep], [row for row, k in zip(rows, keep) if k]
+
+        with self._lock:
+            positions = np.array([self._position(doc_id) for doc_id in ids], dtype=np.int64)
+            moved = np.zeros(len(ids), dtype=bool)
+            moved[positions >= 0] = self.days[positions[positions >= 0]] != days[positions >= 0]
+            if moved.any():
+                # Only possible if a document's date changes: drop and re-add it.
+                self._delete(positions[moved])
+                positions = np.array([self._position(doc_id) for doc_id in ids], dtype=np.int64)
+
+            existing = positions >= 0
+            if existing.any():
+                at = positions[existing]
+                subset = [row for row, e in zip(rows, existing) if e]
+                for field in self.fields:
+                    present = np.array([field in row for row in subset])
+                    if present.any():
+                        column = self.columns[field] = self.columns[field].copy()
+                        column[at[present]] = self._column(field, [row for row, p in zip(subset, present) if p])
+
+            new = ~existing
+            if new.any():
+                order = np.argsort(days[new], kind='stable')
+                new_ids, new_days = ids[new][order], days[new][order]
+                new_rows = [row for row, n in zip(rows, new) if n]
+                new_rows = [new_rows[i] for i in order]
+                at = np.searchsorted(self.days, new_days, side='right')
+                self.days = np.insert(self.days, at, new_days)
+                self.ids = np.insert(self.ids, at, new_ids)
+                for field in self.fields:
+                    self.columns[field] = np.insert(self.columns[field], at, self._column(field, new_rows))
+                self._id_days.update(zip(new_ids.tolist(), new_days))
+
+    def _position(self, doc_id):
+        day = self._id_days.get(doc_id)
+        if day is None:
+            return -1
+        lo, hi = np.searchsorted(self.days, day, side='left'), np.searchsorted(self.days, day, side='right')
+        match = np.flatnonzero(self.ids[lo:hi] == doc_id)
+        return lo + match[0] if len(match) else -1
+
+    def _delete(self, positions):
+        for doc_id in self.ids[positions]:
+            self._id_days.pop(doc_id, None)
+        self.days = np.delete(self.days, positions)
+        self.ids = np.delete(self.ids, positions)
+        for field in self.fields:
+            self.columns[field] = np.delete(self.columns[field], positions)
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.refresh_interval:
+            return
+        with self._refresh_lock:
+            if not force and self._checked_at is not None and now - self._checked_at < self.refresh_interval:
+                return
+            self._checked_at = now
+            documents, self._high_water_mark = fetch_changed(
+                self.client, self.collection, self._high_water_mark, self.updated_field)
+            self.upsert(documents)
+
+    def query(self, start=None, end=None, latest=None):
+        """Records dated start..end (inclusive, either open), the last `latest` of them if given."""
+        with self._lock:
+            days, ids, columns = self.days, self.ids, dict(self.columns)
+        lo = 0 if start is None else np.searchsorted(days, to_days([start])[0], side='left')
+        hi = len(days) if end is None else np.searchsorted(days, to_days([end])[0], side='right')
+        if latest is not None:
+            lo = max(lo, hi - latest)
+        values = {'id': ids[lo:hi].tolist()}
+        for field in self.fields:
+            column = columns[field][lo:hi]
+            if field in self.numeric_fields:
+                column = np.where(np.isnan(column), None, column)
+            values[field] = column.tolist()
+        return [dict(zip(values, row)) for row in zip(*values.values())]
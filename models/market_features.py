@@ -0,0 +1,301 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from Data.firestore_bulk import UPDATED_AT_FIELD, fetch_changed
+from models.features import to_days
+
+GOLD_COLUMN = 'Adj Close'
+
+# Closing prices in Data/price.csv: gold, S&P 500, Dow Jones, USO, GDX,
+# EUR/USD, silver, platinum, palladium and the US dollar index.
+MARKET_COLUMNS = [
+    GOLD_COLUMN, 'SP_close', 'DJ_close', 'USO_Close', 'GDX_Close',
+    'EU_Price', 'SF_Price', 'PLT_Price', 'PLD_Price', 'USDI_Price',
+]
+RATIO_PAIRS = [
+    (GOLD_COLUMN, 'SF_Price'), (GOLD_COLUMN, 'PLT_Price'), (GOLD_COLUMN, 'PLD_Price'),
+    ('GDX_Close', GOLD_COLUMN), (GOLD_COLUMN, 'USDI_Price'), ('SP_close', GOLD_COLUMN),
+]
+RETURN_LAGS = (1, 5)
+MA_WINDOWS = (5, 20)
+VOLATILITY_WINDOW = 20
+
+# Rows of history one feature row depends on.
+LOOKBACK = max(max(RETURN_LAGS), max(MA_WINDOWS), VOLATILITY_WINDOW + 1)
+
+
+def available_market_columns(frame):
+    return [c for c in MARKET_COLUMNS if c in frame.columns and frame[c].notna().any()]
+
+
+def _ratio_pairs(columns):
+    return [(a, b) for a, b in RATIO_PAIRS if a in columns and b in columns]
+
+
+def market_feature_names(columns):
+    names = []
+    for column in columns:
+        names += [f"{column} Return {lag}d" for lag in RETURN_LAGS]
+        names += [f"{column} MA{window} Ratio" for window in MA_WINDOWS]
+        names.append(f"{column} Volatility {VOLATILITY_WINDOW}d")
+    names += [f"{a}/{b} Log Ratio" for a, b in _ratio_pairs(columns)]
+    return names
+
+
+def compute_market_features(prices, columns):
+    """Feature rows for a (days x columns) array of prices in date order.
+
+    Row t uses prices up to and including day t; rows without enough
+    history for a window are NaN there.
+    """
+    prices = np.asarray(prices, dtype=np.float64)
+    n, k = prices.shape
+    log_prices = np.log(prices)
+    blocks = []
+
+    returns = {}
+    for lag in RETURN_LAGS:
+        r = np.full((n, k), np.nan)
+        r[lag:] = log_prices[lag:] - log_prices[:-lag]
+        returns[lag] = r
+
+    ma_ratios = {}
+    for window in MA_WINDOWS:
+        ratio = np.full((n, k), np.nan)
+        if n >= window:
+            moving_average = sliding_window_view(prices, window, axis=0).mean(axis=-1)
+            ratio[window - 1:] = prices[window - 1:] / moving_average - 1
+        ma_ratios[window] = ratio
+
+    volatility = np.full((n, k), np.nan)
+    if n > VOLATILITY_WINDOW:
+        daily = returns[1][1:] if 1 in returns else log_prices[1:] - log_prices[:-1]
+        volatility[VOLATILITY_WINDOW:] = sliding_window_view(daily, VOLATILITY_WINDOW, axis=0).std(axis=-1, ddof=1)
+
+    per_column = [returns[lag] for lag in RETURN_LAGS] + [ma_ratios[w] for w in MA_WINDOWS] + [volatility]
+    # Interleave so each column's features are adjacent, matching market_feature_names().
+    blocks.append(np.stack(per_column, axis=2).reshape(n, k * len(per_column)))
+
+    index = {column: i for i, column in enumerate(columns)}
+    pairs = _ratio_pairs(columns)
+    if pairs:
+        blocks.append(np.column_stack([log_prices[:, index[a]] - log_prices[:, index[b]] for a, b in pairs]))
+    return np.hstack(blocks)
+
+
+def _price_matrix(frame, columns):
+    # A missing quote carries the previous one forward.
+    return frame[columns].apply(pd.to_numeric, errors='coerce').ffill().to_numpy(dtype=np.float64)
+
+
+def add_market_features(prices, columns=None, date_column='Date'):
+    """prices (a frame in date order) plus the market features known before each day.
+
+    Row t gets the features computed from days up to t - 1, so nothing from
+    the day being predicted leaks in.
+    """
+    columns = columns or available_market_columns(prices)
+    features = compute_market_features(_price_matrix(prices, columns), columns)
+    lagged = np.vstack([np.full((1, features.shape[1]), np.nan), features[:-1]])
+    lagged = pd.DataFrame(lagged, columns=market_feature_names(columns), index=prices.index)
+    return pd.concat([prices, lagged], axis=1)
+
+
+class MarketFeatureEngine:
+    """Live market features, updated one price row at a time.
+
+    Prices and feature rows are kept in date-ordered arrays grown by
+    doubling. A new latest row only recomputes its own feature row from the
+    last LOOKBACK rows with the same window arithmetic as the batch path, so
+    a live row matches what training computes for that day. An update for an
+    earlier date recomputes everything. update_many() applies a batch of
+    rows at once, so a backfill costs one recomputation rather than one per
+    row. features_for() looks up, for each date, the features of the latest
+    day before it.
+    """
+
+    def __init__(self, columns=None):
+        self.columns = list(columns or MARKET_COLUMNS)
+        self.names = market_feature_names(self.columns)
+        self.version = 0
+        self._days = np.empty(0, dtype='datetime64[D]')
+        self._prices = np.empty((0, len(self.columns)))
+        self._features = np.empty((0, len(self.names)))
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_frame(cls, frame, columns=None, date_column='Date'):
+        engine = cls(columns or available_market_columns(frame))
+        engine.load(frame, date_column)
+        return engine
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def days(self):
+        return self._days[:self._size]
+
+    def load(self, frame, date_column='Date'):
+        frame = frame.assign(_day=to_days(frame[date_column].to_numpy()))
+        frame = frame.dropna(subset=['_day']).sort_values('_day').drop_duplicates('_day', keep='last')
+        days = frame['_day'].to_numpy(dtype='datetime64[D]')
+        prices = _price_matrix(frame.reindex(columns=self.columns), self.columns)
+        with self._lock:
+            self._days, self._prices, self._size = days, prices, len(days)
+            self._features = compute_market_features(prices, self.columns)
+            self.version += 1
+
+    def _grow(self):
+        capacity = max(16, 2 * len(self._days))
+        self._days = np.resize(self._days, capacity)
+        self._prices = np.resize(self._prices, (capacity, len(self.columns)))
+        self._features = np.resize(self._features, (capacity, len(self.names)))
+
+    def update(self, date, values):
+        """Add or replace the prices for one day; values maps column to price."""
+        day = to_days([date])[0]
+        if np.isnat(day):
+            raise ValueError(f"Unparseable date: {date}")
+        row = np.array([float(values.get(c, np.nan)) if values.get(c) not in (None, '') else np.nan
+                        for c in self.columns])
+        with self._lock:
+            n = self._size
+            if n and day <= self._days[n - 1]:
+                self._replace(day, row)
+                return
+            if n:
+                row = np.where(np.isnan(row), self._prices[n - 1], row)
+            if n == len(self._days):
+                self._grow()
+            self._days[n] = day
+            self._prices[n] = row
+            start = max(0, n + 1 - LOOKBACK)
+            self._features[n] = compute_market_features(self._prices[start:n + 1], self.columns)[-1]
+            self._size = n + 1
+            self.version += 1
+
+    def update_many(self, frame, date_column='Date'):
+        """Add or replace the prices of every row in frame (rows for one day merge, later ones winning)."""
+        frame = frame.assign(_day=to_days(frame[date_column].to_numpy())).dropna(subset=['_day'])
+        if frame.empty:
+            return
+        frame = frame.reindex(columns=self.columns + ['_day'])
+        frame[self.columns] = frame[self.columns].apply(pd.to_numeric, errors='coerce')
+        frame = frame.groupby('_day', sort=True).last()
+        new_days = frame.index.to_numpy(dtype='datetime64[D]')
+        rows = frame.to_numpy(dtype=np.float64)
+        with self._lock:
+            n = self._size
+            if not n or new_days[0] > self._days[n - 1]:
+                # Appending only: compute the new rows from the last LOOKBACK rows.
+                m = len(new_days)
+                start = max(0, n + 1 - LOOKBACK)
+                prices = pd.DataFrame(np.vstack([self._prices[n - 1:n], rows])).ffill().to_numpy()[min(n, 1):]
+                while n + m > len(self._days):
+                    self._grow()
+                self._days[n:n + m] = new_days
+                self._prices[n:n + m] = prices
+                self._features[n:n + m] = compute_market_features(self._prices[start:n + m], self.columns)[-m:]
+                self._size = n + m
+                self.version += 1
+                return
+            days = np.union1d(self._days[:n], new_days)
+            prices = np.full((len(days), len(self.columns)), np.nan)
+            prices[np.searchsorted(days, self._days[:n])] = self._prices[:n]
+            position = np.searchsorted(days, new_days)
+            prices[position] = np.where(np.isnan(rows), prices[position], rows)
+            prices = pd.DataFrame(prices).ffill().to_numpy()
+            if len(days) == n and np.array_equal(prices, self._prices[:n], equal_nan=True):
+                return  # a repeat of what is already there
+            self._days, self._prices, self._size = days, prices, len(days)
+            self._features = compute_market_features(prices, self.columns)
+            self.version += 1
+
+    def _replace(self, day, row):
+        n = self._size
+        days, prices = self._days[:n], self._prices[:n]
+        position = np.searchsorted(days, day)
+        if position < n and days[position] == day:
+            row = np.where(np.isnan(row), prices[position], row)
+            if np.array_equal(row, prices[position], equal_nan=True):
+                return  # a repeat of what is already there
+            prices = prices.copy()
+            prices[position] = row
+        else:
+            if position:
+                row = np.where(np.isnan(row), prices[position - 1], row)
+            days = np.insert(days, position, day)
+            prices = np.insert(prices, position, row, axis=0)
+        # Later rows may have carried the old value forward; recompute all.
+        self._days, self._prices, self._size = days, prices, len(days)
+        self._features = compute_market_features(prices, self.columns)
+        self.version += 1
+
+    def features_for(self, dates, names=None):
+        """(len(dates) x features) array of the features known before each date.
+
+        names picks and orders the feature columns (a pipeline's
+        market_columns); unknown names and dates before any history are NaN.
+        """
+        days = to_days(dates)
+        names = self.names if names is None else list(names)
+        positions = {name: i for i, name in enumerate(self.names)}
+        columns = np.array([positions.get(name, -1) for name in names], dtype=np.int64)
+        with self._lock:
+            index = np.searchsorted(self._days[:self._size], days, side='left') - 1
+            out = np.full((len(days), len(names)), np.nan)
+            known = (index >= 0) & ~np.isnat(days)
+            found = columns >= 0
+            out[np.ix_(known, found)] = self._features[np.ix_(index[known], columns[found])]
+        return out
+
+    def latest(self):
+        """The feature vector that applies to the next trading day, by name."""
+        with self._lock:
+            if not self._size:
+                return {}
+            return dict(zip(self.names, self._features[self._size - 1].tolist()))
+
+
+class MarketFeatureSync:
+    """Keeps a MarketFeatureEngine in step with the price collection.
+
+    The first refresh loads the whole collection. Later ones, at most every
+    refresh_interval seconds, fetch only documents stamped since the last
+    one, which picks up prices written by other worker processes.
+    """
+
+    def __init__(self, client, collection, engine, refresh_interval=30.0, updated_field=UPDATED_AT_FIELD):
+        self.client = client
+        self.collection = collection
+        self.engine = engine
+        self.refresh_interval = refresh_interval
+        self.updated_field = updated_field
+        self._high_water_mark = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self._checked_at is not None and now - self._checked_at < self.refresh_interval:
+            return
+        with self._lock:
+            if not force and self._checked_at is not None and now - self._checked_at < self.refresh_interval:
+                return
+            self._checked_at = now
+            cold = self._high_water_mark is None
+            documents, self._high_water_mark = fetch_changed(
+                self.client, self.collection, self._high_water_mark, self.updated_field)
+            if not documents:
+                return
+            frame = pd.DataFrame([fields for _, fields in documents])
+            if cold or not len(self.engine):
+                self.engine.load(frame)
+                return
+            self.engine.update_many(frame)
@@ -1,71 +1,93 @@
+import argparse
+import copy
+import json
+import os
+import sys
+import numpy as np
 import pandas as pd
-from elasticsearch import Elasticsearch
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_absolute_error
-from sklearn.preprocessing import LabelEncoder, StandardScaler
 from sklearn.model_selection import train_test_split
 import logging
 import joblib
-import firebase_admin
-from firebase_admin import credentials, firestore
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Data.collection_cache import CollectionCache
+from Data.firestore_bulk import LazyFirestoreClient
+from models.compiled_forest import compile_forest
+from models import daily_sentiment, features, market_features, training
+from models.daily_sentiment import DAILY_SENTIMENT_COLLECTION, DailySentiment
+from models.features import FeaturePipeline, calendar_features
+from models.headline_labeler import load_labelled_headlines
+from models.market_features import (
+    MarketFeatureEngine, add_market_features, available_market_columns, market_feature_names
+)
+from models.stage_cache import StageCache
+from models.training import grid_search
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-cred = credentials.Certificate("../firebase.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+# Connected on first fetch, so importing this module (as the app does for
+# online updates) never initialises Firebase.
+db = LazyFirestoreClient("../firebase.json")
+
+CACHE_DIR = os.environ.get(
+    'COLLECTION_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.collection_cache')
+)
 
 def fetch_all_data(index_name):
-    docs = db.collection(index_name).stream()
+    logger.info(f"Fetching all records from {index_name}...")
 
-    data = [doc.to_dict() for doc in docs]  # Extract data as a list of dictionaries
-    df = pd.DataFrame(data)
+    # Only documents changed since the last run are pulled from Firestore.
+    df = CollectionCache(db, index_name, CACHE_DIR).sync()
 
-    logger.info(f"Fetching all records from {index_name}...")
-    
     return df
 
-def fetch_and_merge_data(news_index, price_index):
-    news_df = fetch_all_data(news_index)
-    
-    logger.info("News Data (first few records):")
-    logger.info(news_df.head())
-    
-    try:
-        logger.info("Converting 'Dates' column to datetime...")
-        news_df['Date'] = pd.to_datetime(news_df['Date'], format='%d-%m-%Y', errors='coerce')
-        logger.info(f"After conversion, here are the first few rows of dates:")
-        logger.info(news_df['Date'].head())
-    except Exception as e:
-        logger.error(f"Error during date conversion: {e}")
-    
+def fetch_daily_sentiment(news_index):
+    daily = DailySentiment.from_documents(fetch_all_data(DAILY_SENTIMENT_COLLECTION))
+    if not len(daily):
+        # Stores seeded before the daily table existed only have headlines.
+        logger.info(f"{DAILY_SENTIMENT_COLLECTION} is empty, aggregating {news_index} instead...")
+        daily = DailySentiment.aggregate(fetch_all_data(news_index))
+    logger.info(f"Daily sentiment covers {len(daily)} days")
+    return daily
+
+def fetch_price_data(price_index):
     price_df = fetch_all_data(price_index)
-    
+
     logger.info("Price Data (first few records):")
     logger.info(price_df.head())
 
-    try:
-        logger.info("Converting 'Date' column to datetime...")
-        price_df['Date'] = pd.to_datetime(price_df['Date'], errors='coerce')
-        logger.info(f"After conversion, here are the first few rows of dates:")
-        logger.info(price_df['Date'].head())
-    except Exception as e:
-        logger.error(f"Error during date conversion: {e}")
-
-    logger.info("Merging news and price data...")
-    merged_data = pd.merge(news_df, price_df, left_on='Date', right_on='Date', how='inner')
-    
-    logger.info(f"Merged Data (first few records):")
+    return clean_price_dates(price_df)
+
+def clean_price_dates(price_df):
+    price_df['Date'] = pd.to_datetime(price_df['Date'], errors='coerce')
+    return price_df.dropna(subset=['Date']).sort_values(by='Date').reset_index(drop=True)
+
+def merge_price_and_sentiment(daily, price_df):
+    # Market features are computed over every price day before the join
+    # drops days without recent headlines, so lags are trading-day lags.
+    price_df = add_market_features(price_df)
+
+    # Each price day takes the aggregates of its latest headline day, rather
+    # than an exact-date merge against one headline per date.
+    logger.info("Joining daily sentiment to price data...")
+    merged_data = daily.asof_join(price_df)
+
+    logger.info("Merged Data (first few records):")
     logger.info(merged_data.head())
-    
-    merged_data = merged_data.sort_values(by='Date')
     print(merged_data.shape)
 
     return merged_data
 
-def train_random_forest_model(X_train, y_train):
-    model = RandomForestRegressor(n_estimators=100, random_state=42)
+def fetch_and_merge_data(news_index, price_index):
+    return merge_price_and_sentiment(fetch_daily_sentiment(news_index), fetch_price_data(price_index))
+
+def train_random_forest_model(X_train, y_train, **params):
+    params = {'n_estimators': 100, **params}
+    model = RandomForestRegressor(random_state=42, n_jobs=-1, **params)
     model.fit(X_train, y_train)
     return model
 
@@ -75,69 +97,136 @@ def evaluate_model(model, X_test, y_test):
     logger.info(f"Mean Absolute Error: {mae}")
     return mae
 
+def build_feature_matrix(merged_df):
+    columns = available_market_columns(merged_df)
+    market_columns = [c for c in market_feature_names(columns) if c in merged_df.columns]
+    pipeline = FeaturePipeline(market_columns=market_columns).fit_sentiment(merged_df['Price Sentiment'])
+
+    X, valid = pipeline.raw_features(merged_df)
+    if not valid.all():
+        logger.info(f"Dropping {(~valid).sum()} rows with missing dates or flags")
+    X = X[valid]
+    y = merged_df['Adj Close'].to_numpy(dtype=float)[valid]
+    return X, y, pipeline
+
 def preprocess_data_with_date(merged_df):
-    merged_df['Year'] = merged_df['Date'].dt.year
-    merged_df['Month'] = merged_df['Date'].dt.month
-    merged_df['Day'] = merged_df['Date'].dt.day
-    merged_df['DayOfWeek'] = merged_df['Date'].dt.dayofweek
-    merged_df['WeekOfYear'] = merged_df['Date'].dt.isocalendar().week
-
-    le = LabelEncoder()
-    merged_df['Price Sentiment'] = le.fit_transform(merged_df['Price Sentiment'])
-
-    X = merged_df[['Year', 'Month', 'Day', 'DayOfWeek', 'WeekOfYear',
-                   'Price Direction Up', 'Price Direction Constant', 
-                   'Price Direction Down', 'Asset Comparison', 
-                   'Past Information', 'Future Information', 
-                   'Price Sentiment']]
-    y = merged_df['Adj Close']
+    X, y, pipeline = build_feature_matrix(merged_df)
+    return split_and_scale(X, y, pipeline)
 
+def split_and_scale(X, y, pipeline):
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_test_scaled = scaler.transform(X_test)
+    pipeline.fit_scaler(X_train)
+    X_train_scaled = pipeline.transform(X_train)
+    X_test_scaled = pipeline.transform(X_test)
 
-    return X_train_scaled, X_test_scaled, y_train, y_test, scaler
+    return X_train_scaled, X_test_scaled, y_train, y_test, pipeline
 
-def predict_with_date(model, scaler, date, other_features):
-    year = date.year
-    month = date.month
-    day = date.day
-    day_of_week = date.weekday()
-    week_of_year = date.isocalendar()[1]
+def predict_with_date(model, pipeline, date, other_features, market=()):
+    calendar = calendar_features([pd.Timestamp(date).to_datetime64()])[0]
+    sentiment = pipeline.encode_sentiment([other_features[-1]])[0]
 
-    input_features = [year, month, day, day_of_week, week_of_year] + other_features
+    input_features = list(calendar) + list(other_features[:-1]) + [sentiment] + list(market)
 
-    input_scaled = scaler.transform([input_features])
+    input_scaled = pipeline.transform([input_features])
 
     predicted_price = model.predict(input_scaled)
     return predicted_price[0]
 
+def save_artifacts(model, pipeline, X_check=None, directory='.'):
+    model_path = os.path.join(directory, 'random_forest_model.pkl')
+    # Write to a temporary name first so a serving process polling the
+    # artifact never loads a half-written file.
+    joblib.dump(model, model_path + '.tmp')
+    os.replace(model_path + '.tmp', model_path)
+
+    pipeline.save(os.path.join(directory, 'feature_pipeline.pkl'))
+
+    compiled = compile_forest(model)
+    if X_check is not None and not np.allclose(compiled.predict(X_check), model.predict(X_check)):
+        raise RuntimeError("Compiled forest predictions differ from the sklearn model")
+    compiled.save(os.path.join(directory, 'random_forest_model.npz'))
+
+    logger.info("Model, compiled forest and feature pipeline saved to disk.")
+
+def run_training_pipeline(cache, news_index, price_index, params=None, param_grid=None, from_csv=None,
+                          directory='.'):
+    """Fetch, merge, featurize, search, split, train, evaluate and publish as cached stages.
+
+    Each stage is looked up in cache under its inputs' content, its
+    parameters and its code, so only stages downstream of what changed are
+    recomputed: new data reruns everything after the fetch, new params only
+    the training and evaluation. With params the grid search is skipped.
+    from_csv is a (price CSV, sentiment CSV) pair read instead of Firestore.
+    """
+    def fetch():
+        if from_csv is not None:
+            price_path, sentiment_path = from_csv
+            return {'price': clean_price_dates(pd.read_csv(price_path)),
+                    'daily': DailySentiment.aggregate(load_labelled_headlines(sentiment_path))}
+        return {'price': fetch_price_data(price_index), 'daily': fetch_daily_sentiment(news_index)}
+
+    def merge(price, daily):
+        return {'merged': merge_price_and_sentiment(daily, price)}
+
+    def featurize(merged):
+        X, y, pipeline = build_feature_matrix(merged)
+        return {'X': X, 'y': y, 'pipeline': pipeline}
+
+    def search(X, y, param_grid=None):
+        return {'search': grid_search(X, y, param_grid)}
+
+    def split(X, y, pipeline):
+        X_train, X_test, y_train, y_test, pipeline = split_and_scale(X, y, copy.deepcopy(pipeline))
+        return {'X_train': X_train, 'X_test': X_test, 'y_train': y_train, 'y_test': y_test,
+                'scaled_pipeline': pipeline}
+
+    def train(X_train, y_train, **params):
+        return {'model': train_random_forest_model(X_train, y_train, **params)}
+
+    def evaluate(model, X_test, y_test):
+        return {'mae': float(evaluate_model(model, X_test, y_test))}
+
+    fetched = cache.run('fetch', fetch, always=True)
+    merged = cache.run('merge', merge, [fetched], code=[merge_price_and_sentiment, daily_sentiment, market_features])
+    featurized = cache.run('features', featurize, [merged], code=[build_feature_matrix, features, market_features])
+    if params is None:
+        # Rows are in date order, so the search can use rolling-origin folds.
+        searched = cache.run('search', search, [featurized], {'param_grid': param_grid}, code=[training])
+        for point in searched.values['search']['frontier']:
+            logger.info(f"Frontier: {point['fit_seconds']:.2f}s fit, MAE {point['mae']:.4f} with {point}")
+        params = searched.values['search']['best_params']
+    split_result = cache.run('split', split, [featurized], code=[split_and_scale, features])
+    trained = cache.run('train', train, [split_result], params, code=[train_random_forest_model])
+    evaluated = cache.run('evaluate', evaluate, [trained, split_result], code=[evaluate_model])
+
+    model, pipeline = trained.values['model'], split_result.values['scaled_pipeline']
+    save_artifacts(model, pipeline, np.asarray(split_result.values['X_test']), directory)
+    return {'model': model, 'pipeline': pipeline, 'params': params, 'mae': evaluated.values['mae'],
+            'price': fetched.values['price']}
+
 if __name__ == "__main__":
-    ES_HOST = "127.0.0.1"
-    ES_PORT = 9200
-    ES_USER = "elastic"
-    ES_PASS = "d3ozO4B7tEJK5Jj4U9*L"
     NEWS_INDEX = "sentiment_data"
     PRICE_INDEX = "price_data"
 
-
-    merged_data = fetch_and_merge_data(NEWS_INDEX, PRICE_INDEX)
-
-    X_train, X_test, y_train, y_test, scaler = preprocess_data_with_date(merged_data)
-
-    model = train_random_forest_model(X_train, y_train)
-
-    evaluate_model(model, X_test, y_test)
+    parser = argparse.ArgumentParser(description="Train and publish the gold price model.")
+    parser.add_argument('--params', default=None,
+                        help="JSON RandomForestRegressor parameters; skips the grid search")
+    parser.add_argument('--from-csv', action='store_true', help="use Data/*.csv instead of Firestore")
+    parser.add_argument('--cache-dir', default=os.environ.get(
+        'STAGE_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.stage_cache')))
+    parser.add_argument('--no-cache', action='store_true', help="recompute and store nothing")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    from_csv = (os.path.join(root, 'Data', 'price.csv'), os.path.join(root, 'Data', 'sentiment.csv')) \
+        if args.from_csv else None
+    cache = StageCache(args.cache_dir, enabled=not args.no_cache)
+    result = run_training_pipeline(cache, NEWS_INDEX, PRICE_INDEX, json.loads(args.params) if args.params else None,
+                                   from_csv=from_csv)
 
     input_date = pd.Timestamp('2024-12-01')
     other_features = [1, 0, 0, 1, 0, 1, 0]
-    predicted_price = predict_with_date(model, scaler, input_date, other_features)
+    market = MarketFeatureEngine.from_frame(result['price']).features_for([input_date])[0]
+    predicted_price = predict_with_date(result['model'], result['pipeline'], input_date, other_features, market)
     logger.info(f"Predicted Adjusted Close for {input_date.date()}: {predicted_price}")
-
-joblib.dump(model, 'random_forest_model.pkl')
-
-joblib.dump(scaler, 'scaler.pkl')
-
-logger.info("Model and scaler saved to disk.")
@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import joblib
+import numpy as np
+from sklearn.metrics import mean_absolute_error
+
+from models.features import load_feature_pipeline, to_days
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development server only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = 'online_training_state.json'
+LOCK_FILE = 'online_training.lock'
+
+
+class OnlineTrainer:
+    """Grows the published forest on newly ingested rows in the background.
+
+    Ingestion calls notify() after each write. Once min_new_rows submissions
+    have accumulated, or max_delay seconds after the first one, a daemon
+    thread refetches the merged training rows (incrementally, through
+    load_rows) and picks out the days the model has not been trained on.
+    The newest holdout_fraction of them are held out; the rest, together
+    with the context_rows days before them, fit trees_per_update new trees
+    with warm_start. The forest keeps its newest max_trees trees.
+
+    The candidate is published with save_artifacts, which writes each file
+    atomically, only if its holdout MAE is within tolerance of the current
+    model's. The registry in this process is reloaded at once; other workers
+    pick the new version up through their registry watchers. A lock file
+    makes sure only one process trains at a time.
+    """
+
+    def __init__(self, directory, load_rows, save_artifacts, registry=None, min_new_rows=5, max_delay=3600.0,
+                 trees_per_update=10, max_trees=300, context_rows=256, holdout_fraction=0.2, tolerance=0.05):
+        self.directory = directory
+        self.load_rows = load_rows
+        self.save_artifacts = save_artifacts
+        self.registry = registry
+        self.min_new_rows = min_new_rows
+        self.max_delay = max_delay
+        self.trees_per_update = trees_per_update
+        self.max_trees = max_trees
+        self.context_rows = context_rows
+        self.holdout_fraction = holdout_fraction
+        self.tolerance = tolerance
+        self.model_path = os.path.join(directory, 'random_forest_model.pkl')
+        self.features_path = os.path.join(directory, 'feature_pipeline.pkl')
+        self.state_path = os.path.join(directory, STATE_FILE)
+        self.last_result = None
+        self._pending = 0
+        self._first_pending_at = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+
+    def notify(self, n_rows=1):
+        """Record n_rows newly ingested rows; starts this process's scheduler if needed."""
+        with self._lock:
+            self._pending += n_rows
+            if self._first_pending_at is None:
+                self._first_pending_at = time.monotonic()
+            due = self._pending >= self.min_new_rows
+        self._ensure_thread()
+        if due:
+            self._wake.set()
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so each worker process starts its own.
+        if self._thread is not None and self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread_pid == os.getpid():
+                return
+            self._wake = threading.Event()
+            self._thread = threading.Thread(target=self._run, name="online-trainer", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                first = self._first_pending_at
+            timeout = None if first is None else max(0.0, first + self.max_delay - time.monotonic())
+            self._wake.wait(timeout)
+            self._wake.clear()
+            with self._lock:
+                if not self._pending:
+                    continue
+                self._pending = 0
+                self._first_pending_at = None
+            try:
+                self.update()
+            except Exception as e:
+                logger.error(f"Online model update failed, keeping current version: {e}")
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        return np.array(state['trained_days'], dtype='datetime64[D]')
+
+    def _save_state(self, trained_days):
+        state = {'trained_days': [str(d) for d in np.unique(trained_days)]}
+        with open(self.state_path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def _try_lock(self):
+        lock = open(os.path.join(self.directory, LOCK_FILE), 'a')
+        if fcntl is None:
+            return lock
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return None
+        return lock
+
+    def update(self):
+        """Run one update now; returns a summary dict, also kept as last_result."""
+        lock = self._try_lock()
+        if lock is None:
+            return {'status': 'busy'}  # another worker is training
+        try:
+            result = self._update()
+        finally:
+            lock.close()
+        self.last_result = dict(result, finished_at=time.time())
+        logger.info(f"Online model update: {result}")
+        return result
+
+    def _update(self):
+        if not os.path.exists(self.model_path) or not os.path.exists(self.features_path):
+            return {'status': 'no_model'}
+        rows = self.load_rows()
+        days = to_days(rows['Date'].to_numpy())
+        order = np.argsort(days, kind='stable')
+        rows, days = rows.iloc[order].reset_index(drop=True), days[order]
+
+        trained_days = self._load_state()
+        if trained_days is None:
+            # First run: the published model was trained on everything so far.
+            self._save_state(days[~np.isnat(days)])
+            return {'status': 'initialised', 'trained_rows': int((~np.isnat(days)).sum())}
+
+        pipeline = load_feature_pipeline(self.features_path)
+        X, valid = pipeline.raw_features(rows)
+        y = rows['Adj Close'].to_numpy(dtype=float)
+        valid &= ~np.isnan(y)
+        new = valid & ~np.isin(days, trained_days)
+        n_new = int(new.sum())
+        if n_new < self.min_new_rows:
+            return {'status': 'waiting', 'new_rows': n_new}
+
+        new_index = np.flatnonzero(new)
+        n_holdout = max(1, int(round(n_new * self.holdout_fraction)))
+        fit_index, holdout_index = new_index[:-n_holdout], new_index[-n_holdout:]
+        if not len(fit_index):
+            return {'status': 'waiting', 'new_rows': n_new}
+        context_index = np.flatnonzero(valid & ~new)
+        context_index = context_index[context_index < fit_index[0]][-self.context_rows:]
+        train_index = np.concatenate([context_index, fit_index])
+
+        X = pipeline.transform(X)
+        model = joblib.load(self.model_path)
+        current_mae = mean_absolute_error(y[holdout_index], model.predict(X[holdout_index]))
+
+        # warm_start keeps the fitted trees and fits only the added ones.
+        model.set_params(warm_start=True, n_jobs=1, n_estimators=len(model.estimators_) + self.trees_per_update)
+        model.fit(X[train_index], y[train_index])
+        if len(model.estimators_) > self.max_trees:
+            model.estimators_ = model.estimators_[-self.max_trees:]
+            model.n_estimators = len(model.estimators_)
+        candidate_mae = mean_absolute_error(y[holdout_index], model.predict(X[holdout_index]))
+
+        result = {
+            'new_rows': n_new, 'fit_rows': len(train_index), 'holdout_rows': n_holdout,
+            'current_mae': current_mae, 'candidate_mae': candidate_mae, 'trees': len(model.estimators_),
+        }
+        if candidate_mae > current_mae * (1 + self.tolerance):
+            return dict(result, status='rejected')
+
+        self.save_artifacts(model, pipeline, X[holdout_index], self.directory)
+        # Held-out days stay new, so the next update trains on them.
+        self._save_state(np.concatenate([trained_days, days[fit_index]]))
+        if self.registry is not None:
+            self.registry.reload(force=True)
+        return dict(result, status='published')
@@ -0,0 +1,206 @@
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from models.features import FLAG_COLUMNS, SENTIMENT_COLUMN, calendar_features
+
+logger = logging.getLogger(__name__)
+
+N_FLAG_COMBINATIONS = 2 ** len(FLAG_COLUMNS)
+BUILD_CHUNK_ROWS = 65536
+
+
+def _flag_bit(value):
+    if value in (0, 1, '0', '1', 0.0, 1.0):
+        return int(value)
+    return None
+
+
+class PredictionTable:
+    """Predictions for every (day, 0/1 flag combination, sentiment) in a date range.
+
+    The table is indexed [day offset, flag bits, sentiment index]; flag bits
+    follow FLAG_COLUMNS with the first column as the most significant bit.
+    For pipelines with market features, market holds each day's market
+    feature row and market_version the engine version they came from.
+    """
+
+    def __init__(self, version, start_day, predictions, sentiment_index, market_version=None):
+        self.version = version
+        self.start_day = start_day
+        self.predictions = predictions
+        self.sentiment_index = sentiment_index
+        self.market_version = market_version
+
+    @classmethod
+    def build(cls, model, features, version, start_day, n_days, market=None, market_version=None):
+        days = np.arange(start_day, start_day + n_days)
+        bits = (np.arange(N_FLAG_COMBINATIONS)[:, None] >> np.arange(len(FLAG_COLUMNS) - 1, -1, -1)) & 1
+        labels = sorted(features.sentiment_mapping, key=features.sentiment_mapping.get)
+        encoded = np.array([features.sentiment_mapping[label] for label in labels])
+
+        # Rows ordered day-major, then flag combination, then sentiment.
+        n_rows = n_days * N_FLAG_COMBINATIONS * len(encoded)
+        X = np.empty((n_rows, len(features.feature_columns)))
+        X[:, :5] = np.repeat(calendar_features(days), N_FLAG_COMBINATIONS * len(encoded), axis=0)
+        X[:, 5:11] = np.tile(np.repeat(bits, len(encoded), axis=0), (n_days, 1))
+        X[:, 11] = np.tile(encoded, n_days * N_FLAG_COMBINATIONS)
+        if features.market_columns:
+            X[:, 12:] = np.repeat(market, N_FLAG_COMBINATIONS * len(encoded), axis=0)
+        X = features.transform(X)
+
+        predictions = np.concatenate([
+            model.predict(X[i:i + BUILD_CHUNK_ROWS]) for i in range(0, n_rows, BUILD_CHUNK_ROWS)
+        ])
+        predictions = predictions.reshape(n_days, N_FLAG_COMBINATIONS, len(encoded))
+        return cls(version, start_day, predictions, {label: i for i, label in enumerate(labels)}, market_version)
+
+    @property
+    def end_day(self):
+        return self.start_day + len(self.predictions)
+
+    def lookup(self, record):
+        """The precomputed prediction for an input dict, or None if it is outside the table."""
+        try:
+            day = np.datetime64(record['Date'], 'D')
+        except (ValueError, TypeError):
+            return None
+        offset = int((day - self.start_day).astype(np.int64))
+        if not 0 <= offset < len(self.predictions):
+            return None
+
+        combination = 0
+        for column in FLAG_COLUMNS:
+            bit = _flag_bit(record[column])
+            if bit is None:
+                return None
+            combination = (combination << 1) | bit
+
+        sentiment = self.sentiment_index.get(record[SENTIMENT_COLUMN])
+        if sentiment is None:
+            return None
+        return float(self.predictions[offset, combination, sentiment])
+
+
+class PredictionTableService:
+    """Rebuilds the prediction table in the background for each published model.
+
+    With a market feature engine, the table is also rebuilt whenever new
+    prices change the market features; lookups miss until it is ready. One
+    builder thread always builds for the newest request, so requests made
+    during a build collapse into a single follow-up build, and rebuilds for
+    market changes wait until no newer change has come in for
+    market_debounce seconds.
+    """
+
+    def __init__(self, registry, n_days=365, market=None, market_debounce=2.0):
+        self.n_days = n_days
+        self.market = market
+        self.market_debounce = market_debounce
+        self.table = None
+        self._building = None
+        self._requested = None
+        self._pending = None  # (snapshot, key, not_before)
+        self._thread = None
+        self._thread_pid = None
+        self._cond = threading.Condition()
+        registry.subscribe(self.rebuild)
+
+    def _market_version(self, snapshot):
+        if not snapshot.features.market_columns or self.market is None:
+            return None
+        return self.market.version
+
+    def rebuild(self, snapshot, delay=0.0):
+        if snapshot.features is None:
+            return
+        key = (snapshot.version, self._market_version(snapshot))
+        with self._cond:
+            self._requested = key
+            if self._building == key and self._pending is None:
+                return
+            if self._pending is not None and self._pending[1] == key:
+                return
+            self._pending = (snapshot, key, time.monotonic() + delay)
+            self._cond.notify_all()
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so each worker process starts its own.
+        if self._thread is not None and self._thread_pid == os.getpid():
+            return
+        with self._cond:
+            if self._thread is not None and self._thread_pid == os.getpid():
+                return
+            self._building = None
+            self._thread = threading.Thread(target=self._run, name="prediction-table", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def wait(self, timeout=None):
+        """Block until no build is in progress or waiting."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending is not None or self._building is not None:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return
+                self._cond.wait(remaining)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._pending is None:
+                        self._cond.wait()
+                        continue
+                    # A newer request replaces this one and restarts its delay.
+                    remaining = self._pending[2] - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                snapshot, key, _ = self._pending
+                self._pending = None
+                self._building = key
+            try:
+                self._build(snapshot, key[1])
+            finally:
+                with self._cond:
+                    self._building = None
+                    self._cond.notify_all()
+
+    def _build(self, snapshot, market_version):
+        start_day = np.datetime64('today', 'D')
+        market = None
+        try:
+            if snapshot.features.market_columns:
+                if self.market is None:
+                    return
+                days = np.arange(start_day, start_day + self.n_days)
+                market = self.market.features_for(days, snapshot.features.market_columns)
+                if np.isnan(market).any():
+                    logger.info(f"No market features for model {snapshot.version} yet, not building a table")
+                    return
+            table = PredictionTable.build(snapshot.model, snapshot.features, snapshot.version, start_day,
+                                          self.n_days, market, market_version)
+        except Exception as e:
+            logger.error(f"Building prediction table for model {snapshot.version} failed: {e}")
+            return
+        self.table = table
+        logger.info(f"Prediction table for model {snapshot.version} covers {start_day} to {table.end_day}")
+
+    def lookup(self, record, snapshot):
+        table = self.table
+        market_version = self._market_version(snapshot)
+        if market_version is not None and self._requested != (snapshot.version, market_version):
+            # New prices have changed the market features since the last build.
+            self.rebuild(snapshot, self.market_debounce)
+        if table is None or table.version != snapshot.version or table.market_version != market_version:
+            return None
+        # Roll the window forward once half of it has gone by.
+        if np.datetime64('today', 'D') - table.start_day > self.n_days // 2:
+            self.rebuild(snapshot)
+        return table.lookup(record)
@@ -0,0 +1,151 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import joblib
+
+from models.compiled_forest import CompiledForest
+from models.features import load_feature_pipeline
+
+logger = logging.getLogger(__name__)
+
+ModelSnapshot = namedtuple("ModelSnapshot", ["model", "features", "version", "loaded_at", "load_seconds"])
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    """Keeps one loaded copy of the model artifacts per process.
+
+    The first call to get() loads the model (memory-mapped, so workers reading
+    the same file share its pages) and its feature pipeline, and starts a
+    daemon thread that polls the artifacts' mtime/size. When a file changes
+    and has stopped changing, its hash is compared and a new snapshot is
+    loaded and swapped in; requests keep using the previous snapshot until
+    the swap.
+    """
+
+    def __init__(self, model_path, features_path=None, poll_interval=5.0, mmap_mode="r"):
+        self.model_path = model_path
+        self.features_path = features_path
+        self.poll_interval = poll_interval
+        self.mmap_mode = mmap_mode
+        self._snapshot = None
+        self._load_lock = threading.Lock()
+        self._stamps = None
+        self._pending_stamps = None
+        self._watcher = None
+        self._watcher_pid = None
+        self._stop = threading.Event()
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        """Call callback(snapshot) whenever a model version is published."""
+        self._subscribers.append(callback)
+        if self._snapshot is not None:
+            callback(self._snapshot)
+
+    def _paths(self):
+        return [p for p in (self.model_path, self.features_path) if p]
+
+    def _stat(self):
+        stamps = []
+        for path in self._paths():
+            try:
+                st = os.stat(path)
+                stamps.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stamps.append(None)
+        return tuple(stamps)
+
+    def _version(self):
+        digest = hashlib.sha256()
+        for path in self._paths():
+            if os.path.exists(path):
+                digest.update(file_digest(path).encode())
+        return digest.hexdigest()[:16]
+
+    def _load(self, stamps, version):
+        start = time.perf_counter()
+        if self.model_path.endswith(".npz"):
+            model = CompiledForest.load(self.model_path, self.mmap_mode)
+        else:
+            model = joblib.load(self.model_path, mmap_mode=self.mmap_mode)
+        features = None
+        if self.features_path and os.path.exists(self.features_path):
+            features = load_feature_pipeline(self.features_path)
+        snapshot = ModelSnapshot(model, features, version, time.time(), time.perf_counter() - start)
+        self._stamps = stamps
+        self._snapshot = snapshot
+        logger.info(f"Loaded model version {version} from {self.model_path}")
+        for callback in self._subscribers:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.error(f"Model publish callback failed: {e}")
+        return snapshot
+
+    def get(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._load_lock:
+                snapshot = self._snapshot
+                if snapshot is None:
+                    snapshot = self._load(self._stat(), self._version())
+        self._ensure_watcher()
+        return snapshot
+
+    def reload(self, force=False):
+        """Swap in a new snapshot if the artifacts changed; returns True on swap."""
+        stamps = self._stat()
+        if not force:
+            if stamps == self._stamps or None in stamps[:1]:
+                self._pending_stamps = None
+                return False
+            # Wait until the file has stopped changing so a half-written dump
+            # is never picked up.
+            if stamps != self._pending_stamps:
+                self._pending_stamps = stamps
+                return False
+        with self._load_lock:
+            version = self._version()
+            current = self._snapshot
+            if current is not None and current.version == version and not force:
+                self._stamps = stamps
+                return False
+            self._load(stamps, version)
+        self._pending_stamps = None
+        return True
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.reload()
+            except Exception as e:
+                logger.error(f"Model reload failed, keeping current version: {e}")
+
+    def _ensure_watcher(self):
+        if not self.poll_interval:
+            return
+        # Threads do not survive fork, so each worker process starts its own.
+        if self._watcher is not None and self._watcher_pid == os.getpid():
+            return
+        with self._load_lock:
+            if self._watcher is not None and self._watcher_pid == os.getpid():
+                return
+            self._stop = threading.Event()
+            self._watcher = threading.Thread(target=self._watch, name="model-registry-watcher", daemon=True)
+            self._watcher_pid = os.getpid()
+            self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,167 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pickle
+import shutil
+import time
+from collections import namedtuple
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from Data.columnar import read_columns, write_columns
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+MANIFEST = 'stage.json'
+
+FRAME = 'frame'
+ARRAY = 'array'
+OBJECT = 'object'
+
+StageResult = namedtuple('StageResult', ['name', 'key', 'digest', 'values', 'cached'])
+
+
+def code_version(*code):
+    """Hash of the source of functions and modules a stage depends on."""
+    digest = hashlib.sha256()
+    for item in code:
+        if inspect.ismodule(item):
+            with open(item.__file__, 'rb') as f:
+                digest.update(f.read())
+        else:
+            digest.update(inspect.getsource(item).encode())
+    return digest.hexdigest()[:16]
+
+
+def fingerprint(value):
+    """Content hash of a stage output."""
+    digest = hashlib.sha256()
+    if isinstance(value, pd.DataFrame):
+        digest.update(json.dumps([[str(c) for c in value.columns], [str(t) for t in value.dtypes]]).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray) and value.dtype != object:
+        digest.update(f"{value.dtype}{value.shape}".encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    else:
+        digest.update(pickle.dumps(value, protocol=4))
+    return digest.hexdigest()
+
+
+def _digest(values):
+    digest = hashlib.sha256()
+    for name in sorted(values):
+        digest.update(f"{name}={fingerprint(values[name])};".encode())
+    return digest.hexdigest()
+
+
+class StageCache:
+    """Outputs of pipeline stages on disk, addressed by what they were computed from.
+
+    run() keys a stage by its name, the source of the code it depends on,
+    its parameters and the content digests of its inputs. A stage whose key
+    is stored is loaded instead of run: DataFrames (as columnar directories)
+    and arrays come back memory-mapped, anything else through joblib. Since
+    inputs are identified by content, a rerun upstream stage that produces
+    the same outputs leaves everything below it cached. The newest `keep`
+    entries of each stage are kept.
+    """
+
+    def __init__(self, directory, keep=3, enabled=True):
+        self.directory = directory
+        self.keep = keep
+        self.enabled = enabled
+
+    def _path(self, name, key):
+        return os.path.join(self.directory, f"{name}-{key[:24]}")
+
+    def run(self, name, fn, inputs=(), params=None, code=(), always=False):
+        """fn(**outputs of inputs, **params) -> dict of outputs, from the cache when possible.
+
+        always=True stages (fetching from a source that can change) run
+        every time and are not stored; only their outputs' digest is used,
+        so unchanged data still hits the cache below.
+        """
+        params = dict(params or {})
+        # Each input's outputs are passed by name to the parameters fn declares.
+        names = [n for n, p in inspect.signature(fn).parameters.items()
+                 if p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY)]
+        arguments = {k: v for result in inputs for k, v in result.values.items() if k in names}
+        if always:
+            start = time.perf_counter()
+            values = fn(**arguments, **params)
+            digest = _digest(values)
+            logger.info(f"Stage {name}: ran in {time.perf_counter() - start:.2f}s (digest {digest[:12]})")
+            return StageResult(name, digest, digest, values, False)
+
+        key = hashlib.sha256(json.dumps(
+            [CACHE_VERSION, name, code_version(fn, *code), sorted(params.items()), [r.digest for r in inputs]],
+            default=str,
+        ).encode()).hexdigest()
+        path = self._path(name, key)
+        if self.enabled and os.path.exists(os.path.join(path, MANIFEST)):
+            result = self._load(name, key, path)
+            logger.info(f"Stage {name}: cached ({key[:12]})")
+            return result
+
+        start = time.perf_counter()
+        values = fn(**arguments, **params)
+        digest = _digest(values)
+        logger.info(f"Stage {name}: ran in {time.perf_counter() - start:.2f}s ({key[:12]})")
+        if self.enabled:
+            self._store(name, key, digest, values, path)
+            self._prune(name)
+        return StageResult(name, key, digest, values, False)
+
+    def _store(self, name, key, digest, values, path):
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        outputs = {}
+        for output, value in values.items():
+            file_path = os.path.join(tmp_path, output)
+            if isinstance(value, pd.DataFrame):
+                write_columns(file_path, value)
+                outputs[output] = FRAME
+            elif isinstance(value, np.ndarray) and value.dtype != object:
+                np.save(file_path + '.npy', value)
+                outputs[output] = ARRAY
+            else:
+                joblib.dump(value, file_path + '.joblib')
+                outputs[output] = OBJECT
+        with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+            json.dump({'name': name, 'key': key, 'digest': digest, 'outputs': outputs}, f)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # Another run stored the same key first.
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def _load(self, name, key, path):
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+        values = {}
+        for output, kind in manifest['outputs'].items():
+            file_path = os.path.join(path, output)
+            if kind == FRAME:
+                values[output] = read_columns(file_path)[0]
+            elif kind == ARRAY:
+                values[output] = np.load(file_path + '.npy', mmap_mode='r')
+            else:
+                values[output] = joblib.load(file_path + '.joblib')
+        # Pruning keeps the most recently used entries.
+        os.utime(os.path.join(path, MANIFEST))
+        return StageResult(name, key, manifest['digest'], values, True)
+
+    def _prune(self, name):
+        entries = []
+        for entry in os.listdir(self.directory):
+            manifest = os.path.join(self.directory, entry, MANIFEST)
+            if entry.startswith(f"{name}-") and '.tmp-' not in entry and os.path.exists(manifest):
+                entries.append((os.path.getmtime(manifest), entry))
+        for _, entry in sorted(entries, reverse=True)[self.keep:]:
+            shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
@@ -0,0 +1,30 @@
+import os
+import sys
+import time
+
+from sklearn.model_selection import train_test_split
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.headline_labeler import LABEL_COLUMNS, HeadlineLabeler, load_labelled_headlines
+
+# Kept out of models/headline_labeler.py so the saved labeler is pickled
+# under its importable module name, not __main__.
+
+if __name__ == "__main__":
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    data = load_labelled_headlines(os.path.join(root, 'Data', 'sentiment.csv'))
+    train, test = train_test_split(data, test_size=0.2, random_state=42)
+
+    labeler = HeadlineLabeler().fit(train['News'], train)
+    start = time.perf_counter()
+    predicted = labeler.label(test['News'].tolist())
+    elapsed = time.perf_counter() - start
+    for column in LABEL_COLUMNS:
+        accuracy = (predicted[column].to_numpy() == test[column].to_numpy()).mean()
+        print(f"{column}: holdout accuracy {accuracy:.3f}")
+    print(f"Labelled {len(test)} headlines in {elapsed:.3f}s ({len(test) / elapsed:.0f}/s)")
+
+    labeler = HeadlineLabeler().fit(data['News'], data)
+    labeler.save(os.path.join(root, 'models', 'headline_labeler.pkl'))
+    print("Headline labeler saved to models/headline_labeler.pkl")
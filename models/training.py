@@ -0,0 +1,157 @@
+import itertools
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_absolute_error
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARAM_GRID = {
+    'n_estimators': [25, 50, 100, 200],
+    'max_depth': [None, 10, 20],
+    'min_samples_leaf': [1, 5],
+    'max_features': [1.0, 'sqrt'],
+}
+
+
+def rolling_origin_folds(n_samples, n_folds=5, test_size=None, min_train_size=None):
+    """(train_end, test_end) pairs: train on rows [0, train_end), test on [train_end, test_end).
+
+    Rows must be in time order. Each fold moves the forecast origin forward
+    by test_size rows, so no fold ever trains on data after its test window.
+    """
+    test_size = test_size or max(1, n_samples // (n_folds + 1))
+    first_train_end = min_train_size or n_samples - n_folds * test_size
+    if first_train_end < 1:
+        raise ValueError(f"Not enough rows ({n_samples}) for {n_folds} folds of {test_size}")
+    folds = []
+    for i in range(n_folds):
+        train_end = first_train_end + i * test_size
+        test_end = min(train_end + test_size, n_samples)
+        if train_end < test_end:
+            folds.append((train_end, test_end))
+    return folds
+
+
+class SharedArray:
+    """A NumPy array in POSIX shared memory that worker processes attach to by name."""
+
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        self._shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.array = np.ndarray(array.shape, dtype=array.dtype, buffer=self._shm.buf)
+        self.array[...] = array
+        self.descriptor = (self._shm.name, array.shape, array.dtype.str)
+
+    @staticmethod
+    def attach(descriptor):
+        name, shape, dtype = descriptor
+        shm = shared_memory.SharedMemory(name=name)
+        return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+    def close(self):
+        self.array = None
+        self._shm.close()
+        self._shm.unlink()
+
+
+_worker_data = {}
+
+
+def init_worker(X_descriptor, y_descriptor):
+    """ProcessPoolExecutor initializer attaching the shared X and y (SharedArray descriptors)."""
+    # Keep the SharedMemory handles referenced so the buffers stay mapped.
+    _worker_data['X'] = SharedArray.attach(X_descriptor)
+    _worker_data['y'] = SharedArray.attach(y_descriptor)
+
+
+def worker_arrays():
+    """(X, y) as attached by init_worker in this worker process."""
+    return _worker_data['X'][1], _worker_data['y'][1]
+
+
+def _fit_fold(params, n_estimators_grid, train_end, test_end, random_state):
+    X, y = worker_arrays()
+    X_train, y_train = X[:train_end], y[:train_end]
+    X_test, y_test = X[train_end:test_end], y[train_end:test_end]
+
+    # Grow the same forest through each n_estimators value instead of
+    # refitting from scratch.
+    model = RandomForestRegressor(warm_start=True, n_jobs=1, random_state=random_state, **params)
+    results = []
+    fit_seconds = 0.0
+    for n_estimators in sorted(n_estimators_grid):
+        model.set_params(n_estimators=n_estimators)
+        start = time.perf_counter()
+        model.fit(X_train, y_train)
+        fit_seconds += time.perf_counter() - start
+        mae = mean_absolute_error(y_test, model.predict(X_test))
+        results.append({'n_estimators': n_estimators, 'mae': mae, 'fit_seconds': fit_seconds})
+    return results
+
+
+def accuracy_frontier(results):
+    """Configurations for which nothing else is both faster and more accurate."""
+    frontier = []
+    best_mae = np.inf
+    for result in sorted(results, key=lambda r: (r['fit_seconds'], r['mae'])):
+        if result['mae'] < best_mae:
+            frontier.append(result)
+            best_mae = result['mae']
+    return frontier
+
+
+def grid_search(X, y, param_grid=None, n_folds=5, max_workers=None, random_state=42):
+    """Score every grid point on rolling-origin folds in a process pool.
+
+    X and y are copied once into shared memory; workers attach to them
+    rather than receiving a pickled copy per task. Returns all results
+    (averaged over folds) sorted by MAE, the best parameters and the
+    wall-clock/MAE frontier.
+    """
+    param_grid = dict(param_grid or DEFAULT_PARAM_GRID)
+    n_estimators_grid = param_grid.pop('n_estimators', [100])
+    keys = sorted(param_grid)
+    combos = [dict(zip(keys, values)) for values in itertools.product(*(param_grid[k] for k in keys))]
+    folds = rolling_origin_folds(len(X), n_folds)
+    max_workers = max_workers or os.cpu_count()
+
+    logger.info(f"Grid search: {len(combos)} parameter sets x {len(n_estimators_grid)} forest sizes "
+                f"x {len(folds)} folds on {max_workers} workers")
+
+    X_shared = SharedArray(np.asarray(X, dtype=np.float64))
+    y_shared = SharedArray(np.asarray(y, dtype=np.float64))
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                                 initargs=(X_shared.descriptor, y_shared.descriptor)) as pool:
+            futures = {
+                (i, fold): pool.submit(_fit_fold, params, n_estimators_grid, train_end, test_end, random_state)
+                for i, params in enumerate(combos)
+                for fold, (train_end, test_end) in enumerate(folds)
+            }
+            fold_results = {key: future.result() for key, future in futures.items()}
+    finally:
+        X_shared.close()
+        y_shared.close()
+
+    results = []
+    for i, params in enumerate(combos):
+        for stage in range(len(n_estimators_grid)):
+            stages = [fold_results[(i, fold)][stage] for fold in range(len(folds))]
+            results.append(dict(
+                params,
+                n_estimators=stages[0]['n_estimators'],
+                mae=float(np.mean([s['mae'] for s in stages])),
+                fit_seconds=float(np.mean([s['fit_seconds'] for s in stages])),
+            ))
+    results.sort(key=lambda r: r['mae'])
+
+    best = results[0]
+    best_params = {k: best[k] for k in keys + ['n_estimators']}
+    logger.info(f"Best parameters: {best_params} (MAE {best['mae']:.4f})")
+    return {'results': results, 'best_params': best_params, 'frontier': accuracy_frontier(results)}